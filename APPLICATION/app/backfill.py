@@ -0,0 +1,391 @@
+# APPLICATION/app/backfill.py
+"""
+Пакетное распознавание архива панорам без сервисов (дообработка архива).
+
+Обходит дерево каталогов и распознаёт каждую панораму в пуле процессов.
+Каждый процесс один раз загружает модель и держит её до конца прогона.
+Нарезка, шовный доинференс и слияние детекций — те же, что в
+/api/predict (app.pipeline.detect_panorama): вместо ML-сервиса модель
+вызывается в том же процессе (LocalClient).
+
+Результаты пишутся группами по --commit-size панорам:
+  * --db — в таблицы images/detected (DATABASE_URL), одной транзакцией
+    на группу, как POST /api/predict/batch;
+  * --parquet КАТАЛОГ — part-NNNNN.parquet на группу в подкаталогах
+    detections/ (строка на дефект) и panoramas/ (строка на панораму).
+
+После записи группы её файлы добавляются в журнал --checkpoint (JSONL).
+Прерванный прогон, запущенный снова, пропускает файлы из журнала.
+Повторно может записаться не больше одной группы, попавшей в БД или в
+Parquet, но не в журнал. Панорамы с ошибкой тоже попадают в журнал;
+--retry-failed распознаёт их снова.
+
+Раз в --report-every секунд и в конце печатается пропускная способность:
+панорамы и тайлы в секунду, прогноз до конца.
+
+Запуск из каталога APPLICATION:
+    python -m app.backfill /data/films --db
+    python -m app.backfill /data/films --parquet /data/films-detections --jobs 4
+    DETECTOR_BACKEND=stub python -m app.backfill /data/films --parquet /tmp/out
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import cv2
+
+from app.pipeline import Region, detect_panorama, group_by_tile
+from common.formats import IMAGE_SUFFIXES
+from common.tiling import TilePlan, plan_for_image
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(__file__)
+
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "yolo").lower()
+MODEL_PATH       = os.getenv("MODEL_PATH", os.path.join(HERE, "weights/best.pt"))
+
+
+# -----------------------------------------------------------------------------
+# Воркер пула: модель загружается один раз на процесс
+# -----------------------------------------------------------------------------
+_detector = None
+
+
+def _load_detector(backend: str, model_path: str, threads: int):
+    """Детектор с теми же настройками, что у ML-сервиса (гейт — по GATE_WEIGHTS)."""
+    if backend == "stub":
+        from predict_service.stub_detector import StubDetector
+
+        return StubDetector(
+            latency=float(os.getenv("STUB_LATENCY_MS", "0")) / 1000,
+            boxes=int(os.getenv("STUB_BOXES", "2")),
+        )
+
+    import torch
+    from predict_service.deffect_detector import DefectDetector
+
+    # Без предела каждый процесс пула займёт все ядра
+    torch.set_num_threads(threads)
+    gate = None
+    gate_path = os.getenv("GATE_WEIGHTS")
+    if gate_path and os.path.exists(gate_path):
+        from predict_service.cascade_gate import CascadeGate
+
+        gate_threshold = os.getenv("GATE_THRESHOLD")
+        gate = CascadeGate(gate_path, threshold=float(gate_threshold) if gate_threshold else None)
+    return DefectDetector(model_path, gate=gate)
+
+
+def _init_worker(backend: str, model_path: str, threads: int) -> None:
+    global _detector
+    _detector = _load_detector(backend, model_path, threads)
+
+
+class LocalClient:
+    """
+    Замена MLClient для detect_panorama: участки распознаются моделью
+    этого процесса, без HTTP и очереди ML-сервиса.
+    """
+
+    def __init__(self, detector):
+        self.detector = detector
+
+    async def detect_many(self, regions: list[Region], plan: TilePlan) -> list[dict]:
+        detections = []
+        for region, index, offset in regions:
+            result = self.detector.predict(region, panorama_size=(plan.width, plan.height), index=index, offset=offset)
+            detections.extend(result["detections"])
+        return detections
+
+
+def _process(path: str) -> dict:
+    """
+    Распознать одну панораму в процессе пула.
+
+    Returns:
+        dict: path, seconds и либо width, height, tiles, detections
+            (слитые, в координатах панорамы) и results (по тайлам,
+            в формате ответа API), либо error.
+    """
+    start = time.perf_counter()
+    try:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Не удалось прочитать изображение")
+        plan = plan_for_image(img)
+        detections = asyncio.run(detect_panorama(LocalClient(_detector), img, plan))
+    except Exception as e:
+        return {"path": path, "error": f"{type(e).__name__}: {e}", "seconds": time.perf_counter() - start}
+    return {
+        "path": path,
+        "width": plan.width,
+        "height": plan.height,
+        "tiles": plan.count,
+        "detections": detections,
+        "results": group_by_tile(detections, plan),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Журнал прогресса
+# -----------------------------------------------------------------------------
+class Checkpoint:
+    """
+    Журнал обработанных файлов: строка JSON на файл (path, status и
+    predict_id, part или error). Строки дописываются после записи группы
+    и сбрасываются на диск, поэтому журнал переживает kill.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done: dict[str, dict] = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # строка, оборванная при kill
+                    self.done[entry["path"]] = entry
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def skip(self, path: str, retry_failed: bool) -> bool:
+        entry = self.done.get(path)
+        return entry is not None and not (retry_failed and entry["status"] == "failed")
+
+    def record(self, entries: Iterable[dict]) -> None:
+        for entry in entries:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.done[entry["path"]] = entry
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# -----------------------------------------------------------------------------
+# Запись результатов
+# -----------------------------------------------------------------------------
+class DatabaseSink:
+    """Группа панорам — одна транзакция в images/detected (app.batch.save_panoramas)."""
+
+    def __init__(self):
+        from app.database import ensure_schema
+
+        ensure_schema()
+
+    def write(self, group: list[dict]) -> list[dict]:
+        from app.batch import save_panoramas
+
+        panoramas = []
+        for p in group:
+            name = Path(p["rel"]).as_posix()[-255:]
+            panoramas.append({
+                "filename": name,
+                "content": Path(p["path"]).read_bytes(),
+                "content_type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+                "results": p["results"],
+            })
+        ids = save_panoramas(panoramas)
+        return [{"path": p["rel"], "status": "saved", "predict_id": i} for p, i in zip(group, ids)]
+
+
+class ParquetSink:
+    """Группа панорам — part-NNNNN.parquet в detections/ и panoramas/."""
+
+    def __init__(self, out: Path):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit("Для --parquet нужен пакет pyarrow")
+        self.detections = out / "detections"
+        self.panoramas = out / "panoramas"
+        self.detections.mkdir(parents=True, exist_ok=True)
+        self.panoramas.mkdir(parents=True, exist_ok=True)
+        # Продолжение прерванного прогона: номера частей не перезаписываются
+        self.part = max((int(p.stem.split("-")[1]) + 1 for p in self.panoramas.glob("part-*.parquet")), default=0)
+
+    def write(self, group: list[dict]) -> list[dict]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        name = f"part-{self.part:05d}"
+        rows = [
+            {
+                "path": p["rel"],
+                "index": d["index"],
+                "class": d["class"],
+                "confidence": float(d["confidence"]),
+                "x1": d["box"][0], "y1": d["box"][1], "x2": d["box"][2], "y2": d["box"][3],
+                "length": d["length"],
+            }
+            for p in group for d in p["detections"]
+        ]
+        detections_schema = pa.schema([
+            ("path", pa.string()), ("index", pa.int32()), ("class", pa.string()),
+            ("confidence", pa.float32()), ("x1", pa.int32()), ("y1", pa.int32()),
+            ("x2", pa.int32()), ("y2", pa.int32()), ("length", pa.int32()),
+        ])
+        pq.write_table(pa.Table.from_pylist(rows, schema=detections_schema), self.detections / f"{name}.parquet")
+        pq.write_table(pa.Table.from_pylist([
+            {
+                "path": p["rel"], "width": p["width"], "height": p["height"], "tiles": p["tiles"],
+                "defects": len(p["detections"]), "seconds": p["seconds"],
+            }
+            for p in group
+        ]), self.panoramas / f"{name}.parquet")
+        self.part += 1
+        return [{"path": p["rel"], "status": "saved", "part": name} for p in group]
+
+
+# -----------------------------------------------------------------------------
+# Прогон
+# -----------------------------------------------------------------------------
+def find_images(root: Path) -> Iterator[Path]:
+    """Изображения в дереве root в стабильном порядке."""
+    for path in sorted(root.rglob("*")):
+        if path.suffix.lower() in IMAGE_SUFFIXES and path.is_file() and not path.name.startswith("."):
+            yield path
+
+
+class Throughput:
+    """Счётчики прогона и строка прогресса."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.panoramas = 0
+        self.failed = 0
+        self.tiles = 0
+        self.defects = 0
+        self.busy = 0.0
+        self.start = time.perf_counter()
+
+    def add(self, result: dict) -> None:
+        self.panoramas += 1
+        self.busy += result["seconds"]
+        if "error" in result:
+            self.failed += 1
+        else:
+            self.tiles += result["tiles"]
+            self.defects += len(result["detections"])
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        rate = self.panoramas / elapsed if elapsed else 0.0
+        eta = (self.total - self.panoramas) / rate if rate else float("inf")
+        return (
+            f"{self.panoramas}/{self.total} панорам ({self.failed} с ошибкой), "
+            f"{rate:.2f} пан/с, {self.tiles / elapsed if elapsed else 0:.1f} тайл/с, "
+            f"{self.busy / max(1, self.panoramas):.2f} с на панораму, "
+            f"осталось ~{eta:.0f} с"
+        )
+
+
+def run(args: argparse.Namespace) -> Throughput:
+    root = Path(args.root).resolve()
+    checkpoint = Checkpoint(Path(args.checkpoint) if args.checkpoint else root / ".backfill.jsonl")
+    todo = [
+        p for p in find_images(root)
+        if not checkpoint.skip(p.relative_to(root).as_posix(), args.retry_failed)
+    ]
+    if args.limit:
+        todo = todo[:args.limit]
+    skipped = len(checkpoint.done)
+    logger.info("К обработке %d панорам (в журнале уже %d)", len(todo), skipped)
+
+    sink = ParquetSink(Path(args.parquet)) if args.parquet else DatabaseSink()
+    stats = Throughput(len(todo))
+    group: list[dict] = []
+    failed: list[dict] = []
+
+    def flush() -> None:
+        entries = sink.write(group) if group else []
+        checkpoint.record(entries + failed)
+        group.clear()
+        failed.clear()
+
+    threads = max(1, (os.cpu_count() or 1) // args.jobs)
+    pool = ProcessPoolExecutor(
+        args.jobs,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.backend, args.weights, threads),
+    )
+    paths = iter(todo)
+    pending: set[Future] = set()
+    last_report = time.perf_counter()
+    try:
+        while True:
+            # Окно задач: в пуле не больше двух панорам на процесс
+            for path in paths:
+                pending.add(pool.submit(_process, str(path)))
+                if len(pending) >= 2 * args.jobs:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                result["rel"] = Path(result["path"]).relative_to(root).as_posix()
+                stats.add(result)
+                if "error" in result:
+                    logger.warning("%s: %s", result["rel"], result["error"])
+                    failed.append({"path": result["rel"], "status": "failed", "error": result["error"]})
+                else:
+                    group.append(result)
+            if len(group) >= args.commit_size:
+                flush()
+            if time.perf_counter() - last_report >= args.report_every:
+                logger.info(stats.line())
+                last_report = time.perf_counter()
+        flush()
+    finally:
+        # Ctrl-C: незаписанная группа теряется, журнал её не содержит
+        pool.shutdown(wait=False, cancel_futures=True)
+        checkpoint.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="Каталог с панорамами (обходится рекурсивно)")
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument("--db", action="store_true", help="Писать в images/detected (DATABASE_URL)")
+    out.add_argument("--parquet", default="", help="Каталог для Parquet")
+    parser.add_argument("--checkpoint", default="", help="Журнал прогресса (по умолчанию ROOT/.backfill.jsonl)")
+    parser.add_argument("--retry-failed", action="store_true", help="Повторить панорамы, упавшие в прошлых прогонах")
+    parser.add_argument("--jobs", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Процессов с моделью")
+    parser.add_argument("--commit-size", type=int, default=16, help="Панорам в группе записи")
+    parser.add_argument("--backend", default=DETECTOR_BACKEND, choices=("yolo", "stub"))
+    parser.add_argument("--weights", default=MODEL_PATH, help="Веса детектора")
+    parser.add_argument("--limit", type=int, default=0, help="Не больше N панорам за прогон")
+    parser.add_argument("--report-every", type=float, default=30, help="Период строки прогресса, с")
+    args = parser.parse_args()
+    args.jobs = max(1, args.jobs)
+    args.commit_size = max(1, args.commit_size)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    stats = run(args)
+    logger.info("Готово: %s", stats.line())
+    logger.info("Тайлов %d, дефектов %d", stats.tiles, stats.defects)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+# APPLICATION/app/batch.py
+"""
+Пакетная загрузка серии панорам (POST /api/predict/batch).
+
+Файлы — изображения и/или ZIP-архивы с ними. Панорамы идут по конвейеру
+(чтение → декодирование → нарезка → ML-сервис) окном по BATCH_WINDOW
+штук: пока одна распознаётся, следующая уже декодируется, и очередь
+ML-сервиса не пустеет между панорамами. Каждая панорама занимает место
+в контроле допуска, как обычная загрузка.
+
+Результаты пишутся в БД группами по BATCH_COMMIT_SIZE панорам одной
+транзакцией; байты загрузки держатся только до записи своей группы.
+По всей серии строится один сводный отчёт (create_series_report).
+
+Ответ — поток NDJSON, строка на событие:
+
+    {"event": "accepted", "batch_id": ..., "panoramas": [имена]}
+    {"event": "started",  "index": 0, "filename": ...}
+    {"event": "detected", "index": 0, "filename": ..., "defects": 3, "results": [...]}
+    {"event": "saved",    "index": 0, "filename": ..., "predict_id": 17}
+    {"event": "failed",   "index": 1, "filename": ..., "error": ...}
+    {"event": "done",     "report_url": ..., "succeeded": N, "failed": M}
+
+Если группу не удалось записать в БД, её панорамы после detected получают
+failed, а серия продолжается.
+
+Память: BATCH_WINDOW панорам в работе (оценка на панораму — в
+app/pipeline.py) плюс байты загрузки не больше BATCH_COMMIT_SIZE
+распознанных, но ещё не записанных панорам.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import uuid
+import zipfile
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+import cv2
+import httpx
+import numpy as np
+from fastapi import HTTPException, UploadFile, status
+
+from app.database import Sessionlocal
+from app.models import Detections, Images
+from app.pipeline import ML_TIMEOUT, MLClient, detect_panorama, group_by_tile, share_panorama
+from app.utils import create_series_report
+from common import executors
+from common.admission import AdmissionController, Overloaded, Permit
+from common.deadline import Deadline
+from common.formats import IMAGE_SUFFIXES
+from common.metrics import timed
+from common.tiling import plan_for_image
+from common.tracing import span
+
+logger = logging.getLogger(__name__)
+
+BATCH_WINDOW         = max(1, int(os.getenv("BATCH_WINDOW", "2")))         # панорам в конвейере
+BATCH_COMMIT_SIZE    = max(1, int(os.getenv("BATCH_COMMIT_SIZE", "8")))    # панорам в транзакции
+BATCH_MAX_PANORAMAS  = int(os.getenv("BATCH_MAX_PANORAMAS", "200"))
+
+
+class SeriesItem:
+    """Панорама серии: имя, тип и чтение байтов (только когда до неё дошла очередь)."""
+
+    __slots__ = ("filename", "content_type", "read")
+
+    def __init__(self, filename: str, content_type: str, read: Callable[[], bytes]):
+        self.filename = filename
+        self.content_type = content_type
+        self.read = read
+
+
+class Series:
+    """
+    Загруженная серия: файлы скопированы во временный каталог, потому что
+    FastAPI закрывает UploadFile раньше, чем отдан потоковый ответ.
+    """
+
+    def __init__(self, root: Path):
+        self.id = uuid.uuid4().hex[:12]
+        self.dir = root / f"batch_{self.id}"
+        self.dir.mkdir(parents=True)
+        self.items: list[SeriesItem] = []
+        self._archives: list[zipfile.ZipFile] = []
+
+    def add_file(self, path: Path, filename: str, content_type: str | None) -> None:
+        if zipfile.is_zipfile(path):
+            archive = zipfile.ZipFile(path)
+            self._archives.append(archive)
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                name = Path(info.filename).name
+                if info.is_dir() or name.startswith(".") or Path(name).suffix.lower() not in IMAGE_SUFFIXES:
+                    continue
+                self.items.append(SeriesItem(
+                    name,
+                    mimetypes.guess_type(name)[0] or "application/octet-stream",
+                    lambda archive=archive, info=info: archive.read(info),
+                ))
+        elif (content_type or "").startswith("image/") or path.suffix.lower() in IMAGE_SUFFIXES:
+            self.items.append(SeriesItem(
+                filename, content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                path.read_bytes,
+            ))
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{filename}: нужен файл изображения или ZIP-архив с изображениями"
+            )
+
+    def close(self) -> None:
+        """Закрыть архивы и удалить каталог; повторный вызов ничего не делает."""
+        for archive in self._archives:
+            archive.close()
+        self._archives.clear()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def _spool(source, path: Path) -> None:
+    source.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(source, out, 1024 * 1024)
+
+
+async def accept_series(files: list[UploadFile], root: Path) -> Series:
+    """
+    Скопировать загруженные файлы во временный каталог и составить список
+    панорам (ZIP-архивы раскрываются).
+
+    Raises:
+        HTTPException: 422 — не изображение и не архив или панорам нет,
+            413 — панорам больше BATCH_MAX_PANORAMAS.
+    """
+    series = Series(root)
+    try:
+        for k, file in enumerate(files):
+            name = Path(file.filename or f"file{k}").name
+            path = series.dir / f"{k:04d}_{name}"
+            with timed("read_upload"):
+                await executors.run("read_upload", _spool, file.file, path)
+            series.add_file(path, name, file.content_type)
+        if not series.items:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="В загрузке нет изображений")
+        if len(series.items) > BATCH_MAX_PANORAMAS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Панорам в серии больше {BATCH_MAX_PANORAMAS}"
+            )
+    except BaseException:
+        series.close()
+        raise
+    return series
+
+
+async def _admit(controller: AdmissionController, deadline: Deadline) -> Permit:
+    """Место в контроле допуска; серия не отказывает при перегрузке, а ждёт Retry-After."""
+    while True:
+        try:
+            return await controller.acquire_until(deadline)
+        except Overloaded as e:
+            if deadline.remaining() <= e.retry_after:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+
+async def detect_upload(content: bytes, http: httpx.AsyncClient, deadline: Deadline | None) -> list[dict]:
+    """
+    Распознать загруженную панораму (байты файла) через ML-сервис; место
+    в контроле допуска уже занято вызывающим.
+
+    Returns:
+        list[dict]: Результаты по тайлам в формате ответа API.
+    """
+    shared = None
+    try:
+        with timed("decode"), span("decode", upload_bytes=len(content)):
+            img = await executors.run(
+                "decode", cv2.imdecode, np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR
+            )
+        if img is None:
+            raise ValueError("Не удалось прочитать изображение")
+        plan = plan_for_image(img)
+
+        with timed("share"):
+            shared = await executors.run("share", share_panorama, img)
+        if shared is not None:
+            img = shared.array
+
+        client = MLClient(http, shared, deadline)
+        with timed("ml_full"), span("ml_full"):
+            detections = await detect_panorama(client, img, plan)
+        return group_by_tile(detections, plan)
+    finally:
+        if shared is not None:
+            shared.close()
+
+
+async def _detect(
+    item: SeriesItem,
+    http: httpx.AsyncClient,
+    controller: AdmissionController,
+    deadline: Deadline
+) -> tuple[bytes, list[dict]]:
+    """Распознать одну панораму серии; возвращает байты загрузки и результаты по тайлам."""
+    permit = await _admit(controller, deadline)
+    try:
+        with timed("read_upload"):
+            content = await executors.run("read_upload", item.read)
+        return content, await detect_upload(content, http, deadline)
+    finally:
+        permit.release()
+
+
+def save_panoramas(group: list[dict]) -> list[int]:
+    """Записать группу распознанных панорам одной транзакцией; вернуть predict_id."""
+    with timed("db_commit"), Sessionlocal() as db:
+        images = [
+            Images(
+                filename=p["filename"],
+                data=p["content"],
+                content_type=p["content_type"],
+                expansion=Path(p["filename"]).suffix or ".bin",
+            )
+            for p in group
+        ]
+        db.add_all(images)
+        db.flush()
+        predictions = [
+            Detections(
+                is_success=any(r["status"] == "success" for r in p["results"]),
+                defects=p["results"],
+                image_id=image.id,
+                stage="full",
+            )
+            for p, image in zip(group, images)
+        ]
+        db.add_all(predictions)
+        db.flush()
+        ids = [prediction.predict_id for prediction in predictions]
+        db.commit()
+    return ids
+
+
+def _line(event: dict) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode()
+
+
+async def run_series(
+    series: Series,
+    controller: AdmissionController,
+    deadline_seconds: float,
+    reports: Path
+) -> AsyncIterator[bytes]:
+    """
+    Поток событий NDJSON по серии (формат — в docstring модуля). Если клиент
+    отключился, незавершённые панорамы отменяются; уже записанные
+    группы остаются в БД.
+    """
+    items = series.items
+    events: asyncio.Queue[dict | None] = asyncio.Queue()
+    queue = iter(enumerate(items))
+    summary: list[dict] = [{"filename": item.filename, "status": "queued"} for item in items]
+
+    async def worker(http: httpx.AsyncClient) -> None:
+        # Общий итератор: каждый воркер берёт следующую панораму серии
+        for index, item in queue:
+            events.put_nowait({"event": "started", "index": index, "filename": item.filename})
+            try:
+                with span("batch_panorama", index=index, filename=item.filename):
+                    content, results = await _detect(item, http, controller, Deadline(deadline_seconds))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Панорама %s серии %s не обработана: %s", item.filename, series.id, e)
+                events.put_nowait({"event": "failed", "index": index, "filename": item.filename, "error": str(e)})
+                continue
+            events.put_nowait({
+                "event": "detected", "index": index, "filename": item.filename,
+                "defects": sum(len(r["defects"]) for r in results), "results": results,
+                "content": content, "content_type": item.content_type,
+            })
+
+    async def save(group: list[dict]) -> list[bytes]:
+        # Сбой записи группы не обрывает поток: её панорамы помечаются failed
+        try:
+            ids = await executors.run("db_commit", save_panoramas, group)
+        except Exception as e:
+            logger.exception("Группа из %d панорам серии %s не записана в БД", len(group), series.id)
+            lines = []
+            for p in group:
+                summary[p["index"]] = {"filename": p["filename"], "status": "failed", "error": f"Ошибка записи в БД: {e}"}
+                lines.append(_line({"event": "failed", "index": p["index"], "filename": p["filename"],
+                                    "error": summary[p["index"]]["error"]}))
+            group.clear()
+            return lines
+        lines = []
+        for p, predict_id in zip(group, ids):
+            summary[p["index"]]["predict_id"] = predict_id
+            lines.append(_line({"event": "saved", "index": p["index"], "filename": p["filename"], "predict_id": predict_id}))
+        group.clear()
+        return lines
+
+    async with httpx.AsyncClient(timeout=ML_TIMEOUT) as http:
+        workers = [asyncio.create_task(worker(http)) for _ in range(min(BATCH_WINDOW, len(items)))]
+        finished = asyncio.gather(*workers)
+        finished.add_done_callback(lambda _: events.put_nowait(None))
+        group: list[dict] = []
+        try:
+            yield _line({"event": "accepted", "batch_id": series.id, "panoramas": [i.filename for i in items]})
+            while (event := await events.get()) is not None:
+                index = event["index"]
+                if event["event"] == "failed":
+                    summary[index].update(status="failed", error=event["error"])
+                elif event["event"] == "detected":
+                    summary[index].update(status="success", results=event["results"])
+                    group.append(event)
+                yield _line({k: v for k, v in event.items() if k not in ("content", "content_type")})
+                if len(group) >= BATCH_COMMIT_SIZE:
+                    for line in await save(group):
+                        yield line
+            await finished  # ошибки воркеров (кроме панорам) — наружу
+            if group:
+                for line in await save(group):
+                    yield line
+
+            report = reports / f"series_{series.id}.docx"
+            with timed("report"), span("report", panoramas=len(items)):
+                await executors.run("report", create_series_report, summary, output_filename=str(report))
+            failed = sum(1 for p in summary if p["status"] == "failed")
+            yield _line({
+                "event": "done", "batch_id": series.id,
+                "report_url": f"/static/reports/{report.name}",
+                "succeeded": len(items) - failed, "failed": failed,
+            })
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            series.close()
@@ -0,0 +1,300 @@
+# APPLICATION/app/ingest.py
+"""
+Приём панорам из папки сканера (INGEST_DIR).
+
+Оцифровщик плёнок складывает панорамы в сетевую папку. Фронтенд сам
+забирает их оттуда, без ручной загрузки через index.html.
+
+  * Изменения в папке отслеживаются через inotify (пакет watchfiles).
+    Кроме того, папка пересканируется раз в INGEST_POLL_SECONDS: на
+    сетевых дисках inotify событий не присылает. Без watchfiles работает
+    только опрос.
+  * Файл берётся в работу, когда его размер и время изменения не
+    менялись INGEST_SETTLE_SECONDS: сканер дописал его до конца. Скрытые
+    файлы и файлы с расширением не из IMAGE_SUFFIXES (.part, .tmp)
+    пропускаются.
+  * Распознавание — тот же конвейер, что у POST /api/predict/batch
+    (app.batch.detect_upload), не больше INGEST_CONCURRENCY панорам
+    сразу. Место в контроле допуска панорам берётся фоновым
+    (acquire_background): пока есть ожидающие интерактивные загрузки,
+    новые панорамы из папки ждут.
+  * Результат пишется в images/detected. После этого файл переносится в
+    INGEST_DONE_DIR (с ошибкой — в INGEST_FAILED_DIR) или, при
+    INGEST_MODE=mark, остаётся на месте с меткой <имя>.done или
+    <имя>.failed (JSON с predict_id или ошибкой). В режиме move метка
+    .done тоже пишется, до переноса, и удаляется после него: если перенос
+    не удался, сохранённый файл не распознаётся повторно. В failed
+    попадают только файлы с ошибкой распознавания или сохранения.
+
+Файл, который не успели обработать до остановки, после перезапуска
+распознаётся заново. Папку должен обслуживать один процесс фронтенда.
+
+Метрики: weld_ingest_lag_seconds (от записи файла до сохранения),
+weld_ingest_files_total{outcome} (пропускная способность — rate) и
+weld_ingest_pending{state}.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import time
+from pathlib import Path
+
+import httpx
+
+from app.batch import detect_upload, save_panoramas
+from app.pipeline import ML_TIMEOUT
+from common import executors
+from common.admission import AdmissionController
+from common.deadline import Deadline
+from common.formats import IMAGE_SUFFIXES
+from common.metrics import INGEST_FILES, INGEST_LAG_SECONDS, timed
+from common.tracing import span
+
+logger = logging.getLogger(__name__)
+
+INGEST_DIR             = os.getenv("INGEST_DIR", "")
+INGEST_MODE            = os.getenv("INGEST_MODE", "move").lower()        # move или mark
+INGEST_DONE_DIR        = os.getenv("INGEST_DONE_DIR", "")                # по умолчанию INGEST_DIR/processed
+INGEST_FAILED_DIR      = os.getenv("INGEST_FAILED_DIR", "")              # по умолчанию INGEST_DIR/failed
+INGEST_CONCURRENCY     = max(1, int(os.getenv("INGEST_CONCURRENCY", "1")))
+INGEST_SETTLE_SECONDS  = float(os.getenv("INGEST_SETTLE_SECONDS", "10"))
+INGEST_POLL_SECONDS    = float(os.getenv("INGEST_POLL_SECONDS", "15"))
+INGEST_DEADLINE        = float(os.getenv("INGEST_DEADLINE", "600"))
+
+
+class IngestWatcher:
+    """
+    Наблюдатель за папкой сканера: находит дописанные файлы и
+    распознаёт их воркерами по INGEST_CONCURRENCY.
+
+    Args:
+        root: Папка сканера.
+        controller: Контроль допуска панорам фронтенда.
+        mode: move — переносить обработанные файлы, mark — класть метку рядом.
+        done_dir, failed_dir: Куда переносить файлы в режиме move.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        controller: AdmissionController,
+        mode: str = INGEST_MODE,
+        done_dir: Path | None = None,
+        failed_dir: Path | None = None,
+    ):
+        self.root = root
+        self.controller = controller
+        self.mode = mode
+        self.done_dir = done_dir or root / "processed"
+        self.failed_dir = failed_dir or root / "failed"
+        # Файл -> (размер, mtime) и время, с которого они не меняются
+        self._seen: dict[Path, tuple[tuple[int, float], float]] = {}
+        self._queue: asyncio.Queue[Path] = asyncio.Queue()
+        self._claimed: set[Path] = set()     # в очереди или в обработке
+        self._accepted: set[Path] = set()    # сохранены, но не перенесены и не отмечены
+        self._processing = 0
+        self._changed = asyncio.Event()
+        self.saved = 0
+        self.failed = 0
+
+    # -------------------------------------------------------------------------
+    # Поиск дописанных файлов
+    # -------------------------------------------------------------------------
+    def _skip(self, path: Path) -> bool:
+        if path.name.startswith(".") or path.suffix.lower() not in IMAGE_SUFFIXES:
+            return True
+        if path in self._accepted or path.with_name(path.name + ".done").exists():
+            return True
+        return self.mode == "mark" and path.with_name(path.name + ".failed").exists()
+
+    def _scan(self) -> list[Path]:
+        """Файлы верхнего уровня папки, которые уже не меняются INGEST_SETTLE_SECONDS."""
+        now = time.monotonic()
+        present = set()
+        ready = []
+        for path in sorted(self.root.iterdir()):
+            if path in self._claimed or not path.is_file() or self._skip(path):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            present.add(path)
+            signature = (st.st_size, st.st_mtime)
+            previous = self._seen.get(path)
+            if previous is None or previous[0] != signature or st.st_size == 0:
+                self._seen[path] = (signature, now)
+            elif now - previous[1] >= INGEST_SETTLE_SECONDS:
+                ready.append(path)
+        # Файлы, исчезнувшие до обработки, забываем
+        for path in self._seen.keys() - present:
+            del self._seen[path]
+        return ready
+
+    def _next_check(self) -> float:
+        """Через сколько секунд пересканировать папку."""
+        if not self._seen:
+            return INGEST_POLL_SECONDS
+        now = time.monotonic()
+        soonest = min(since + INGEST_SETTLE_SECONDS - now for _, since in self._seen.values())
+        return max(0.5, min(INGEST_POLL_SECONDS, soonest))
+
+    async def _notify(self) -> None:
+        """События inotify будят сканирование раньше очередного опроса."""
+        try:
+            from watchfiles import awatch
+        except ImportError:
+            logger.info("watchfiles не установлен, папка %s только опрашивается", self.root)
+            return
+        try:
+            async for _ in awatch(self.root, recursive=False):
+                self._changed.set()
+        except Exception:
+            logger.warning("inotify для %s недоступен, остаётся опрос", self.root, exc_info=True)
+
+    async def _watch(self) -> None:
+        while True:
+            for path in await executors.run("ingest_scan", self._scan):
+                del self._seen[path]
+                self._claimed.add(path)
+                self._queue.put_nowait(path)
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=self._next_check())
+            except asyncio.TimeoutError:
+                pass
+
+    # -------------------------------------------------------------------------
+    # Обработка
+    # -------------------------------------------------------------------------
+    async def _ingest(self, path: Path, http: httpx.AsyncClient) -> int:
+        """Распознать и сохранить файл; вернуть predict_id."""
+        written = path.stat().st_mtime
+        permit = await self.controller.acquire_background()
+        try:
+            with span("ingest", filename=path.name):
+                with timed("read_upload"):
+                    content = await executors.run("read_upload", path.read_bytes)
+                results = await detect_upload(content, http, Deadline(INGEST_DEADLINE))
+        finally:
+            permit.release()
+        ids = await executors.run("db_commit", save_panoramas, [{
+            "filename": path.name,
+            "content": content,
+            "content_type": mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+            "results": results,
+        }])
+        INGEST_LAG_SECONDS.observe(max(0.0, time.time() - written))
+        return ids[0]
+
+    def _done(self, path: Path, predict_id: int) -> None:
+        """
+        Отметить сохранённый файл. Метка .done пишется до переноса: если
+        перенос не удастся, повторное сканирование файл пропустит.
+        """
+        mark = path.with_name(path.name + ".done")
+        mark.write_text(json.dumps({"predict_id": predict_id}, ensure_ascii=False), encoding="utf-8")
+        if self.mode == "mark":
+            return
+        self._move(path, self.done_dir)
+        mark.unlink()
+
+    def _fail(self, path: Path, error: str) -> None:
+        """Отметить файл, который не удалось распознать или сохранить."""
+        if self.mode == "mark":
+            path.with_name(path.name + ".failed").write_text(
+                json.dumps({"error": error}, ensure_ascii=False), encoding="utf-8"
+            )
+            return
+        self._move(path, self.failed_dir)
+
+    @staticmethod
+    def _move(path: Path, target: Path) -> None:
+        target.mkdir(parents=True, exist_ok=True)
+        destination = target / path.name
+        if destination.exists():
+            destination = target / f"{path.stem}_{int(time.time())}{path.suffix}"
+        shutil.move(path, destination)
+
+    async def _worker(self, http: httpx.AsyncClient) -> None:
+        while True:
+            path = await self._queue.get()
+            self._processing += 1
+            try:
+                await self._handle(path, http)
+            finally:
+                self._processing -= 1
+                self._claimed.discard(path)
+
+    async def _handle(self, path: Path, http: httpx.AsyncClient) -> None:
+        # В failed попадают только ошибки распознавания и сохранения
+        try:
+            predict_id = await self._ingest(path, http)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            INGEST_FILES.labels("failed").inc()
+            logger.warning("Файл %s из папки сканера не обработан: %s", path.name, e)
+            try:
+                await executors.run("ingest_mark", self._fail, path, str(e))
+            except OSError:
+                logger.exception("Не удалось отметить %s", path)
+            return
+
+        self.saved += 1
+        INGEST_FILES.labels("saved").inc()
+        logger.info("Принят %s из папки сканера: predict_id=%s", path.name, predict_id)
+        try:
+            await executors.run("ingest_mark", self._done, path, predict_id)
+        except Exception:
+            # Файл уже в БД: до перезапуска не берём его повторно, даже если
+            # не удалось записать и метку
+            self._accepted.add(path)
+            logger.exception("Файл %s сохранён (predict_id=%s), но не перенесён", path.name, predict_id)
+
+    async def run(self) -> None:
+        """Работать до отмены задачи (остановка сервера)."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        logger.info("Приём панорам из %s (%s), воркеров %d", self.root, self.mode, INGEST_CONCURRENCY)
+        async with httpx.AsyncClient(timeout=ML_TIMEOUT) as http:
+            tasks = [
+                asyncio.create_task(self._notify()),
+                asyncio.create_task(self._watch()),
+                *(asyncio.create_task(self._worker(http)) for _ in range(INGEST_CONCURRENCY)),
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "dir": str(self.root),
+            "mode": self.mode,
+            "settling": len(self._seen),
+            "queued": self._queue.qsize(),
+            "processing": self._processing,
+            "saved": self.saved,
+            "failed": self.failed,
+        }
+
+
+def from_env(controller: AdmissionController) -> IngestWatcher | None:
+    """Наблюдатель по INGEST_*; None, если INGEST_DIR не задан."""
+    if not INGEST_DIR:
+        return None
+    return IngestWatcher(
+        Path(INGEST_DIR),
+        controller,
+        done_dir=Path(INGEST_DONE_DIR) if INGEST_DONE_DIR else None,
+        failed_dir=Path(INGEST_FAILED_DIR) if INGEST_FAILED_DIR else None,
+    )
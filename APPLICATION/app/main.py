@@ -1,14 +1,21 @@
 # APPLICATION/app/main.py
 
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import TYPE_CHECKING
+import asyncio
+import logging
 import os
 # import threading
 
 import cv2
 import httpx
+import numpy as np
 # import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException, status, Depends, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import (
+    FastAPI, UploadFile, File, HTTPException, status, Depends, Request, BackgroundTasks
+)
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,13 +23,34 @@ from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
 import app.schemas as schemas
-from app.schemas import GetImage, PredictResult
+from app.batch import accept_series, run_series
+from app import ingest
+from app.schemas import GetImage, PredictResult, ProgressiveResult
 from app.models import Images, Detections
-from app.database import engine, get_db, Base
-from app.utils import _slice_panorama, create_defects_report, ndarray_to_bytes
-from app.visualize_predictions import PanoramaProcessor
+from app.database import Sessionlocal, ensure_schema, get_db
+from app.pipeline import (
+    ML_TIMEOUT, MLClient, detect_coarse, detect_panorama, group_by_tile, refine_regions,
+    share_panorama, with_tier
+)
+from app.utils import create_defects_report
+from common.admission import AdmissionController, Overloaded, Permit
+from common.responses import ClosingStreamingResponse
+from common.deadline import (
+    DEADLINE_HEADER, Deadline, DeadlineExceeded, RequestAborted, RequestGuard, cancellations
+)
+from common.metrics import (
+    render as render_metrics, timed, track_admission, track_cancellations, track_executors, track_ingest,
+    track_memory
+)
+from common import executors, memory, profiling
+from common.tracing import annotate, span
+from common.shm import SharedPanorama, sweep_stale_segments
+from common.tiling import TilePlan, plan_for_image
 # from predict_service.ml_service import app as model_app
 
+if TYPE_CHECKING:
+    from app.visualize_predictions import PanoramaProcessor
+
 # -----------------------------------------------------------------------------
 # Загрузка переменных окружения
 # -----------------------------------------------------------------------------
@@ -41,10 +69,33 @@ REPORTS   = STATIC / "reports"
 RESULTS.mkdir(parents=True, exist_ok=True)
 REPORTS.mkdir(parents=True, exist_ok=True)
 
+# Создавать и догонять схему БД при старте процесса. 0 — схему готовит
+# отдельный шаг развёртывания: python -m app.database
+DB_SCHEMA_ON_STARTUP = os.getenv("DB_SCHEMA_ON_STARTUP", "1") == "1"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Старт сервера: схема БД, уборка разделяемой памяти и приём из папки
+    сканера (INGEST_DIR). При импорте модуля к БД никто не обращается.
+    """
+    if DB_SCHEMA_ON_STARTUP:
+        await asyncio.to_thread(ensure_schema)
+    # Удаляем сегменты разделяемой памяти, брошенные упавшими процессами
+    sweep_stale_segments()
+    ingest_task = asyncio.create_task(watcher.run()) if watcher is not None else None
+    yield
+    if ingest_task is not None:
+        ingest_task.cancel()
+        await asyncio.gather(ingest_task, return_exceptions=True)
+    executors.shutdown()
+
+
 # -----------------------------------------------------------------------------
 # Инициализация FastAPI-приложения
 # -----------------------------------------------------------------------------
-application = FastAPI(title="AI Weld Analysis Frontend")
+application = FastAPI(title="AI Weld Analysis Frontend", lifespan=lifespan)
 
 # Разрешаем CORS для любых источников (для разработки)
 application.add_middleware(
@@ -55,19 +106,152 @@ application.add_middleware(
     allow_headers=["*"],
 )
 
+# Учёт памяти по стадиям каждого запроса (GET /debug/memory)
+application.add_middleware(memory.MemoryMiddleware)
+
+# Профилирование запроса по заголовку X-Profile (только с PROFILE_TOKEN)
+if profiling.enabled():
+    application.add_middleware(profiling.ProfileMiddleware, service="frontend")
+
 # Монтируем статические файлы и настраиваем шаблоны
 application.mount("/static", StaticFiles(directory=str(STATIC)), name="static")
 templates = Jinja2Templates(directory=str(TEMPLATES))
 
-# Создаем таблицы в БД при старте
-Base.metadata.create_all(bind=engine)
+# PanoramaProcessor (локальная модель для /upload) создаётся при первом
+# обращении: фронтенд, который только пересылает тайлы в ML-сервис,
+# не загружает ultralytics и torch
+_processor: "PanoramaProcessor | None" = None
+
+# Контроль допуска: сколько панорам декодируется и распознаётся одновременно,
+# сколько запросов ждёт в очереди и сколько секунд. Сверх лимита — 429/503
+panoramas = AdmissionController(
+    "panoramas",
+    capacity=int(os.getenv("MAX_INFLIGHT_PANORAMAS", "2")),
+    queue_size=int(os.getenv("PANORAMA_QUEUE_SIZE", "8")),
+    max_wait=float(os.getenv("PANORAMA_QUEUE_TIMEOUT", "60")),
+)
+
+# Дедлайн распознавания панорамы, с: клиент может сократить его заголовком
+# X-Deadline-Ms, остаток передаётся ML-сервису с каждым запросом
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "300"))
+
+# Метрики очереди панорам и брошенной работы (GET /metrics)
+track_admission(panoramas)
+track_cancellations(cancellations)
+track_memory()
+track_executors()
+
+# Приём панорам из папки сканера: фоновый, с приоритетом ниже загрузок
+watcher = ingest.from_env(panoramas)
+if watcher is not None:
+    track_ingest(watcher)
+
+logger = logging.getLogger(__name__)
+
+
+def get_processor() -> "PanoramaProcessor":
+    """
+    PanoramaProcessor для /upload; модуль визуализации (ultralytics, torch,
+    PIL) импортируется при первом вызове.
+
+    Returns:
+        PanoramaProcessor: Общий для процесса экземпляр.
+    """
+    global _processor
+    if _processor is None:
+        from app.visualize_predictions import PanoramaProcessor
+        _processor = PanoramaProcessor()
+    return _processor
+
+
+def _visualize(image_path: str) -> tuple[str, list[dict]]:
+    """Локальная обработка панорамы для /upload (выполняется в пуле потоков)."""
+    return get_processor().process_image(image_path)
 
-# Создаем экземпляр PanoramaProcessor для визуализации
-processor = PanoramaProcessor()
 
-# Адрес ML-сервиса
-ML_SERVICE_BASE_URL  = os.getenv("ML_SERVICE_URL", "http://localhost:8001")
-ML_SERVICE_DETECT_EP = f"{ML_SERVICE_BASE_URL}/detect"
+def _update_detections(predict_id: int, detections: list[dict], plan: TilePlan, stage: str) -> list[dict]:
+    """
+    Обновить запись Detections результатами очередной стадии.
+
+    Returns:
+        list[dict]: Результаты по тайлам в формате ответа API.
+    """
+    results = group_by_tile(detections, plan)
+    with timed("db_commit"), span("db_commit", stage=stage), Sessionlocal() as db:
+        record = db.get(Detections, predict_id)
+        record.defects    = results
+        record.is_success = any(r["status"] == "success" for r in results)
+        record.stage      = stage
+        db.commit()
+    return results
+
+
+async def _progressive_passes(
+    predict_id: int,
+    img: np.ndarray,
+    plan: TilePlan,
+    coarse: list[dict],
+    shared: SharedPanorama | None = None,
+    permit: Permit | None = None
+) -> None:
+    """
+    Фоновые стадии прогрессивного режима: уточнение найденных областей
+    в исходном разрешении, затем полный проход и отчёт. Сегмент shared
+    и место в контроле допуска permit передаются задаче во владение
+    и освобождаются по её окончании.
+    """
+    try:
+        with span("progressive_passes", predict_id=predict_id):
+            async with httpx.AsyncClient(timeout=ML_TIMEOUT) as http:
+                client = MLClient(http, shared, Deadline(REQUEST_DEADLINE))
+                with timed("ml_refine"), span("ml_refine", coarse_detections=len(coarse)):
+                    refined = await refine_regions(client, img, plan, coarse)
+                _update_detections(predict_id, with_tier(refined, "refined"), plan, "refined")
+
+                with timed("ml_full"), span("ml_full"):
+                    full = await detect_panorama(client, img, plan)
+            full = with_tier(full, "full")
+
+            # Отчёт пишем до смены стадии: клиент запрашивает его, увидев "full"
+            with timed("report"), span("report"):
+                await executors.run(
+                    "report", create_defects_report,
+                    group_by_tile(full, plan),
+                    output_filename=str(REPORTS / "defects_report.docx")
+                )
+            _update_detections(predict_id, full, plan, "full")
+    except Exception:
+        logger.exception("Прогрессивное распознавание %s прервано", predict_id)
+        with Sessionlocal() as db:
+            db.get(Detections, predict_id).stage = "failed"
+            db.commit()
+    finally:
+        if shared is not None:
+            shared.close()
+        if permit is not None:
+            permit.release()
+
+
+@application.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded) -> JSONResponse:
+    """Отказ контроля допуска: 429/503 с заголовком Retry-After."""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@application.exception_handler(DeadlineExceeded)
+async def deadline_handler(request: Request, exc: DeadlineExceeded) -> JSONResponse:
+    """Дедлайн запроса истёк: 504."""
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": str(exc)})
+
+
+@application.exception_handler(RequestAborted)
+async def aborted_handler(request: Request, exc: RequestAborted) -> JSONResponse:
+    """Клиент отключился: ответ 499 никто не прочитает, он нужен для логов."""
+    return JSONResponse(status_code=499, content={"detail": str(exc)})
 
 
 @application.get("/", response_class=HTMLResponse)
@@ -97,42 +281,64 @@ async def upload_image(file: UploadFile = File(...)) -> dict[str, str]:
 
     Raises:
         HTTPException: При ошибке чтения или обработки файла.
+        Overloaded: Превышен лимит одновременных панорам (429/503).
     """
-    try:
-        temp_dir  = HERE / "temp_uploads"
-        temp_dir.mkdir(exist_ok=True)
-        temp_path = temp_dir / file.filename
+    async with panoramas.admit():
+        try:
+            temp_dir  = HERE / "temp_uploads"
+            temp_dir.mkdir(exist_ok=True)
+            temp_path = temp_dir / file.filename
 
-        content = await file.read()
-        if not content:
-            raise HTTPException(status_code=400, detail="Пустой файл")
+            with timed("read_upload"):
+                content = await file.read()
+            if not content:
+                raise HTTPException(status_code=400, detail="Пустой файл")
 
-        temp_path.write_bytes(content)
+            with timed("write_temp"):
+                temp_path.write_bytes(content)
+            # Дальше панорама читается из файла: байты загрузки не держим
+            del content
 
-        # output_path = processor.process_image(str(temp_path))
-        output_path, metadata = processor.process_image(str(temp_path))
-        filename    = Path(output_path).name
-        return {"result_url": f"/static/results/{filename}"}
+            # output_path = processor.process_image(str(temp_path))
+            with timed("visualize"):
+                output_path, metadata = await executors.run("visualize", _visualize, str(temp_path))
+            filename    = Path(output_path).name
+            return {"result_url": f"/static/results/{filename}"}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @application.post(
     "/api/predict",
     status_code=status.HTTP_201_CREATED,
-    response_model=list[PredictResult]
+    response_model=list[PredictResult] | ProgressiveResult
 )
 async def predict_defect(
+    request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
+    progressive: bool = False,
     db: Session = Depends(get_db)
-) -> list[dict]:
+) -> list[dict] | dict:
     """
     Разрезать панораму на тайлы, отправить каждый тайл в ML-сервис,
     сохранить результаты в БД и сформировать отчёт.
 
+    В прогрессивном режиме (?progressive=true) сразу возвращаются грубые
+    детекции по уменьшенной панораме, а уточнение найденных областей и
+    полный проход в исходном разрешении выполняются в фоне и обновляют
+    запись Detections (см. GET /api/predict/{predict_id}).
+
+    Если клиент отключается или истекает дедлайн (REQUEST_DEADLINE или
+    заголовок X-Deadline-Ms), запросы к ML-сервису отменяются, а запись
+    в БД и отчёт не создаются.
+
     Args:
+        request (Request): Входящий запрос (заголовки, отключение клиента).
+        background_tasks (BackgroundTasks): Очередь фоновых задач FastAPI.
         file (UploadFile): Загруженный файл панорамы.
+        progressive (bool): Включить прогрессивный режим.
         db (Session): Сессия SQLAlchemy для работы с БД.
 
     Returns:
@@ -140,6 +346,8 @@ async def predict_defect(
             - status: "success" или "no_defects"
             - defects: список дефектов с полями:
                 class, confidence, index, coordinates, length
+        dict: В прогрессивном режиме — predict_id, stage="coarse" и results
+            в том же формате, у каждого дефекта есть поле tier.
     """
     # Проверка типа файла
     if not file.content_type.startswith("image/"):
@@ -148,87 +356,175 @@ async def predict_defect(
             content={"message": "Файл должен быть изображением"}
         )
 
-    # Считываем содержимое
-    content = await file.read()
-    if not content:
-        raise HTTPException(status_code=400, detail="Пустой файл")
-
-    # Временное сохранение для OpenCV
-    temp_dir  = HERE / "temp_uploads"
-    temp_dir.mkdir(exist_ok=True)
-    temp_path = temp_dir / file.filename
-    temp_path.write_bytes(content)
-
-    # Декодируем изображение
-    img = cv2.imread(str(temp_path))
-    if img is None:
-        raise HTTPException(status_code=422, detail="Не удалось прочитать изображение")
-
-    # Разбиваем панораму на тайлы
-    tiles   = _slice_panorama(img)
-    results = []
-
-    # Отправка запросов к ML-сервису
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        for tile in tiles:
-            payload = {
-                'file': (
-                    'tile.png',
-                    ndarray_to_bytes(tile, format="png"),
-                    'image/png'
-                )
-            }
-            resp = await client.post(ML_SERVICE_DETECT_EP, files=payload)
-            if resp.status_code != status.HTTP_201_CREATED:
-                raise HTTPException(
-                    status_code=502,
-                    detail=f"Ошибка ML-сервиса: {resp.text}"
-                )
-            ml_data = resp.json()
-
-            # Формируем запись с необходимыми полями
-            results.append({
-                "status": ml_data.get("status"),
-                "defects": [
-                    {
-                        "class":       d["class"],
-                        "confidence":  f"{d['confidence']*100:.2f}%",
-                        "index":       d["index"],
-                        "coordinates": d["coordinates"],
-                        "length":      d["length"],
-                    }
-                    for d in ml_data.get("detections", [])
-                ]
-            })
-
-    # Сохраняем изображение в БД
-    db_image = Images(
-        filename=file.filename,
-        data=content,
-        content_type=file.content_type,
-        expansion=f".{file.filename.split('.')[-1]}"
-    )
-    db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
+    deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER), REQUEST_DEADLINE)
+    guard    = RequestGuard(request, deadline)
 
-    # Сохраняем детекции в БД
-    db_pred = Detections(
-        is_success=any(r["status"] == "success" for r in results),
-        defects=results,
-        image_id=db_image.id
-    )
-    db.add(db_pred)
-    db.commit()
+    # Место в контроле допуска: до чтения и декодирования, чтобы под
+    # нагрузкой в памяти было не больше MAX_INFLIGHT_PANORAMAS панорам
+    try:
+        permit = await panoramas.acquire_until(deadline)
+    except DeadlineExceeded as e:
+        cancellations.record(e)
+        raise
+    shared = None
+    handed_off = False
+
+    try:
+        # Клиент мог уйти, пока запрос ждал в очереди
+        await guard.check()
+
+        # Считываем содержимое
+        with timed("read_upload"):
+            content = await file.read()
+        if not content:
+            raise HTTPException(status_code=400, detail="Пустой файл")
+
+        # Декодируем изображение прямо из загруженных байтов (без временного
+        # файла и без второй копии байтов внутри OpenCV)
+        with timed("decode"), span("decode", upload_bytes=len(content)):
+            img = await executors.run(
+                "decode", cv2.imdecode, np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR
+            )
+        if img is None:
+            raise HTTPException(status_code=422, detail="Не удалось прочитать изображение")
+
+        # План нарезки панорамы на тайлы
+        try:
+            plan = plan_for_image(img)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        # Размер панорамы — атрибутами спана запроса (трасса всей загрузки)
+        annotate(panorama_width=plan.width, panorama_height=plan.height, tiles=plan.count)
+
+        # Панорама один раз копируется в разделяемую память (если ML-сервис
+        # на той же машине), дальше тайлы — это view внутри сегмента
+        with timed("share"):
+            shared = await executors.run("share", share_panorama, img)
+        if shared is not None:
+            img = shared.array
+
+        # Отправка запросов к ML-сервису
+        # Запросы к ML-сервису отменяются, как только клиент отключится
+        async with httpx.AsyncClient(timeout=ML_TIMEOUT) as http:
+            client = MLClient(http, shared, deadline)
+            if progressive:
+                with timed("ml_coarse"), span("ml_coarse"):
+                    detections = with_tier(await guard.run(detect_coarse(client, img, plan)), "coarse")
+            else:
+                with timed("ml_full"), span("ml_full"):
+                    detections = await guard.run(detect_panorama(client, img, plan))
+
+        results = group_by_tile(detections, plan)
+
+        if not progressive:
+            # Пиксели панорамы больше не нужны: освобождаем их до записи
+            # в БД и отчёта (в памяти остаются только байты загрузки)
+            img = None
+            if shared is not None:
+                shared.close()
+                shared = None
+
+        # Клиент мог уйти, пока шли запросы: не пишем в БД и не строим отчёт
+        await guard.check()
+
+        with timed("db_commit"), span("db_commit", stage="coarse" if progressive else "full"):
+            # Сохраняем изображение в БД
+            db_image = Images(
+                filename=file.filename,
+                data=content,
+                content_type=file.content_type,
+                expansion=f".{file.filename.split('.')[-1]}"
+            )
+            db.add(db_image)
+            db.commit()
+            db.refresh(db_image)
+
+            # Сохраняем детекции в БД
+            db_pred = Detections(
+                is_success=any(r["status"] == "success" for r in results),
+                defects=results,
+                image_id=db_image.id,
+                stage="coarse" if progressive else "full"
+            )
+            db.add(db_pred)
+            db.commit()
+
+        if progressive:
+            # Уточнение и полный проход — после отправки ответа
+            background_tasks.add_task(
+                _progressive_passes, db_pred.predict_id, img, plan, detections, shared, permit
+            )
+            handed_off = True
+            return {"predict_id": db_pred.predict_id, "stage": "coarse", "results": results}
+
+        # Генерируем отчет Word
+        # create_defects_report(results)
+        await guard.check()
+        with timed("report"), span("report"):
+            await executors.run(
+                "report", create_defects_report,
+                results,
+                output_filename=str(REPORTS / "defects_report.docx")
+            )
+
+        return results
+    finally:
+        if not handed_off:
+            if shared is not None:
+                shared.close()
+            permit.release()
+
+
+@application.post("/api/predict/batch", status_code=status.HTTP_200_OK)
+async def predict_batch(files: list[UploadFile] = File(...)) -> StreamingResponse:
+    """
+    Распознать серию панорам: несколько файлов и/или ZIP-архивов
+    с изображениями. Панорамы идут по конвейеру окном (BATCH_WINDOW),
+    результаты пишутся в БД группами, по серии строится сводный отчёт.
+
+    Args:
+        files (list[UploadFile]): Изображения панорам и/или ZIP-архивы.
+
+    Returns:
+        StreamingResponse: Поток NDJSON с событиями по каждой панораме
+            (started, detected, saved, failed) и итоговым done со ссылкой
+            на отчёт; формат — в app/batch.py.
 
-    # Генерируем отчет Word
-    # create_defects_report(results)
-    create_defects_report(
-        results,
-        output_filename=str(REPORTS / "defects_report.docx")
+    Raises:
+        HTTPException: 422 — в загрузке нет изображений, 413 — панорам
+            больше BATCH_MAX_PANORAMAS.
+    """
+    series = await accept_series(files, HERE / "temp_uploads")
+    # Серию закрывает и run_series, и сам ответ — если отправка сорвалась
+    # до первой итерации генератора и его finally не выполнился
+    return ClosingStreamingResponse(
+        run_series(series, panoramas, REQUEST_DEADLINE, REPORTS),
+        media_type="application/x-ndjson",
+        on_close=series.close,
     )
 
-    return results
+
+@application.get(
+    "/api/predict/{predict_id}",
+    response_model=ProgressiveResult,
+    status_code=status.HTTP_200_OK
+)
+def get_prediction(predict_id: int, db: Session = Depends(get_db)) -> dict:
+    """
+    Текущее состояние распознавания: стадия (coarse → refined → full,
+    либо failed) и результаты по тайлам с проходом каждого дефекта в tier.
+
+    Args:
+        predict_id (int): Идентификатор записи Detections.
+        db (Session): Сессия SQLAlchemy.
+
+    Returns:
+        dict: predict_id, stage и results.
+    """
+    record = db.get(Detections, predict_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="Результат не найден")
+    return {"predict_id": record.predict_id, "stage": record.stage, "results": record.defects}
 
 
 @application.get(
@@ -272,6 +568,86 @@ def delete_image(filename: str, db: Session = Depends(get_db)) -> None:
     db.commit()
 
 
+@application.get("/api/admission/stats", status_code=status.HTTP_200_OK)
+def admission_stats() -> dict:
+    """
+    Состояние контроля допуска панорам.
+
+    Returns:
+        dict: Панорамы в работе и в очереди, время ожидания,
+            число отказов по переполнению очереди (429) и по таймауту (503),
+            а в cancelled — брошенные запросы (клиент ушёл, дедлайн) и тайлы,
+            в executors — загрузка пулов CPU-стадий, в ingest — приём
+            из папки сканера (если включён).
+    """
+    return {
+        **panoramas.stats(),
+        "cancelled": cancellations.stats(),
+        "executors": executors.stats(),
+        "ingest": watcher.stats() if watcher is not None else None,
+    }
+
+
+@application.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    """
+    Метрики Prometheus: длительности стадий (weld_stage_seconds), тайлы
+    по транспорту, дефекты по классам, очередь и отмены.
+    """
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@application.get("/debug/memory", include_in_schema=False)
+def debug_memory(request: Request) -> dict:
+    """
+    Память процесса: текущий и пиковый RSS, прирост пика по стадиям,
+    последние запросы по стадиям и (с MEMORY_TRACE=1) топ аллокаций.
+    Доступ — с токеном PROFILE_TOKEN, как у /debug/profile.
+    """
+    if code := profiling.denied(request.headers, request.query_params):
+        raise HTTPException(status_code=code)
+    return memory.summary()
+
+
+@application.get("/debug/profile", include_in_schema=False)
+async def debug_profile(request: Request, seconds: float = 10) -> FileResponse:
+    """
+    Сэмплировать весь процесс seconds секунд и отдать профиль speedscope.
+    Доступ — с токеном PROFILE_TOKEN в X-Profile или ?profile=.
+
+    Raises:
+        HTTPException: 404 — профилирование выключено, 403 — неверный токен,
+            409 — уже идёт другой профиль.
+    """
+    if code := profiling.denied(request.headers, request.query_params):
+        raise HTTPException(status_code=code)
+    path = await profiling.profile_window("frontend", seconds)
+    if path is None:
+        raise HTTPException(status_code=409, detail="Профилирование уже идёт")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+
+@application.get("/debug/profiles/{name}", include_in_schema=False)
+def debug_profile_file(name: str, request: Request) -> Response:
+    """
+    Сохранённый профиль запроса (имя — из заголовка ответа X-Profile-File).
+    Пока запрос не завершился и профиль не записан — 202 с Retry-After.
+    """
+    if code := profiling.denied(request.headers, request.query_params):
+        raise HTTPException(status_code=code)
+    path = profiling.profile_path(name)
+    if path is None:
+        if profiling.profile_pending(name):
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={"detail": "Профиль ещё записывается"},
+                headers={"Retry-After": "1"},
+            )
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+
 @application.get("/report", status_code=status.HTTP_200_OK)
 def get_report() -> dict[str, str]:
     """
@@ -1,7 +1,9 @@
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
 from .database import Base
-from sqlalchemy import Column, Integer, VARCHAR, TIMESTAMP, text, LargeBinary, Boolean, ForeignKey
+from sqlalchemy import (
+    JSON, Column, Integer, VARCHAR, TIMESTAMP, func, text, LargeBinary, Boolean, ForeignKey
+)
 
 
 class Images(Base):
@@ -12,7 +14,7 @@ class Images(Base):
     data = Column(LargeBinary, nullable=False)
     content_type = Column(VARCHAR(100), nullable=False)
     expansion = Column(VARCHAR(255), nullable=False)
-    uploaded_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'))
+    uploaded_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
     detections = relationship("Detections", back_populates="image", cascade='all, delete')
 
@@ -20,8 +22,11 @@ class Detections(Base):
     __tablename__ = 'detected'
     predict_id = Column(Integer, nullable=False, primary_key=True, index=True)
     is_success = Column(Boolean)
-    defects = Column(JSONB)
+    # JSONB в PostgreSQL, JSON в SQLite (локальные прогоны bench/)
+    defects = Column(JSON().with_variant(JSONB, "postgresql"))
+    # стадия прогрессивного распознавания: coarse → refined → full
+    stage = Column(VARCHAR(16), server_default=text("'full'"))
     image_id = Column(Integer, ForeignKey("images.id", ondelete="CASCADE"), nullable=False)
-    timestamp = Column(TIMESTAMP(timezone=True), server_default=text('now()'))
+    timestamp = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
     image = relationship("Images", back_populates="detections")
\ No newline at end of file
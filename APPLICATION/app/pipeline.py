@@ -0,0 +1,488 @@
+# APPLICATION/app/pipeline.py
+"""
+Конвейер распознавания панорамы через ML-сервис: отправка участков
+панорамы в /detect, шовный доинференс, глобальное слияние детекций и
+прогрессивный режим (быстрый проход по уменьшенной панораме → уточнение
+найденных областей → полный проход).
+
+Если фронтенд и ML-сервис работают на одной машине, панорама один раз
+кладётся в разделяемую память (common.shm), и в /detect_shm уходят только
+имя сегмента и координаты участка; при любой ошибке — откат на HTTP.
+
+Участки отправляются пачками по бинарному протоколу /detect_batch
+(common.rpc, msgpack); если ML-сервис его не поддерживает — по одному
+через REST /detect. Кодирование участков, уменьшение и слияние
+детекций выполняются в пулах common.executors, а не в event loop.
+
+Память на одну панораму W×H в /api/predict (P = W·H·3 байт, тайл
+T = tile_width·H·3, C — байты загрузки, они нужны до записи в БД):
+
+    C + 2·P                  — миг копирования в разделяемую память
+    C + P + (ML_INFLIGHT_BATCHES + 1)·ML_BATCH_TILES·T
+                             — распознавание: тела запросов в полёте и
+                               копии участков кодируемой пачки
+                               (через разделяемую память T ≈ 0)
+    C + детекции             — запись в БД и отчёт
+
+Для 31920×1152 это P ≈ 105 МиБ, T ≈ 3,8 МиБ: при настройках по умолчанию
+не больше C + 2·P ≈ C + 210 МиБ. Прогрессивный режим держит панораму
+до конца фоновых проходов.
+"""
+
+import asyncio
+import logging
+import os
+
+import cv2
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from app.utils import _slice_panorama, ndarray_to_bytes
+from common import executors, rpc
+from common.admission import Overloaded
+from common.deadline import Deadline, DeadlineExceeded, cancellations
+from common.metrics import count_defects, count_tiles, timed
+from common.boxes import merge_detections, rescale_detections, touched_seams
+from common.shm import SharedPanorama
+from common.tracing import inject, span
+from common.tiling import TilePlan, plan_tiles, refine_windows, tile_views
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Адрес ML-сервиса
+ML_SERVICE_BASE_URL  = os.getenv("ML_SERVICE_URL", "http://localhost:8001")
+ML_SERVICE_DETECT_EP = f"{ML_SERVICE_BASE_URL}/detect"
+ML_SERVICE_SHM_EP    = f"{ML_SERVICE_BASE_URL}/detect_shm"
+ML_SERVICE_BATCH_EP  = f"{ML_SERVICE_BASE_URL}/detect_batch"
+
+# Транспорт участков: auto — разделяемая память, пока ML-сервис её видит,
+# иначе HTTP; shm/http — принудительно
+ML_TRANSPORT = os.getenv("ML_TRANSPORT", "auto").lower()
+
+# Кодек: auto/msgpack — пачки участков через /detect_batch, json — REST /detect
+ML_CODEC       = os.getenv("ML_CODEC", "auto").lower()
+ML_BATCH_TILES = int(os.getenv("ML_BATCH_TILES", "8"))          # участков в запросе
+ML_TILE_FORMAT = os.getenv("ML_TILE_FORMAT", "raw").lower()     # raw или png
+# Окно: сколько пачек одной панорамы одновременно в полёте. Участок
+# кодируется, когда уходит его пачка, тело запроса живёт до ответа
+ML_INFLIGHT_BATCHES = max(1, int(os.getenv("ML_INFLIGHT_BATCHES", "2")))
+
+# Таймаут одного запроса к ML-сервису, с (урезается дедлайном запроса)
+ML_TIMEOUT = float(os.getenv("ML_TIMEOUT", "60"))
+
+# Повторы при перегрузке ML-сервиса (429/503 с Retry-After)
+ML_RETRIES         = int(os.getenv("ML_RETRIES", "3"))
+ML_RETRY_MAX_WAIT  = float(os.getenv("ML_RETRY_MAX_WAIT", "10"))
+
+# Шовный режим: доинференс полос вокруг стыков тайлов и глобальное слияние
+SEAM_AWARE       = os.getenv("SEAM_AWARE", "1") == "1"
+SEAM_MARGIN      = int(os.getenv("SEAM_MARGIN", "8"))         # касание края тайла, px
+SEAM_STRIP_WIDTH = int(os.getenv("SEAM_STRIP_WIDTH", "384"))  # ширина полосы, px
+
+# Прогрессивный режим: высота уменьшенной панорамы для быстрого прохода
+COARSE_HEIGHT = int(os.getenv("COARSE_HEIGHT", "288"))
+
+
+# None — ещё не проверяли; False — ML-сервис не видит наши сегменты
+# (другая машина или контейнер), больше не пытаемся
+_shm_available: bool | None = None
+# False — ML-сервис без /detect_batch, работаем через REST
+_batch_available: bool | None = None
+
+# Ответы ML-сервиса, после которых запрос повторяется через Retry-After
+OVERLOAD_STATUSES = (status.HTTP_429_TOO_MANY_REQUESTS, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+def _retry_after(resp: httpx.Response) -> int:
+    try:
+        return max(1, int(float(resp.headers.get("Retry-After", "1"))))
+    except ValueError:
+        return 1
+
+
+# Участок панорамы для отправки: (пиксели, номер тайла, левая граница)
+Region = tuple[np.ndarray, int, int]
+
+
+def share_panorama(img: np.ndarray) -> SharedPanorama | None:
+    """
+    Положить панораму в разделяемую память, если транспорт это допускает.
+    Владелец сегмента — вызывающий код: он обязан вызвать close().
+    """
+    if ML_TRANSPORT == "http" or (ML_TRANSPORT == "auto" and _shm_available is False):
+        return None
+    try:
+        return SharedPanorama(img)
+    except OSError:
+        logger.warning("Разделяемая память недоступна, участки уйдут по HTTP", exc_info=True)
+        return None
+
+
+class MLClient:
+    """
+    Клиент ML-сервиса: участок панорамы уходит через разделяемую память,
+    если он лежит в сегменте shared, иначе — пикселями по HTTP.
+    """
+
+    def __init__(
+        self,
+        http: httpx.AsyncClient,
+        shared: SharedPanorama | None = None,
+        deadline: Deadline | None = None
+    ):
+        self.http = http
+        self.shared = shared
+        self.deadline = deadline
+
+    async def detect_many(self, regions: list[Region], plan: TilePlan) -> list[dict]:
+        """
+        Распознать участки панорамы и вернуть все детекции одним списком.
+
+        Args:
+            regions (list[Region]): Участки (пиксели, номер тайла, левая граница).
+            plan (TilePlan): План нарезки панорамы.
+
+        Returns:
+            list[dict]: Детекции в координатах панорамы.
+        """
+        use_batch = (
+            rpc.available()
+            and ML_CODEC != "json"
+            and (ML_CODEC == "msgpack" or _batch_available is not False)
+        )
+        detections = []
+        done = 0
+        rest = regions
+        pending: dict[asyncio.Task, int] = {}
+        try:
+            if use_batch:
+                # Пачки уходят окном до ML_INFLIGHT_BATCHES запросов; детекции
+                # складываются в порядке пачек, как при последовательной отправке
+                chunks = [regions[i:i + ML_BATCH_TILES] for i in range(0, len(regions), ML_BATCH_TILES)]
+                batches: list[list[dict] | None] = [None] * len(chunks)
+                launched = 0
+                unsupported = False
+                while pending or (launched < len(chunks) and not unsupported):
+                    while not unsupported and launched < len(chunks) and len(pending) < ML_INFLIGHT_BATCHES:
+                        pending[asyncio.create_task(self._dispatch_batch(chunks[launched], plan))] = launched
+                        launched += 1
+                    finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        k = pending.pop(task)
+                        batches[k] = task.result()
+                        if batches[k] is None:
+                            unsupported = True
+                        else:
+                            done += len(chunks[k])
+                for batch in batches:
+                    detections.extend(batch or ())
+                # Без /detect_batch: всё, что не распознано пачками, — через REST
+                rest = [region for k, chunk in enumerate(chunks) if batches[k] is None for region in chunk]
+
+            # REST /detect по одному участку
+            for region, index, offset in rest:
+                ml_data = await self.detect(region, plan, index, offset)
+                detections.extend(ml_data.get("detections", []))
+                done += 1
+        except (asyncio.CancelledError, DeadlineExceeded):
+            # Отмена (клиент ушёл) или дедлайн: неотправленные участки брошены
+            cancellations.record(tiles=max(0, len(regions) - done))
+            raise
+        finally:
+            # Ошибка или отмена: пачки, ещё ждущие ответа, не нужны
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        return detections
+
+    async def _dispatch_batch(self, chunk: list[Region], plan: TilePlan) -> list[dict] | None:
+        with span("dispatch_batch", tiles=len(chunk), tile_indices=[i for _, i, _ in chunk]):
+            return await self._detect_batch(chunk, plan)
+
+    async def _send(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Запрос к ML-сервису с повтором при перегрузке: на 429/503 ждём
+        Retry-After (не дольше ML_RETRY_MAX_WAIT) до ML_RETRIES раз.
+        При stream=True вызывающий обязан закрыть ответ (aclose).
+
+        Raises:
+            Overloaded: ML-сервис перегружен и после всех повторов.
+            DeadlineExceeded: Дедлайн запроса истёк.
+        """
+        for attempt in range(ML_RETRIES + 1):
+            # Дедлайн: не отправляем заведомо опоздавший запрос, передаём
+            # остаток бюджета ML-сервису и не ждём ответа дольше него
+            if self.deadline is not None:
+                self.deadline.check()
+                kwargs["headers"] = {**kwargs.get("headers", {}), **self.deadline.header()}
+                kwargs["timeout"] = min(ML_TIMEOUT, self.deadline.remaining())
+            # Контекст трассы: спаны ML-сервиса — дети спана отправки участка
+            kwargs["headers"] = inject(dict(kwargs.get("headers", {})))
+            request = self.http.build_request(method, url, **kwargs)
+            with timed("ml_roundtrip"):
+                resp = await self.http.send(request, stream=stream)
+            if resp.status_code not in OVERLOAD_STATUSES:
+                return resp
+            await resp.aclose()
+            retry_after = _retry_after(resp)
+            if attempt == ML_RETRIES:
+                raise Overloaded(status.HTTP_503_SERVICE_UNAVAILABLE, retry_after, "ML-сервис перегружен")
+            delay = min(retry_after, ML_RETRY_MAX_WAIT)
+            if self.deadline is not None:
+                delay = min(delay, self.deadline.remaining())
+            await asyncio.sleep(delay)
+
+    def _tile_request(self, region: np.ndarray, index: int, offset: int) -> rpc.TileRequest:
+        bounds = self.shared.locate(region) if self.shared is not None else None
+        if bounds is not None:
+            return rpc.TileRequest(index, offset, bounds=bounds)
+        if ML_TILE_FORMAT == "png":
+            return rpc.TileRequest(index, offset, ndarray_to_bytes(region, format="png"), "png")
+        with timed("encode"):
+            return rpc.TileRequest.from_array(region, index, offset)
+
+    def _encode_batch(self, regions: list[Region], plan: TilePlan) -> tuple[bytes, dict | None]:
+        """Тело запроса /detect_batch и сегмент разделяемой памяти, если участки в нём."""
+        tiles = [self._tile_request(*region) for region in regions]
+        segment = self.shared.descriptor if any(t.bounds for t in tiles) else None
+        # Копии участков живут только до упаковки в тело запроса
+        return rpc.encode_batch(tiles, plan.width, plan.height, segment), segment
+
+    @timed("ml_batch")
+    async def _detect_batch(self, regions: list[Region], plan: TilePlan) -> list[dict] | None:
+        """
+        Пачка участков одним запросом /detect_batch, ответ читается потоком.
+        None — ML-сервис протокол не поддерживает, нужен откат на REST.
+        """
+        return await self._send_batch(regions, plan)
+
+    async def _send_batch(self, regions: list[Region], plan: TilePlan) -> list[dict] | None:
+        # Без таймера: повтор без разделяемой памяти идёт в тот же замер ml_batch
+        global _batch_available, _shm_available
+        body, segment = await executors.run("encode", self._encode_batch, regions, plan)
+
+        detections = []
+        resp = await self._send(
+            "POST", ML_SERVICE_BATCH_EP, stream=True,
+            content=body, headers={"Content-Type": rpc.MEDIA_TYPE}
+        )
+        try:
+            if resp.status_code == status.HTTP_404_NOT_FOUND and segment is not None:
+                # Сегмент не виден ML-сервису: повторяем с пикселями
+                logger.info("ML-сервис не видит разделяемую память, переходим на HTTP")
+                _shm_available = False
+                self.shared = None
+                return await self._send_batch(regions, plan)
+            if resp.status_code in (
+                status.HTTP_404_NOT_FOUND,
+                status.HTTP_405_METHOD_NOT_ALLOWED,
+                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            ):
+                logger.info("ML-сервис без /detect_batch, переходим на REST /detect")
+                _batch_available = False
+                return None
+            if resp.status_code != status.HTTP_200_OK:
+                raise HTTPException(
+                    status_code=502,
+                    detail=f"Ошибка ML-сервиса: {(await resp.aread()).decode(errors='replace')}"
+                )
+
+            stream = rpc.unpacker()
+            names = None
+            async for chunk in resp.aiter_bytes():
+                stream.feed(chunk)
+                for msg in stream:
+                    if "error" in msg:
+                        if msg.get("kind") == rpc.ERROR_DEADLINE:
+                            raise DeadlineExceeded(msg["error"])
+                        raise HTTPException(status_code=502, detail=f"Ошибка ML-сервиса: {msg['error']}")
+                    if names is None:
+                        names = msg["names"]
+                        continue
+                    detections.extend(rpc.TileResult.unpack(msg).detections(names, plan.width))
+        finally:
+            await resp.aclose()
+
+        _batch_available = True
+        if segment is not None:
+            _shm_available = True
+        count_tiles("batch_shm" if segment is not None else "batch", len(regions))
+        return detections
+
+    async def detect(self, region: np.ndarray, plan: TilePlan, index: int, offset: int) -> dict:
+        """
+        Отправить участок панорамы (тайл или полосу вокруг стыка) в ML-сервис.
+
+        Args:
+            region (np.ndarray): Участок панорамы во всю высоту.
+            plan (TilePlan): План нарезки панорамы.
+            index (int): Номер тайла, к которому относится участок.
+            offset (int): Левая граница участка в панораме.
+
+        Returns:
+            dict: Ответ ML-сервиса (status, detections).
+        """
+        # Геометрия участка: ML-сервис переводит координаты в систему панорамы
+        geometry = {
+            "index":  index,
+            "offset": offset,
+            "width":  plan.width,
+            "height": plan.height,
+        }
+        with span("dispatch_tile", tile_index=index, tile_offset=offset, tile_width=region.shape[1]):
+            bounds = self.shared.locate(region) if self.shared is not None else None
+            if bounds is not None:
+                result = await self._detect_shm(bounds, geometry)
+                if result is not None:
+                    return result
+            return await self._detect_http(region, geometry)
+
+    async def _detect_shm(self, bounds: tuple[int, int, int, int], geometry: dict) -> dict | None:
+        """Запрос через разделяемую память; None — нужен откат на HTTP."""
+        global _shm_available
+        y0, y1, x0, x1 = bounds
+        body = {**self.shared.descriptor, "y0": y0, "y1": y1, "x0": x0, "x1": x1, **geometry}
+        try:
+            resp = await self._send("POST", ML_SERVICE_SHM_EP, json=body)
+        except httpx.HTTPError:
+            logger.warning("Запрос /detect_shm не прошёл, откат на HTTP", exc_info=True)
+            return None
+        if resp.status_code == status.HTTP_201_CREATED:
+            _shm_available = True
+            count_tiles("shm")
+            return resp.json()
+        if resp.status_code in (status.HTTP_404_NOT_FOUND, status.HTTP_405_METHOD_NOT_ALLOWED):
+            # Сегмент не виден ML-сервису или он без /detect_shm —
+            # до перезапуска работаем по HTTP
+            logger.info("ML-сервис не видит разделяемую память, переходим на HTTP")
+            _shm_available = False
+            self.shared = None
+        return None
+
+    async def _detect_http(self, region: np.ndarray, geometry: dict) -> dict:
+        payload = {
+            'file': (
+                'tile.png',
+                await executors.run("encode", ndarray_to_bytes, region, format="png"),
+                'image/png'
+            )
+        }
+        resp = await self._send("POST", ML_SERVICE_DETECT_EP, files=payload, data=geometry)
+        if resp.status_code != status.HTTP_201_CREATED:
+            raise HTTPException(
+                status_code=502,
+                detail=f"Ошибка ML-сервиса: {resp.text}"
+            )
+        count_tiles("rest")
+        return resp.json()
+
+
+async def detect_panorama(client: MLClient, img: np.ndarray, plan: TilePlan) -> list[dict]:
+    """
+    Полный проход: все тайлы в исходном разрешении, шовный доинференс
+    и слияние детекций в координатах панорамы.
+    """
+    with timed("slice"), span("slice", panorama_width=plan.width, panorama_height=plan.height, tiles=plan.count):
+        tiles = zip(_slice_panorama(img, plan), plan.offsets)
+        regions = [(tile, idx, offset) for idx, (tile, offset) in enumerate(tiles, start=1)]
+    detections = await client.detect_many(regions, plan)
+
+    # Шовный режим: дефекты, упёршиеся в край тайла, переопределяем
+    # по узкой полосе вокруг стыка, затем сливаем всё в координатах панорамы
+    if SEAM_AWARE and plan.count > 1:
+        regions = []
+        for seam in touched_seams(detections, plan, SEAM_MARGIN):
+            strip = plan.seam_strip(seam, SEAM_STRIP_WIDTH)
+            regions.append((img[:, strip], seam + 1, strip.start))
+        detections.extend(await client.detect_many(regions, plan))
+        with timed("merge"), span("merge", detections=len(detections)):
+            detections = await executors.run("merge", merge_detections, detections, plan)
+
+    count_defects(d["class"] for d in detections)
+    return detections
+
+
+async def detect_coarse(client: MLClient, img: np.ndarray, plan: TilePlan) -> list[dict]:
+    """
+    Быстрый проход по панораме, уменьшенной до COARSE_HEIGHT по высоте.
+    Тайлы берутся шириной до imgsz, поэтому их в разы меньше, чем в полном
+    проходе. Детекции возвращаются в координатах исходной панорамы.
+    """
+    scale = min(1.0, COARSE_HEIGHT / plan.height)
+    with span("slice", panorama_width=plan.width, panorama_height=plan.height, scale=scale):
+        small = await executors.run(
+            "resize", cv2.resize,
+            img,
+            (max(1, round(plan.width * scale)), max(1, round(plan.height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+        sh, sw = small.shape[:2]
+        small_plan = plan_tiles(sw, sh, plan.imgsz, max_aspect=plan.imgsz / sh)
+
+        tiles = zip(tile_views(small, small_plan), small_plan.offsets)
+        regions = [(tile, idx, offset) for idx, (tile, offset) in enumerate(tiles, start=1)]
+    detections = await client.detect_many(regions, small_plan)
+    with timed("merge"), span("merge", detections=len(detections)):
+        detections = await executors.run("merge", merge_detections, detections, small_plan)
+
+    return rescale_detections(detections, plan.width / sw, plan)
+
+
+async def refine_regions(
+    client: MLClient,
+    img: np.ndarray,
+    plan: TilePlan,
+    coarse: list[dict]
+) -> list[dict]:
+    """
+    Уточнение в исходном разрешении только тех областей, где быстрый
+    проход что-то нашёл. Окна вокруг детекций объединяются и режутся
+    на тайлы тем же планировщиком.
+    """
+    spans = [(d["box"][0], d["box"][2]) for d in coarse]
+    regions = []
+    for win in refine_windows(plan, spans):
+        sub = plan_tiles(win.stop - win.start, plan.height, plan.imgsz)
+        for tile, offset in zip(tile_views(img[:, win], sub), sub.offsets):
+            x0 = win.start + offset
+            regions.append((tile, plan.tile_index(x0 + sub.tile_width / 2), x0))
+    detections = await client.detect_many(regions, plan)
+    with timed("merge"), span("merge", detections=len(detections)):
+        return await executors.run("merge", merge_detections, detections, plan)
+
+
+def with_tier(detections: list[dict], tier: str) -> list[dict]:
+    """Пометить детекции проходом, на котором они получены."""
+    return [{**d, "tier": tier} for d in detections]
+
+
+def group_by_tile(detections: list[dict], plan: TilePlan) -> list[dict]:
+    """
+    Разложить детекции по тайлам в формате ответа API.
+
+    Returns:
+        list[dict]: По записи на тайл — status и defects с полями
+            class, confidence, index, coordinates, length (и tier
+            в прогрессивном режиме).
+    """
+    per_tile: list[list[dict]] = [[] for _ in range(plan.count)]
+    for d in detections:
+        defect = {
+            "class":       d["class"],
+            "confidence":  f"{d['confidence']*100:.2f}%",
+            "index":       d["index"],
+            "coordinates": d["coordinates"],
+            "length":      d["length"],
+        }
+        if "tier" in d:
+            defect["tier"] = d["tier"]
+        per_tile[d["index"] - 1].append(defect)
+    return [
+        {"status": "success" if defects else "no_defects", "defects": defects}
+        for defects in per_tile
+    ]
@@ -27,4 +27,10 @@ class GetImage(BaseModel):
 
 class PredictResult(BaseModel):
     status: str
-    defects: list[dict[str, str | float]]
\ No newline at end of file
+    defects: list[dict[str, str | float]]
+
+
+class ProgressiveResult(BaseModel):
+    predict_id: int
+    stage: str
+    results: list[PredictResult]
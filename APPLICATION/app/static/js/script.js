@@ -56,18 +56,26 @@ document.addEventListener('DOMContentLoaded', () => {
             const formData = new FormData();
             formData.append('file', file);
 
-            // Send to predict endpoint
-            const predictResponse = await fetch('/api/predict', {
+            // Send to predict endpoint (progressive: coarse answer first)
+            const predictResponse = await fetch('/api/predict?progressive=true', {
                 method: 'POST',
                 body: formData
             });
 
+            if (predictResponse.status === 429 || predictResponse.status === 503) {
+                const retryAfter = predictResponse.headers.get('Retry-After') || '10';
+                throw new Error(`Сервис перегружен, повторите попытку через ${retryAfter} с`);
+            }
             if (!predictResponse.ok) {
                 throw new Error(`Ошибка анализа: ${predictResponse.status}`);
             }
 
             const predictData = await predictResponse.json();
-            displayDefects(predictData);
+            displayDefects(predictData.results, predictData.stage);
+            loader.style.display = 'none';
+
+            // Poll until the full-resolution pass has updated the record
+            await pollPrediction(predictData.predict_id);
 
             // Send to upload endpoint
             const uploadResponse = await fetch('/upload', {
@@ -106,6 +114,24 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    async function pollPrediction(predictId, intervalMs = 1500) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+            const response = await fetch(`/api/predict/${predictId}`);
+            if (!response.ok) {
+                throw new Error(`Ошибка получения результата: ${response.status}`);
+            }
+            const data = await response.json();
+            if (data.stage === 'failed') {
+                throw new Error('Полный анализ не завершён');
+            }
+            displayDefects(data.results, data.stage);
+            if (data.stage === 'full') {
+                return data;
+            }
+        }
+    }
+
     function createDownloadLink(reportUrl, filename = 'report') {
         const container = document.getElementById('downloadReportContainer');
         if (!container) {
@@ -133,9 +159,28 @@ document.addEventListener('DOMContentLoaded', () => {
         `;
     }
 
-    function displayDefects(results) {
+    const STAGE_LABELS = {
+        coarse: 'Предварительный результат (уменьшенное изображение), идёт уточнение...',
+        refined: 'Найденные области уточнены, идёт полный анализ...',
+        full: ''
+    };
+
+    const TIER_LABELS = {
+        coarse: 'предварительно',
+        refined: 'уточнено',
+        full: 'полный анализ'
+    };
+
+    function displayDefects(results, stage = 'full') {
         defectsList.innerHTML = '';
 
+        if (STAGE_LABELS[stage]) {
+            const stageNote = document.createElement('p');
+            stageNote.className = 'stage-note';
+            stageNote.textContent = STAGE_LABELS[stage];
+            defectsList.appendChild(stageNote);
+        }
+
         if (!Array.isArray(results)) {
             defectsList.innerHTML = `
                 <div class="error">
@@ -208,6 +253,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         <p class="defect-confidence"><strong>Уверенность:</strong> ${defect.confidence}</p>
                         <p class="defect-coordinates"><strong>Координаты:</strong> ${defect.coordinates}</p>
                         <p class="defect-length"><strong>Длина по линейке:</strong> ${defect.length}</p>
+                        ${defect.tier ? `<p class="defect-tier"><strong>Проход:</strong> ${TIER_LABELS[defect.tier] || defect.tier}</p>` : ''}
                     `;
                     partDiv.appendChild(defectItem);
                 });
@@ -1,14 +1,15 @@
 import asyncio
 from fastapi import HTTPException
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 from datetime import datetime
 import cv2
 import numpy as np
 from pathlib import Path
 
+from common.metrics import timed
+from common.tiling import TilePlan, plan_for_image, tile_views
 
+
+@timed("encode")
 def ndarray_to_bytes(image_array: np.ndarray, format: str = "jpg") -> bytes:
     if format.lower() == "jpg":
         ext = ".jpg"
@@ -52,22 +53,20 @@ async def run_visualization_async(image_path: str, weights: str = "last.pt", con
             detail=f"Системная ошибка: {str(e)}"
         )
 
-def _slice_panorama(img: np.ndarray) -> list[np.ndarray]:
-    """Нарезка панорамы на тайлы"""
-    SIZE_MAP = {
-        (31920, 1152): 28,
-        (30780, 1152): 27,
-        (18144, 1142): 16,
-    }
-    h, w = img.shape[:2]
-    tiles = SIZE_MAP.get((w, h))
-    if tiles is None:
-        raise ValueError(f"Неизвестный размер панорамы {w}×{h}")
-    tw = w // tiles
-    return [img[:, i * tw:(i + 1) * tw] for i in range(tiles)]
+def _slice_panorama(img: np.ndarray, plan: TilePlan | None = None) -> list[np.ndarray]:
+    """Нарезка панорамы на тайлы (view без копирования) по плану common.tiling"""
+    if plan is None:
+        plan = plan_for_image(img)
+    return tile_views(img, plan)
 
 
-def create_defects_report(data, output_filename="static/reports/defects_report.docx"):
+def _new_report(title_text):
+    """Документ отчёта: стиль, заголовок и дата создания."""
+    # python-docx (lxml) нужен только отчёту — не грузим его при старте
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+
     doc = Document()
 
     style = doc.styles['Normal']
@@ -75,42 +74,63 @@ def create_defects_report(data, output_filename="static/reports/defects_report.d
     font.name = 'Times New Roman'
     font.size = Pt(12)
 
-    title = doc.add_heading('Отчет о дефектах', level=1)
+    title = doc.add_heading(title_text, level=1)
     title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
 
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     date_paragraph = doc.add_paragraph(f"Дата создания отчета: {current_time}")
     date_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    return doc
 
-    table = doc.add_table(rows=1, cols=6)
+
+def _add_table(doc, headers):
+    """Таблица с жирной строкой заголовков."""
+    table = doc.add_table(rows=1, cols=len(headers))
     table.style = 'Table Grid'
 
     hdr_cells = table.rows[0].cells
-    hdr_cells[0].text = '№'
-    hdr_cells[1].text = 'Тип дефекта'
-    hdr_cells[2].text = 'Уверенность'
-    hdr_cells[3].text = 'Индекс'
-    hdr_cells[4].text = 'Координаты'
-    hdr_cells[5].text = 'Длина по линейке'
+    for cell, text in zip(hdr_cells, headers):
+        cell.text = text
 
     for cell in hdr_cells:
         paragraphs = cell.paragraphs
         for paragraph in paragraphs:
             for run in paragraph.runs:
                 run.font.bold = True
+    return table
 
-    defect_counter = 1
+
+def _iter_defects(data):
     for item in data:
         if item["status"] == "success" and item["defects"]:
-            for defect in item["defects"]:
-                row_cells = table.add_row().cells
-                row_cells[0].text = str(defect_counter)
-                row_cells[1].text = defect["class"]
-                row_cells[2].text = defect["confidence"]
-                row_cells[3].text = str(defect["index"])
-                row_cells[4].text = defect["coordinates"]
-                row_cells[5].text = str(defect["length"])
-                defect_counter += 1
+            yield from item["defects"]
+
+
+def _add_signature(doc):
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+
+    doc.add_paragraph("\n")
+    sign_paragraph = doc.add_paragraph("Ответственный: _________________________")
+    sign_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
+
+
+DEFECT_COLUMNS = ['Тип дефекта', 'Уверенность', 'Индекс', 'Координаты', 'Длина по линейке']
+
+
+def _defect_cells(defect):
+    return [defect["class"], defect["confidence"], str(defect["index"]), defect["coordinates"], str(defect["length"])]
+
+
+def create_defects_report(data, output_filename="static/reports/defects_report.docx"):
+    doc = _new_report('Отчет о дефектах')
+    table = _add_table(doc, ['№'] + DEFECT_COLUMNS)
+
+    defect_counter = 1
+    for defect in _iter_defects(data):
+        row_cells = table.add_row().cells
+        for cell, text in zip(row_cells, [str(defect_counter)] + _defect_cells(defect)):
+            cell.text = text
+        defect_counter += 1
 
     total_defects = defect_counter - 1
     stats_paragraph = doc.add_paragraph()
@@ -118,17 +138,58 @@ def create_defects_report(data, output_filename="static/reports/defects_report.d
     stats_paragraph.add_run(f"Всего обнаружено дефектов: {total_defects}\n")
 
     defect_types = {}
-    for item in data:
-        if item["status"] == "success" and item["defects"]:
-            for defect in item["defects"]:
-                defect_type = defect["class"]
-                defect_types[defect_type] = defect_types.get(defect_type, 0) + 1
+    for defect in _iter_defects(data):
+        defect_type = defect["class"]
+        defect_types[defect_type] = defect_types.get(defect_type, 0) + 1
 
     for defect_type, count in defect_types.items():
         stats_paragraph.add_run(f"{defect_type}: {count}\n")
 
-    doc.add_paragraph("\n")
-    sign_paragraph = doc.add_paragraph("Ответственный: _________________________")
-    sign_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
+    _add_signature(doc)
+    doc.save(output_filename)
+
+
+def create_series_report(series, output_filename="static/reports/series_report.docx"):
+    """
+    Сводный отчёт по серии панорам (пакетная загрузка): одна таблица
+    дефектов с колонкой панорамы, статистика по типам и по панорамам.
+
+    Args:
+        series: Список словарей filename, status ("success" или "failed"),
+            results — результаты по тайлам в формате ответа /api/predict,
+            error — причина для неудавшихся панорам.
+        output_filename: Путь к файлу .docx.
+    """
+    doc = _new_report('Отчет о дефектах серии панорам')
+    table = _add_table(doc, ['№', 'Панорама'] + DEFECT_COLUMNS)
+
+    defect_counter = 1
+    defect_types = {}
+    per_panorama = []
+    for panorama in series:
+        found = 0
+        for defect in _iter_defects(panorama.get("results") or []):
+            row_cells = table.add_row().cells
+            for cell, text in zip(row_cells, [str(defect_counter), panorama["filename"]] + _defect_cells(defect)):
+                cell.text = text
+            defect_counter += 1
+            found += 1
+            defect_types[defect["class"]] = defect_types.get(defect["class"], 0) + 1
+        per_panorama.append((panorama, found))
+
+    stats_paragraph = doc.add_paragraph()
+    stats_paragraph.add_run("Статистика:\n").bold = True
+    stats_paragraph.add_run(f"Панорам в серии: {len(series)}\n")
+    stats_paragraph.add_run(f"Всего обнаружено дефектов: {defect_counter - 1}\n")
+    for defect_type, count in defect_types.items():
+        stats_paragraph.add_run(f"{defect_type}: {count}\n")
+
+    stats_paragraph.add_run("По панорамам:\n").bold = True
+    for panorama, found in per_panorama:
+        if panorama["status"] == "failed":
+            stats_paragraph.add_run(f"{panorama['filename']}: не обработана ({panorama.get('error', '')})\n")
+        else:
+            stats_paragraph.add_run(f"{panorama['filename']}: {found}\n")
 
+    _add_signature(doc)
     doc.save(output_filename)
\ No newline at end of file
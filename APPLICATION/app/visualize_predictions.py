@@ -2,16 +2,32 @@
 # app/visualize_predictions.py
 
 from __future__ import annotations
+import importlib.util
 import os
 from pathlib import Path
 import cv2
 import numpy as np
-from ultralytics import YOLO
 from PIL import Image, ImageDraw, ImageFont
 import yaml
-from matplotlib import font_manager as fm
 from typing import Tuple, List, Dict, Any
 
+from common.metrics import timed
+from common.tiling import TilePlan, plan_for_image, tile_views, join_tiles
+
+FONT_FILE = "DejaVuSans.ttf"
+
+
+def _font_path() -> str | None:
+    """
+    Путь к DejaVu Sans в пакете matplotlib (ставится вместе с ultralytics)
+    без импорта самого matplotlib. None — matplotlib не установлен.
+    """
+    spec = importlib.util.find_spec("matplotlib")
+    if spec is None or spec.origin is None:
+        return None
+    path = Path(spec.origin).parent / "mpl-data" / "fonts" / "ttf" / FONT_FILE
+    return str(path) if path.is_file() else None
+
 
 class PanoramaProcessor:
     """
@@ -20,12 +36,6 @@ class PanoramaProcessor:
     """
 
     def __init__(self):
-        # Карта известных размеров панорам и числа тайлов
-        self.SIZE_MAP = {
-            (31920, 1152): 28,
-            (30780, 1152): 27,
-            (18144, 1142): 16,
-        }
         self.FONT_SIZE = 14
         self.FONT = self._init_font()
 
@@ -41,13 +51,17 @@ class PanoramaProcessor:
     def _init_font(self) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
         """
         Инициализация шрифта для отрисовки подписей.
-        Пытаемся загрузить DejaVu Sans, иначе используем шрифт по умолчанию.
-        """
-        try:
-            path = fm.findfont("DejaVu Sans")
-            return ImageFont.truetype(path, self.FONT_SIZE)
-        except Exception:
-            return ImageFont.load_default()
+        Пытаемся загрузить DejaVu Sans из системных шрифтов (PIL ищет их сам)
+        или из matplotlib, иначе используем шрифт по умолчанию.
+        """
+        for path in (FONT_FILE, _font_path()):
+            if path is None:
+                continue
+            try:
+                return ImageFont.truetype(path, self.FONT_SIZE)
+            except OSError:
+                pass
+        return ImageFont.load_default()
 
     def process_image(
         self,
@@ -62,7 +76,8 @@ class PanoramaProcessor:
         1. Загружает модель YOLO.
         2. Делит панораму на тайлы.
         3. Для каждого тайла выполняет предсказание, рисует коробки и собирает метаданные.
-        4. Склеивает аннотированные тайлы обратно в одну панораму.
+        4. Записывает аннотированный тайл прямо в панораму, на его место
+           в склейке (как join_tiles): в памяти одна панорама и один тайл.
         5. Сохраняет результат в OUTPUT_DIR.
 
         Возвращает:
@@ -78,7 +93,8 @@ class PanoramaProcessor:
         # Загружаем названия классов
         names = self._load_class_names(Path(yaml_path))
 
-        # Инициализируем модель
+        # Инициализируем модель (ultralytics и torch грузятся только здесь)
+        from ultralytics import YOLO
         model = YOLO(str(weights))
 
         # Читаем изображение
@@ -88,19 +104,26 @@ class PanoramaProcessor:
             raise ValueError(f"Не удалось открыть изображение: {image_path}")
 
         # Делим на тайлы
-        tiles = self._slice_panorama(img)
+        plan = plan_for_image(img)
+        tiles = self._slice_panorama(img, plan)
 
-        annotated_tiles: List[np.ndarray] = []
         metadata: List[Dict[str, Any]] = []
 
         # Обрабатываем каждый тайл
         for idx, tile in enumerate(tiles, start=1):
             # Выполняем предсказание
-            result = model.predict(tile, conf=conf_threshold, verbose=False)[0]
+            result = model.predict(tile, conf=conf_threshold, imgsz=plan.imgsz, verbose=False)[0]
 
             # Рисуем на тайле
-            annotated = self._draw_preds(tile, result, names, conf_threshold)
-            annotated_tiles.append(annotated)
+            with timed("draw"):
+                annotated = self._draw_preds(tile, result, names, conf_threshold)
+
+            # Видимая в склейке часть тайла пишется прямо в панораму: эти
+            # столбцы левее следующего тайла и на вход модели больше не попадут
+            with timed("join"):
+                visible = plan.visible_columns(idx)
+                tile[:, visible] = annotated[:, visible, ::-1]  # RGB -> BGR
+            del annotated
 
             # Собираем метаданные
             dets: List[Dict[str, Any]] = []
@@ -120,12 +143,10 @@ class PanoramaProcessor:
             status = "success" if dets else "no_defects"
             metadata.append({"status": status, "defects": dets})
 
-        # Склейка всех тайлов обратно в панораму
-        result_img = self._join_tiles(annotated_tiles)
-
-        # Сохранение
+        # Сохранение: img уже склеенная аннотированная панорама (BGR)
         output_path = os.path.join(self.OUTPUT_DIR, f"processed_{image_path.name}")
-        cv2.imwrite(output_path, cv2.cvtColor(result_img, cv2.COLOR_RGB2BGR))
+        with timed("write_result"):
+            cv2.imwrite(output_path, img)
 
         return output_path, metadata
 
@@ -136,23 +157,18 @@ class PanoramaProcessor:
         data = yaml.safe_load(yaml_path.read_text(encoding="utf-8"))
         return {int(k): v for k, v in data["names"].items()}
 
-    def _slice_panorama(self, img: np.ndarray) -> List[np.ndarray]:
+    def _slice_panorama(self, img: np.ndarray, plan: TilePlan | None = None) -> List[np.ndarray]:
         """
-        Делит панораму на список тайлов по горизонтали,
-        в зависимости от её размера.
+        Делит панораму на список тайлов по горизонтали
+        согласно плану нарезки (view без копирования).
         """
-        h, w = img.shape[:2]
-        tiles = self.SIZE_MAP.get((w, h))
-        if tiles is None:
-            raise ValueError(f"Неизвестный размер панорамы {w}×{h}")
-        tw = w // tiles
-        return [img[:, i*tw:(i+1)*tw] for i in range(tiles)]
+        return tile_views(img, plan or plan_for_image(img))
 
-    def _join_tiles(self, tiles: List[np.ndarray]) -> np.ndarray:
+    def _join_tiles(self, tiles: List[np.ndarray], plan: TilePlan) -> np.ndarray:
         """
         Склеивает список тайлов обратно в одно изображение-панораму.
         """
-        return np.concatenate(tiles, axis=1)
+        return join_tiles(tiles, plan)
 
     def _draw_preds(
         self,
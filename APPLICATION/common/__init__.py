@@ -0,0 +1,3 @@
+# APPLICATION/common/__init__.py
+#
+# Общие модули фронтенда, ML-сервиса и скриптов подготовки датасета.
@@ -0,0 +1,232 @@
+# APPLICATION/common/admission.py
+"""
+Контроль допуска (admission control) для обоих сервисов.
+
+Ограничивает объём одновременно выполняемой работы (панорамы во фронтенде,
+тайлы в ML-сервисе) и длину очереди ожидающих. Когда очередь заполнена,
+запрос сразу получает 429, а если место не освободилось за max_wait — 503.
+В обоих случаях отдаётся Retry-After, оценённый по среднему времени
+обработки. Так пиковая нагрузка не раздувает память: декодированных
+панорам и тайлов в работе не больше capacity.
+
+Фоновая работа (приём из папки сканера, app/ingest.py) ждёт места через
+acquire_background: она получает его, только когда в основной очереди
+никого нет, и никогда не получает отказ.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from common.deadline import Deadline, DeadlineExceeded
+
+
+class Overloaded(Exception):
+    """Запрос не допущен: status_code 429 или 503, retry_after в секундах."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class Permit:
+    """Разрешение на работу весом weight; release() можно вызывать повторно."""
+
+    def __init__(self, controller: "AdmissionController", weight: int):
+        self._controller = controller
+        self.weight = weight
+        self.granted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    Взвешенный семафор с ограниченной FIFO-очередью.
+
+    Args:
+        name: Имя ресурса — для сообщений об ошибке и статистики.
+        capacity: Сколько единиц работы (панорам, тайлов) выполняется одновременно.
+        queue_size: Сколько запросов может ждать; следующий получает 429.
+        max_wait: Сколько секунд запрос ждёт в очереди, прежде чем получить 503.
+
+    Все методы вызываются из одного event loop.
+    """
+
+    def __init__(self, name: str, capacity: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.queue_size = max(0, queue_size)
+        self.max_wait = max_wait
+
+        self.in_flight = 0
+        self._waiters: deque[tuple[int, asyncio.Future]] = deque()
+        self._background: deque[tuple[int, asyncio.Future]] = deque()
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # Скользящее среднее времени удержания одной единицы — для Retry-After
+        self._hold_ewma = 1.0
+        # Получает время ожидания каждого допущенного запроса (метрики)
+        self.wait_observer: Callable[[float], None] | None = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def background_waiting(self) -> int:
+        return len(self._background)
+
+    def _retry_after(self, weight: int) -> int:
+        queued = sum(w for w, _ in self._waiters) + weight
+        return max(1, math.ceil(self._hold_ewma * queued / self.capacity))
+
+    def _admit(self, weight: int, waited: float) -> Permit:
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        if self.wait_observer is not None:
+            self.wait_observer(waited)
+        return Permit(self, weight)
+
+    async def acquire(self, weight: int = 1, timeout: float | None = None) -> Permit:
+        """
+        Дождаться места и вернуть Permit; вызывающий обязан его освободить.
+        timeout (например, остаток дедлайна запроса) сокращает max_wait.
+
+        Raises:
+            Overloaded: 429 — очередь заполнена, 503 — не дождались max_wait.
+        """
+        # Пачка больше capacity занимает весь ресурс, но не блокируется навсегда
+        weight = min(max(1, weight), self.capacity)
+        if not self._waiters and self.in_flight + weight <= self.capacity:
+            self.in_flight += weight
+            return self._admit(weight, 0.0)
+
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_queue_full += 1
+            raise Overloaded(429, self._retry_after(weight), f"{self.name}: очередь заполнена")
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (weight, future)
+        self._waiters.append(entry)
+        started = time.monotonic()
+        try:
+            wait = self.max_wait if timeout is None else min(self.max_wait, timeout)
+            await asyncio.wait({future}, timeout=wait)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not future.done():
+            self._abandon(entry)
+            self.rejected_timeout += 1
+            raise Overloaded(503, self._retry_after(weight), f"{self.name}: превышено время ожидания")
+        return self._admit(weight, time.monotonic() - started)
+
+    async def acquire_until(self, deadline: Deadline, weight: int = 1) -> Permit:
+        """
+        acquire() в пределах дедлайна запроса. Запрос с исчерпанным
+        бюджетом в очередь не ставится.
+
+        Raises:
+            DeadlineExceeded: Дедлайн истёк до очереди или в очереди (504).
+            Overloaded: 429 — очередь заполнена, 503 — не дождались max_wait.
+        """
+        deadline.check()
+        # Ожидание ограничено дедлайном, а не max_wait: таймаут — это 504
+        by_deadline = deadline.remaining() < self.max_wait
+        try:
+            return await self.acquire(weight, timeout=deadline.remaining())
+        except Overloaded as e:
+            if e.status_code == 503 and (by_deadline or deadline.expired):
+                raise DeadlineExceeded(f"{self.name}: дедлайн истёк в очереди") from None
+            raise
+
+    async def acquire_background(self, weight: int = 1) -> Permit:
+        """
+        Дождаться места с приоритетом ниже acquire: место выдаётся, только
+        когда основная очередь пуста. Без отказов и без предела ожидания;
+        отмена задачи снимает её из очереди.
+        """
+        weight = min(max(1, weight), self.capacity)
+        if not self._waiters and not self._background and self.in_flight + weight <= self.capacity:
+            self.in_flight += weight
+            return self._admit(weight, 0.0)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (weight, future)
+        self._background.append(entry)
+        started = time.monotonic()
+        try:
+            await asyncio.wait({future})
+        except asyncio.CancelledError:
+            self._abandon(entry, self._background)
+            raise
+        return self._admit(weight, time.monotonic() - started)
+
+    def _abandon(self, entry: tuple[int, asyncio.Future], queue: deque | None = None) -> None:
+        """Ожидающий ушёл: убрать из очереди или вернуть уже выданное место."""
+        weight, future = entry
+        if future.done():
+            self.in_flight -= weight
+            self._wake()
+        else:
+            future.cancel()
+            (self._waiters if queue is None else queue).remove(entry)
+
+    def _release(self, permit: Permit) -> None:
+        held = time.monotonic() - permit.granted_at
+        self._hold_ewma = 0.8 * self._hold_ewma + 0.2 * held / permit.weight
+        self.in_flight -= permit.weight
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight + self._waiters[0][0] <= self.capacity:
+            weight, future = self._waiters.popleft()
+            self.in_flight += weight
+            future.set_result(None)
+        # Фоновые — только при пустой основной очереди
+        while not self._waiters and self._background and self.in_flight + self._background[0][0] <= self.capacity:
+            weight, future = self._background.popleft()
+            self.in_flight += weight
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def admit(self, weight: int = 1, timeout: float | None = None) -> AsyncIterator[Permit]:
+        """async with controller.admit(): ... — acquire/release вокруг блока."""
+        permit = await self.acquire(weight, timeout)
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "background_waiting": self.background_waiting,
+            "queue_size": self.queue_size,
+            "max_wait": self.max_wait,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_mean": self.wait_seconds_total / self.admitted if self.admitted else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
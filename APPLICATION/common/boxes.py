@@ -0,0 +1,293 @@
+# APPLICATION/common/boxes.py
+"""
+Детекции в системе координат панорамы: форматирование для API и отчёта,
+поиск стыков, задетых детекциями, и глобальное слияние детекций со всех
+тайлов (NMS + склейка фрагментов, разрезанных границей тайла).
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+import numpy as np
+
+from common.tiling import TilePlan
+
+# Длина линейки на плёнке и отступ её начала от края панорамы, px
+RULER_LENGTH = 310
+RULER_ORIGIN = 2000
+
+
+def ruler_length(x1: float, x2: float, panorama_width: int) -> int:
+    """Примерная позиция дефекта по линейке, округлённая до 10."""
+    length = (int((x1 + x2 - RULER_ORIGIN) / 2 * RULER_LENGTH / panorama_width)) % RULER_LENGTH
+    if length % 10 >= 5:
+        length += 10 - length % 10
+    else:
+        length -= length % 10
+    return length
+
+
+def format_coordinates(box: Iterable[float]) -> str:
+    """
+    Строка координат в историческом формате API: y1 — нижняя граница,
+    y2 — верхняя.
+    """
+    x1, top, x2, bottom = (int(v) for v in box)
+    return f"x1={x1}, y1={bottom}, x2={x2}, y2={top}"
+
+
+def touched_seams(dets: list[dict[str, Any]], plan: TilePlan, margin: int) -> list[int]:
+    """
+    Номера стыков (0 — между 1-м и 2-м тайлом), к которым вплотную
+    подходит хотя бы одна детекция своего тайла.
+
+    Args:
+        dets (list[dict]): Детекции с полями "box" (координаты панорамы) и "index".
+        plan (TilePlan): План нарезки.
+        margin (int): Расстояние до края тайла, считающееся касанием.
+    """
+    seams: set[int] = set()
+    for d in dets:
+        i = d["index"] - 1
+        x1, _, x2, _ = d["box"]
+        left, right = plan.offsets[i], plan.offsets[i] + plan.tile_width
+        if i > 0 and x1 <= left + margin:
+            seams.add(i - 1)
+        if i < plan.count - 1 and x2 >= right - margin:
+            seams.add(i)
+    return sorted(seams)
+
+
+def _candidate_pairs(boxes: np.ndarray, classes: np.ndarray, reach: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Пары (i, j) одного класса, у которых x1[i] <= x1[j] <= x2[i] + reach.
+
+    Детекции лежат вдоль полосы панорамы, поэтому после сортировки по x1
+    кандидаты каждого бокса — непрерывный отрезок следующих за ним:
+    память и время растут с числом соседей, а не как N×N.
+    """
+    n = len(boxes)
+    order = np.argsort(boxes[:, 0], kind="stable")
+    x1 = boxes[order, 0]
+    end = np.searchsorted(x1, boxes[order, 2] + reach, side="right")
+    start = np.arange(1, n + 1)
+    counts = np.maximum(end - start, 0)
+    first = np.repeat(np.arange(n), counts)
+    # Номер внутри отрезка каждого бокса + начало отрезка
+    second = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(start, counts)
+    i, j = order[first], order[second]
+    same = classes[i] == classes[j]
+    return i[same], j[same]
+
+
+def _pair_overlap(boxes: np.ndarray, i: np.ndarray, j: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """IoU и IoS (пересечение к меньшей площади) для пар (i, j)."""
+    a, b = boxes[i], boxes[j]
+    iw = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a + area_b - inter
+    smaller = np.minimum(area_a, area_b)
+    iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+    ios = np.divide(inter, smaller, out=np.zeros_like(inter), where=smaller > 0)
+    return iou, ios
+
+
+def _seam_zones(plan: TilePlan, tol: float) -> tuple[np.ndarray, np.ndarray]:
+    """Зона стыка k: от левого края (k+1)-го тайла до правого края k-го, с допуском."""
+    offs = np.asarray(plan.offsets, dtype=np.float64)
+    return offs[1:] - tol, offs[:-1] + plan.tile_width + tol
+
+
+def _seam_adjacent(boxes: np.ndarray, i: np.ndarray, j: np.ndarray, plan: TilePlan, tol: float) -> np.ndarray:
+    """
+    Пары, где левый фрагмент кончается у стыка, а правый начинается у того
+    же стыка, с перекрытием по вертикали не меньше половины меньшего бокса.
+    В парах из _candidate_pairs x1[i] <= x1[j], так что левый — i.
+    """
+    if plan.count < 2 or len(i) == 0:
+        return np.zeros(len(i), dtype=bool)
+    lo, hi = _seam_zones(plan, tol)
+    a, b = boxes[i], boxes[j]
+    ends = (a[:, 2, None] >= lo) & (a[:, 2, None] <= hi)        # E×Z
+    starts = (b[:, 0, None] >= lo) & (b[:, 0, None] <= hi)      # E×Z
+    adj = (ends & starts).any(axis=1) & (a[:, 0] < b[:, 0])
+    vh = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    hmin = np.minimum(a[:, 3] - a[:, 1], b[:, 3] - b[:, 1])
+    return adj & (vh >= 0.5 * hmin)
+
+
+def _find(parent: list[int], x: int) -> int:
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def fuse_boxes(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    classes: np.ndarray,
+    plan: TilePlan,
+    iou_thr: float = 0.5,
+    ios_thr: float = 0.7,
+    seam_tol: float = 4.0,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Слияние детекций со всех тайлов.
+
+    Кандидаты в пары — соседи по x одного класса (развёртка по x1), а не
+    все N×N. Затем два шага:
+
+      * дубли: в порядке убывания уверенности бокс присоединяется к уже
+        оставленному боксу, который он дублирует (IoU ≥ iou_thr) или
+        в котором почти целиком лежит / который почти целиком покрывает
+        (IoS ≥ ios_thr). Сравнение только с оставленными боксами, поэтому
+        цепочка перекрытий не склеивает соседние отдельные дефекты;
+      * стыки: группы, чьи фрагменты — две половины дефекта по разные
+        стороны стыка, объединяются (union-find по рёбрам-стыкам; дефект
+        может тянуться через несколько тайлов).
+
+    Группа заменяется боксом-объединением с максимальной уверенностью.
+
+    Args:
+        boxes (np.ndarray): N×4, x1, y1, x2, y2 в координатах панорамы.
+        scores (np.ndarray): N уверенностей.
+        classes (np.ndarray): N целочисленных идентификаторов классов.
+        plan (TilePlan): План нарезки, по которому искались детекции.
+
+    Returns:
+        tuple: (fused_boxes K×4, fused_scores K, representative N→K индексы
+        исходной детекции с максимальной уверенностью в каждой компоненте).
+    """
+    n = len(boxes)
+    if n == 0:
+        return boxes.reshape(0, 4), scores, np.zeros(0, dtype=np.intp)
+
+    boxes = boxes.astype(np.float64)
+    reach = 0.0
+    if plan.count >= 2:
+        lo, hi = _seam_zones(plan, seam_tol)
+        reach = max(0.0, float((hi - lo).max()))
+    i, j = _candidate_pairs(boxes, classes, reach)
+    iou, ios = _pair_overlap(boxes, i, j)
+    dup = (iou >= iou_thr) | (ios >= ios_thr)
+    seam = _seam_adjacent(boxes, i, j, plan, seam_tol)
+
+    # Соседи-дубли каждого бокса (CSR по обоим концам пары)
+    di, dj = i[dup], j[dup]
+    src = np.concatenate([di, dj])
+    dst = np.concatenate([dj, di])
+    by_src = np.argsort(src, kind="stable")
+    bounds = np.searchsorted(src[by_src], np.arange(n + 1))
+    neighbours = dst[by_src].tolist()
+    bounds = bounds.tolist()
+
+    # Дубли: присоединение к оставленному боксу с наибольшей уверенностью
+    parent = list(range(n))
+    kept = [False] * n
+    rank = np.empty(n, dtype=np.intp)
+    by_score = np.argsort(-scores, kind="stable")
+    rank[by_score] = np.arange(n)
+    rank = rank.tolist()
+    for b in by_score.tolist():
+        best = -1
+        for other in neighbours[bounds[b]:bounds[b + 1]]:
+            if kept[other] and (best < 0 or rank[other] < rank[best]):
+                best = other
+        if best < 0:
+            kept[b] = True
+        else:
+            parent[b] = best
+
+    # Стыки: union-find по рёбрам между группами
+    for a, b in zip(i[seam].tolist(), j[seam].tolist()):
+        ra, rb = _find(parent, a), _find(parent, b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+
+    labels = np.array([_find(parent, x) for x in range(n)])
+    _, comp = np.unique(labels, return_inverse=True)
+    k = comp.max() + 1
+
+    fused = np.empty((k, 4), dtype=np.float64)
+    fused[:, :2] = np.inf
+    fused[:, 2:] = -np.inf
+    np.minimum.at(fused[:, 0], comp, boxes[:, 0])
+    np.minimum.at(fused[:, 1], comp, boxes[:, 1])
+    np.maximum.at(fused[:, 2], comp, boxes[:, 2])
+    np.maximum.at(fused[:, 3], comp, boxes[:, 3])
+
+    # Представитель компоненты — детекция с максимальной уверенностью
+    order = np.lexsort((-scores, comp))
+    first = np.r_[True, comp[order][1:] != comp[order][:-1]]
+    rep = order[first]
+    return fused, scores[rep], rep
+
+
+def merge_detections(
+    dets: list[dict[str, Any]],
+    plan: TilePlan,
+    iou_thr: float = 0.5,
+    ios_thr: float = 0.7,
+    seam_tol: float = 4.0,
+) -> list[dict[str, Any]]:
+    """
+    Слить детекции всех тайлов (и полос вокруг стыков) в один список
+    без дублей. У объединённых детекций пересчитываются box, coordinates,
+    length и index (тайл, в который попадает центр бокса).
+
+    Args:
+        dets (list[dict]): Ответы ML-сервиса с полями class, confidence, box.
+        plan (TilePlan): План нарезки панорамы.
+
+    Returns:
+        list[dict]: Детекции, отсортированные по x1.
+    """
+    if not dets:
+        return []
+    boxes = np.array([d["box"] for d in dets], dtype=np.float64)
+    scores = np.array([d["confidence"] for d in dets], dtype=np.float64)
+    _, classes = np.unique([d["class"] for d in dets], return_inverse=True)
+
+    fused, fused_scores, rep = fuse_boxes(boxes, scores, classes, plan, iou_thr, ios_thr, seam_tol)
+
+    merged = []
+    for box, score, r in zip(fused.round().astype(int).tolist(), fused_scores.tolist(), rep.tolist()):
+        x1, _, x2, _ = box
+        merged.append({
+            **dets[r],
+            "confidence":  score,
+            "box":         box,
+            "coordinates": format_coordinates(box),
+            "index":       plan.tile_index((x1 + x2) / 2),
+            "length":      ruler_length(x1, x2, plan.width),
+        })
+    merged.sort(key=lambda d: d["box"][0])
+    return merged
+
+
+def rescale_detections(dets: list[dict[str, Any]], factor: float, plan: TilePlan) -> list[dict[str, Any]]:
+    """
+    Перевести детекции уменьшенной панорамы в координаты исходной.
+
+    Args:
+        dets (list[dict]): Детекции с полем "box" в координатах уменьшенной панорамы.
+        factor (float): Во сколько раз исходная панорама больше уменьшенной.
+        plan (TilePlan): План нарезки исходной панорамы.
+    """
+    out = []
+    for d in dets:
+        box = [min(round(v * factor), lim) for v, lim in zip(d["box"], (plan.width, plan.height) * 2)]
+        x1, _, x2, _ = box
+        out.append({
+            **d,
+            "box":         box,
+            "coordinates": format_coordinates(box),
+            "index":       plan.tile_index((x1 + x2) / 2),
+            "length":      ruler_length(x1, x2, plan.width),
+        })
+    return out
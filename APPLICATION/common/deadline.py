@@ -0,0 +1,158 @@
+# APPLICATION/common/deadline.py
+"""
+Дедлайны запросов и отмена работы для ушедших клиентов.
+
+Дедлайн передаётся между сервисами заголовком X-Deadline-Ms — оставшимся
+бюджетом в миллисекундах на момент отправки (а не абсолютным временем,
+чтобы не зависеть от расхождения часов). Каждый сервис переводит его
+в свой monotonic-дедлайн, урезает таймауты исходящих запросов и
+отбрасывает работу, которая уже никому не нужна.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable
+
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+# Как часто RequestGuard проверяет, не отключился ли клиент, с
+DISCONNECT_POLL = 0.5
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени запроса исчерпан (отдаётся как 504)."""
+
+
+class RequestAborted(Exception):
+    """Клиент отключился, ответ никому не нужен (отдаётся как 499)."""
+
+
+class Deadline:
+    """Момент, к которому запрос должен быть обработан (по time.monotonic)."""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, value: str | None, default: float | None = None) -> "Deadline | None":
+        """
+        Дедлайн из заголовка X-Deadline-Ms; если задан и default (с),
+        берётся более ранний. Некорректный заголовок игнорируется.
+        """
+        seconds = default
+        if value:
+            try:
+                budget = max(0.0, float(value) / 1000)
+            except ValueError:
+                budget = None
+            if budget is not None:
+                seconds = budget if seconds is None else min(seconds, budget)
+        return cls(seconds) if seconds is not None else None
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self) -> None:
+        if self.expired:
+            raise DeadlineExceeded("Превышен дедлайн запроса")
+
+    def header(self) -> dict[str, str]:
+        """Заголовок для исходящего запроса с оставшимся бюджетом."""
+        return {DEADLINE_HEADER: str(int(self.remaining() * 1000))}
+
+
+class CancellationStats:
+    """Счётчики брошенной работы: запросы по причине и отброшенные тайлы."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests_aborted = 0
+        self.requests_expired = 0
+        self.tiles_dropped = 0
+
+    def record(self, reason: BaseException | None = None, tiles: int = 0) -> None:
+        with self._lock:
+            if isinstance(reason, DeadlineExceeded):
+                self.requests_expired += 1
+            elif isinstance(reason, (RequestAborted, asyncio.CancelledError)):
+                self.requests_aborted += 1
+            self.tiles_dropped += tiles
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "requests_aborted": self.requests_aborted,
+                "requests_expired": self.requests_expired,
+                "tiles_dropped": self.tiles_dropped,
+            }
+
+
+# Один набор счётчиков на процесс сервиса
+cancellations = CancellationStats()
+
+
+class RequestGuard:
+    """
+    Следит за входящим запросом: клиент отключился или дедлайн истёк —
+    текущая работа отменяется.
+
+    Args:
+        request: Запрос Starlette/FastAPI (нужен только is_disconnected()).
+        deadline: Дедлайн запроса или None.
+    """
+
+    def __init__(self, request: Any, deadline: Deadline | None = None):
+        self.request = request
+        self.deadline = deadline
+
+    async def check(self) -> None:
+        """
+        Проверить, нужна ли ещё работа; брошенный запрос учитывается в cancellations.
+
+        Raises:
+            RequestAborted: Клиент отключился.
+            DeadlineExceeded: Дедлайн истёк.
+        """
+        try:
+            if await self.request.is_disconnected():
+                raise RequestAborted("Клиент отключился")
+            if self.deadline is not None:
+                self.deadline.check()
+        except (RequestAborted, DeadlineExceeded) as e:
+            cancellations.record(e)
+            raise
+
+    async def run(self, awaitable: Awaitable) -> Any:
+        """
+        Выполнить awaitable, отменив его (вместе с запросами в полёте),
+        как только клиент отключится или истечёт дедлайн.
+        """
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while True:
+                timeout = DISCONNECT_POLL
+                if self.deadline is not None:
+                    timeout = min(timeout, self.deadline.remaining())
+                done, _ = await asyncio.wait({task}, timeout=timeout)
+                if done:
+                    try:
+                        return task.result()
+                    except DeadlineExceeded as e:
+                        cancellations.record(e)
+                        raise
+                try:
+                    await self.check()
+                except (RequestAborted, DeadlineExceeded):
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    raise
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
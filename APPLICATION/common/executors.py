@@ -0,0 +1,219 @@
+# APPLICATION/common/executors.py
+"""
+Пулы исполнителей для CPU-стадий обоих сервисов.
+
+Event loop только принимает запросы и ждёт ответов. Всё, что занимает
+процессор (декодирование и кодирование изображений, инференс, отрисовка,
+слияние детекций, отчёт), выполняется в пуле:
+
+    img = await run("decode", cv2.imdecode, buf, cv2.IMREAD_COLOR)
+
+Пулы:
+  * thread — потоки для OpenCV, numpy и torch: они отпускают GIL, поэтому
+    стадии идут параллельно друг другу и event loop. Контекст вызова
+    (трасса, учёт памяти запроса) переносится в поток;
+  * process — процессы для стадий на чистом Python (отчёт python-docx):
+    в потоке они держали бы GIL и тормозили event loop. Аргументы и
+    результат передаются через pickle, функция должна быть на уровне модуля
+    (импорт модуля в процессе пула не должен поднимать приложение).
+
+Стадия попадает в пул по EXECUTOR_STAGES ("report=process,merge=thread"),
+остальные — в thread. Размеры пулов — EXECUTOR_THREADS и
+EXECUTOR_PROCESSES; при EXECUTOR_PROCESSES=0 стадии process выполняются
+в thread. Свой пул подключается через register(). Пулы создаются при
+первой задаче. Насыщенность (занятые воркеры, очередь, ожидание в
+очереди) отдают stats() и метрики weld_executor_* (common.metrics).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator
+
+EXECUTOR_THREADS   = int(os.getenv("EXECUTOR_THREADS", str(min(32, (os.cpu_count() or 1) + 4))))
+EXECUTOR_PROCESSES = int(os.getenv("EXECUTOR_PROCESSES", "1"))
+EXECUTOR_STAGES    = os.getenv("EXECUTOR_STAGES", "report=process")
+
+THREAD = "thread"
+PROCESS = "process"
+
+
+def _parse_stages(spec: str) -> dict[str, str]:
+    stages = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        stage, _, pool = item.partition("=")
+        stages[stage.strip()] = pool.strip() or THREAD
+    return stages
+
+
+def _call(fn: Callable, args: tuple, kwargs: dict, submitted: float) -> tuple[float, Any]:
+    """Выполнить fn в воркере; вернуть и время ожидания в очереди пула."""
+    return time.time() - submitted, fn(*args, **kwargs)
+
+
+class Pool:
+    """
+    Пул исполнителя с учётом насыщенности.
+
+    Args:
+        name: Имя пула (метка метрик).
+        factory: Создаёт Executor при первой задаче.
+        workers: Число воркеров.
+        copy_context: Переносить contextvars в воркер (только для потоков).
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Executor], workers: int, copy_context: bool = False):
+        self.name = name
+        self.workers = workers
+        self.copy_context = copy_context
+        self._factory = factory
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self.pending = 0                 # отправлено и ещё не завершено
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # Получает время ожидания каждой задачи в очереди — метрики
+        self.wait_observer: Callable[[float], None] | None = None
+
+    @property
+    def active(self) -> int:
+        return min(self.pending, self.workers)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending - self.workers)
+
+    def executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._factory()
+        return self._executor
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Выполнить fn(*args, **kwargs) в пуле и дождаться результата."""
+        if self.copy_context:
+            fn, args = contextvars.copy_context().run, (fn, *args)
+        future = self.executor().submit(_call, fn, args, kwargs, time.time())
+        with self._lock:
+            self.pending += 1
+        future.add_done_callback(self._done)
+        waited, result = await asyncio.wrap_future(future)
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        if self.wait_observer is not None:
+            self.wait_observer(waited)
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        done = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "started": self._executor is not None,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_seconds_mean": self.wait_seconds_total / done if done else 0.0,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+_pools: dict[str, Pool] = {
+    THREAD: Pool(
+        THREAD,
+        lambda: ThreadPoolExecutor(EXECUTOR_THREADS, thread_name_prefix="cpu"),
+        EXECUTOR_THREADS,
+        copy_context=True,
+    ),
+}
+if EXECUTOR_PROCESSES > 0:
+    # spawn: процессы пула не наследуют потоки, CUDA и сокеты родителя
+    _pools[PROCESS] = Pool(
+        PROCESS,
+        lambda: ProcessPoolExecutor(EXECUTOR_PROCESSES, mp_context=multiprocessing.get_context("spawn")),
+        EXECUTOR_PROCESSES,
+    )
+
+_stages = _parse_stages(EXECUTOR_STAGES)
+
+
+def register(name: str, executor: Executor, workers: int, copy_context: bool = False) -> Pool:
+    """
+    Подключить свой пул (например, с другим числом потоков для инференса)
+    и направить в него стадии через EXECUTOR_STAGES или route().
+    """
+    pool = _pools[name] = Pool(name, lambda: executor, workers, copy_context)
+    return pool
+
+
+def route(stage: str, pool: str) -> None:
+    """Направить стадию в пул pool."""
+    _stages[stage] = pool
+
+
+def pool_for(stage: str) -> Pool:
+    """Пул стадии; неизвестный или выключенный пул — thread."""
+    return _pools.get(_stages.get(stage, THREAD)) or _pools[THREAD]
+
+
+async def run(stage: str, fn: Callable, *args, **kwargs) -> Any:
+    """Выполнить CPU-стадию stage в её пуле."""
+    return await pool_for(stage).run(fn, *args, **kwargs)
+
+
+async def iterate(stage: str, iterator: Iterator) -> AsyncIterator:
+    """
+    Асинхронно пройти синхронный итератор (например, генератор потокового
+    ответа), выполняя каждый шаг в пуле стадии. Генератор не передать
+    в другой процесс, поэтому шаги всегда идут в потоках.
+    """
+    pool = pool_for(stage)
+    if not pool.copy_context:
+        pool = _pools[THREAD]
+    done = object()
+    while True:
+        item = await pool.run(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def stats() -> dict[str, dict]:
+    """Насыщенность пулов и маршруты стадий (для /admission/stats)."""
+    return {
+        "pools": {name: pool.stats() for name, pool in _pools.items()},
+        "stages": dict(_stages),
+    }
+
+
+def pools() -> list[Pool]:
+    return list(_pools.values())
+
+
+def shutdown() -> None:
+    """Остановить все пулы (при остановке сервиса)."""
+    for pool in _pools.values():
+        pool.shutdown()
@@ -0,0 +1,11 @@
+# APPLICATION/common/formats.py
+"""
+Форматы файлов, общие для фронтенда и фоновых задач.
+
+Модуль без зависимостей: его импортируют и app.batch, и app.backfill,
+которому нельзя тянуть за собой стек БД.
+"""
+
+# Расширения файлов панорам, которые принимают пакетная загрузка, приём из
+# папки сканера и backfill
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp"}
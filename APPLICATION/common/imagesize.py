@@ -0,0 +1,149 @@
+# APPLICATION/common/imagesize.py
+"""
+Размер изображения без декодирования пикселей.
+
+Скриптам подготовки датасета для плана нарезки (common.tiling) нужны
+только ширина и высота панорамы. Полное декодирование PNG 31920×1152 —
+это ~110 МБ пикселей и сотни миллисекунд, а заголовок читается за
+микросекунды:
+
+  * PNG — чанк IHDR сразу за сигнатурой;
+  * JPEG — первый маркер SOFn (baseline, progressive, lossless, ...).
+
+Остальные форматы и нестандартные файлы декодируются OpenCV
+(IMREAD_UNCHANGED, как раньше в скриптах). Поворот по EXIF не
+учитывается — так же, как при IMREAD_UNCHANGED.
+
+SizeCache хранит размеры в JSON между запусками. Ключ — абсолютный
+путь, запись устаревает при смене mtime или размера файла:
+
+    with SizeCache(Path("data/.image_sizes.json")) as sizes:
+        w, h = sizes.get(img_path)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+from pathlib import Path
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# SOF0..SOF15 без DHT (C4), JPG (C8) и DAC (CC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Маркеры без поля длины
+_JPEG_STANDALONE = {0x01, *range(0xD0, 0xDA)}
+
+
+def _png_size(f) -> tuple[int, int] | None:
+    head = f.read(24)
+    if len(head) < 24 or head[:8] != PNG_SIGNATURE or head[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", head[16:24])
+    return width, height
+
+
+def _jpeg_size(f) -> tuple[int, int] | None:
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue  # мусор между сегментами
+        marker = f.read(1)
+        while marker == b"\xff":  # байты-заполнители
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code in _JPEG_STANDALONE:
+            continue
+        if code == 0xD9:  # EOI
+            return None
+        raw = f.read(2)
+        if len(raw) < 2:
+            return None
+        length = struct.unpack(">H", raw)[0]
+        if code in _JPEG_SOF:
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            height, width = struct.unpack(">HH", sof[1:5])
+            # Высота 0 — она задана маркером DNL после данных
+            return (width, height) if height else None
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def probe(path: str | os.PathLike) -> tuple[int, int]:
+    """
+    Ширина и высота изображения: из заголовка PNG/JPEG, иначе — декодированием.
+
+    Raises:
+        ValueError: Файл не читается как изображение.
+    """
+    with open(path, "rb") as f:
+        size = _png_size(f)
+        if size is None:
+            f.seek(0)
+            size = _jpeg_size(f)
+    if size is not None:
+        return size
+
+    import cv2
+
+    img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"Не удалось открыть {path}")
+    h, w = img.shape[:2]
+    return w, h
+
+
+class SizeCache:
+    """
+    Размеры изображений, сохраняемые в JSON между запусками скриптов.
+
+    Args:
+        path: Файл кэша; None — только в памяти.
+    """
+
+    def __init__(self, path: Path | None):
+        self.path = path
+        self._entries: dict[str, list] = {}
+        self._dirty = False
+        if path is not None and path.exists():
+            try:
+                self._entries = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._entries = {}  # испорченный кэш просто строится заново
+
+    def get(self, image: str | os.PathLike) -> tuple[int, int]:
+        """(ширина, высота) изображения; при промахе — probe() и запись в кэш."""
+        image = Path(image).resolve()
+        st = image.stat()
+        key = str(image)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2], entry[3]
+        width, height = probe(image)
+        self._entries[key] = [st.st_mtime_ns, st.st_size, width, height]
+        self._dirty = True
+        return width, height
+
+    def save(self) -> None:
+        """Записать кэш, если он менялся (через временный файл)."""
+        if self.path is None or not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self._entries, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def __enter__(self) -> "SizeCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.save()
@@ -0,0 +1,283 @@
+# APPLICATION/common/memory.py
+"""
+Учёт памяти по стадиям конвейера и по запросам.
+
+Стадии — те же, что замеряет common.metrics.timed: на входе и выходе
+стадии он вызывает enter/leave отсюда. Для каждой стадии считается:
+
+  * прирост RSS за стадию — всегда: текущий RSS (/proc/self/statm) на
+    входе и на выходе, два чтения по несколько мкс. ru_maxrss для этого
+    не годится: это максимум за всю жизнь процесса, и после первого
+    тяжёлого запроса прирост у всех следующих был бы нулевым. Без
+    MEMORY_TRACE пик внутри стадии, уже освобождённый к выходу, не виден;
+    с MEMORY_TRACE на Linux стадия на входе сбрасывает пиковый RSS ядра
+    (VmHWM, запись «5» в /proc/self/clear_refs) и на выходе читает его,
+    так что засчитывается и промежуточный пик;
+  * пик Python-аллокаций внутри стадии (tracemalloc) — если
+    MEMORY_TRACE=1. tracemalloc замедляет аллокации в разы, это режим
+    отладки. Массивы numpy (и результаты OpenCV) он видит, тензоры torch — нет;
+  * снимок «что стадия оставила в памяти» (разница снимков tracemalloc
+    на входе и выходе, топ строк) — для стадий из MEMORY_SNAPSHOT_STAGES.
+
+Пики процесса общие, поэтому при параллельных запросах чужие аллокации
+попадают и в стадию текущего. Итоги по запросу собирает ASGI-middleware
+MemoryMiddleware; последние MEMORY_RECENT запросов и
+топ аллокаций отдаёт summary().
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable
+
+try:
+    import resource
+except ImportError:  # Windows: пиковый RSS не считается
+    resource = None
+
+MEMORY_TRACE          = os.getenv("MEMORY_TRACE", "0") == "1"
+MEMORY_TRACE_FRAMES   = int(os.getenv("MEMORY_TRACE_FRAMES", "10"))
+MEMORY_SNAPSHOT_STAGES = frozenset(filter(None, os.getenv("MEMORY_SNAPSHOT_STAGES", "").split(",")))
+MEMORY_RECENT         = int(os.getenv("MEMORY_RECENT", "50"))
+MEMORY_TOP            = int(os.getenv("MEMORY_TOP", "15"))
+
+# Сброс VmHWM меняет ru_maxrss всего процесса, поэтому только в режиме отладки
+_hwm_reset = MEMORY_TRACE and sys.platform.startswith("linux")
+
+if MEMORY_TRACE and not tracemalloc.is_tracing():
+    tracemalloc.start(MEMORY_TRACE_FRAMES)
+
+_MIB = 1024 * 1024
+# ru_maxrss в килобайтах на Linux и в байтах на macOS
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+# Максимум VmHWM до сбросов: после clear_refs ru_maxrss его уже не помнит
+_process_peak = 0
+
+
+def peak_rss() -> int:
+    """Пиковый RSS процесса с его старта, байты."""
+    if resource is None:
+        return _process_peak
+    return max(_process_peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT)
+
+
+def current_rss() -> int:
+    """Текущий RSS процесса, байты (0, если /proc недоступен)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _hwm_rss() -> int:
+    """Пиковый RSS процесса с последнего сброса (VmHWM), байты."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class _Stage:
+    __slots__ = ("name", "rss0", "rss_peak", "traced0", "traced_peak", "snapshot")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rss0 = self.rss_peak = current_rss()
+        self.traced0 = self.traced_peak = 0
+        self.snapshot = None
+
+
+class StageStats:
+    """Сводка по стадии за всё время работы процесса."""
+
+    __slots__ = ("calls", "rss_growth_total", "rss_growth_max", "traced_peak_max", "retained")
+
+    def __init__(self):
+        self.calls = 0
+        self.rss_growth_total = 0
+        self.rss_growth_max = 0
+        self.traced_peak_max = 0
+        self.retained: list[dict] = []
+
+    def as_dict(self) -> dict:
+        result = {
+            "calls": self.calls,
+            "peak_rss_growth_mib_total": self.rss_growth_total / _MIB,
+            "peak_rss_growth_mib_max": self.rss_growth_max / _MIB,
+        }
+        if MEMORY_TRACE:
+            result["alloc_peak_mib_max"] = self.traced_peak_max / _MIB
+        if self.retained:
+            result["retained_top"] = self.retained
+        return result
+
+
+_lock = threading.Lock()
+# Открытые стадии (всех запросов): tracemalloc.reset_peak() общий, поэтому
+# перед сбросом пик сначала засчитывается всем открытым стадиям
+_open: list[_Stage] = []
+_stages: dict[str, StageStats] = {}
+_recent: deque[dict] = deque(maxlen=MEMORY_RECENT)
+_request: ContextVar[dict | None] = ContextVar("memory_request", default=None)
+
+# Получает (стадия, прирост пикового RSS, пик аллокаций или None) — метрики
+stage_observer: Callable[[str, int, int | None], None] | None = None
+# Получает прирост пикового RSS за запрос — метрики
+request_observer: Callable[[int], None] | None = None
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    """Снимок tracemalloc без аллокаций самого tracemalloc."""
+    return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+def _fold_peak() -> None:
+    """Засчитать текущие пики tracemalloc и VmHWM открытым стадиям и сбросить их."""
+    global _hwm_reset, _process_peak
+    peak = tracemalloc.get_traced_memory()[1]
+    for stage in _open:
+        stage.traced_peak = max(stage.traced_peak, peak)
+    tracemalloc.reset_peak()
+    if not _hwm_reset:
+        return
+    try:
+        rss_peak = _hwm_rss()
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:  # нет /proc или прав на clear_refs: только RSS на входе и выходе
+        _hwm_reset = False
+        return
+    _process_peak = max(_process_peak, rss_peak)
+    for stage in _open:
+        stage.rss_peak = max(stage.rss_peak, rss_peak)
+
+
+def enter(name: str) -> _Stage:
+    """Начало стадии name; результат передаётся в leave()."""
+    stage = _Stage(name)
+    if MEMORY_TRACE:
+        if name in MEMORY_SNAPSHOT_STAGES:
+            stage.snapshot = _snapshot()
+        with _lock:
+            _fold_peak()
+            stage.traced0 = stage.traced_peak = tracemalloc.get_traced_memory()[0]
+            _open.append(stage)
+    return stage
+
+
+def leave(stage: _Stage) -> None:
+    """Конец стадии: сводка, итог запроса и метрики."""
+    traced = None
+    retained = None
+    if MEMORY_TRACE:
+        with _lock:
+            _fold_peak()
+            _open.remove(stage)
+        traced = max(0, stage.traced_peak - stage.traced0)
+        if stage.snapshot is not None:
+            diff = _snapshot().compare_to(stage.snapshot, "lineno")
+            retained = [_stat(s) for s in diff[:MEMORY_TOP] if s.size_diff > 0]
+    stage.rss_peak = max(stage.rss_peak, current_rss())
+    growth = max(0, stage.rss_peak - stage.rss0)
+
+    with _lock:
+        stats = _stages.get(stage.name)
+        if stats is None:
+            stats = _stages[stage.name] = StageStats()
+        stats.calls += 1
+        stats.rss_growth_total += growth
+        stats.rss_growth_max = max(stats.rss_growth_max, growth)
+        if traced is not None:
+            stats.traced_peak_max = max(stats.traced_peak_max, traced)
+        if retained is not None:
+            stats.retained = retained
+
+    report = _request.get()
+    if report is not None:
+        report["rss_peak"] = max(report["rss_peak"], stage.rss_peak)
+        entry = report["stages"].setdefault(stage.name, {"calls": 0, "peak_rss_growth_mib": 0.0})
+        entry["calls"] += 1
+        entry["peak_rss_growth_mib"] += growth / _MIB
+        if traced is not None:
+            entry["alloc_peak_mib"] = max(entry.get("alloc_peak_mib", 0.0), traced / _MIB)
+
+    if stage_observer is not None:
+        stage_observer(stage.name, growth, traced)
+
+
+def _stat(stat: tracemalloc.StatisticDiff | tracemalloc.Statistic) -> dict:
+    frame = stat.traceback[0]
+    result = {"where": f"{frame.filename}:{frame.lineno}", "mib": stat.size / _MIB, "blocks": stat.count}
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        result["mib_diff"] = stat.size_diff / _MIB
+    return result
+
+
+class MemoryMiddleware:
+    """
+    ASGI-middleware: итог по памяти для каждого запроса, в котором были
+    стадии (GET /metrics и статика в журнал не попадают).
+
+    Args:
+        app: ASGI-приложение.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rss0, started = current_rss(), time.time()
+        report = {"method": scope["method"], "path": scope["path"], "stages": {}, "rss_peak": rss0}
+        token = _request.set(report)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request.reset(token)
+            rss_peak = max(report.pop("rss_peak"), current_rss())
+            if report["stages"]:
+                growth = max(0, rss_peak - rss0)
+                report.update(
+                    started=started,
+                    seconds=time.time() - started,
+                    peak_rss_growth_mib=growth / _MIB,
+                    peak_rss_mib=peak_rss() / _MIB,
+                )
+                _recent.append(report)
+                if request_observer is not None:
+                    request_observer(growth)
+
+
+def summary(top: int = MEMORY_TOP) -> dict:
+    """
+    Состояние памяти для /debug/memory: RSS процесса, сводка по стадиям,
+    последние запросы и (с MEMORY_TRACE) топ живых аллокаций по строкам.
+    """
+    with _lock:
+        stages = {name: stats.as_dict() for name, stats in _stages.items()}
+    result = {
+        "rss_mib": current_rss() / _MIB,
+        "peak_rss_mib": peak_rss() / _MIB,
+        "tracemalloc": MEMORY_TRACE,
+        "stages": stages,
+        "recent_requests": list(_recent),
+    }
+    if MEMORY_TRACE:
+        current, peak = tracemalloc.get_traced_memory()
+        result.update(
+            traced_mib=current / _MIB,
+            top_allocations=[_stat(s) for s in _snapshot().statistics("lineno")[:top]],
+        )
+    return result
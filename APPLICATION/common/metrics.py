@@ -0,0 +1,270 @@
+# APPLICATION/common/metrics.py
+"""
+Метрики Prometheus для обоих сервисов (GET /metrics).
+
+Стадии конвейера замеряются одним помощником timed — контекстным
+менеджером или декоратором (в том числе для async-функций):
+
+    with timed("decode"):
+        img = cv2.imread(path)
+
+    @timed("encode")
+    def ndarray_to_bytes(...): ...
+
+На горячем пути это два вызова perf_counter и observe() у заранее
+найденной дочерней метрики плюс учёт памяти стадии (common.memory:
+getrusage, а с MEMORY_TRACE=1 — ещё и tracemalloc). Глубина очередей, число запросов в работе,
+загрузка пулов CPU-стадий, счётчики кэша и отмен читаются из уже
+существующих счётчиков только в момент сбора метрик, без затрат на каждый запрос.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+
+from common import executors, memory
+
+# Границы от миллисекунд (кодирование тайла) до минут (вся панорама)
+_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "weld_stage_seconds", "Длительность стадии конвейера", ["stage"], buckets=_BUCKETS
+)
+INFERENCE_SECONDS = Histogram(
+    "weld_inference_seconds", "Время инференса одного тайла моделью", ["model"], buckets=_BUCKETS
+)
+TILES = Counter(
+    "weld_tiles", "Обработанные тайлы и участки панорамы", ["kind"]
+)
+DEFECTS = Counter(
+    "weld_defects", "Найденные дефекты по классам", ["class"]
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "weld_queue_wait_seconds", "Ожидание в очереди контроля допуска", ["resource"], buckets=_BUCKETS
+)
+IN_FLIGHT = Gauge(
+    "weld_in_flight", "Единиц работы в обработке", ["resource"]
+)
+QUEUE_DEPTH = Gauge(
+    "weld_queue_depth", "Запросов в очереди контроля допуска", ["resource"]
+)
+EXECUTOR_WAIT_SECONDS = Histogram(
+    "weld_executor_wait_seconds", "Ожидание CPU-стадии в очереди пула", ["pool"], buckets=_BUCKETS
+)
+# Задержка приёма из папки сканера: от записи файла до сохранения в БД
+INGEST_LAG_SECONDS = Histogram(
+    "weld_ingest_lag_seconds", "Задержка приёма файла из папки сканера",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+)
+INGEST_FILES = Counter(
+    "weld_ingest_files", "Файлы, принятые из папки сканера", ["outcome"]
+)
+
+# Память: от мегабайта (тайл) до гигабайт (панорама и её копии)
+_BYTE_BUCKETS = tuple(2 ** p for p in range(20, 34))
+
+STAGE_PEAK_RSS_GROWTH = Histogram(
+    "weld_stage_peak_rss_growth_bytes", "Прирост RSS процесса за стадию (до пика внутри неё)",
+    ["stage"], buckets=_BYTE_BUCKETS
+)
+STAGE_ALLOC_PEAK = Histogram(
+    "weld_stage_alloc_peak_bytes", "Пик аллокаций внутри стадии (tracemalloc, MEMORY_TRACE=1)",
+    ["stage"], buckets=_BYTE_BUCKETS
+)
+REQUEST_PEAK_RSS_GROWTH = Histogram(
+    "weld_request_peak_rss_growth_bytes", "Прирост RSS процесса за запрос (до пика внутри него)",
+    buckets=_BYTE_BUCKETS
+)
+
+_children: dict[tuple[int, str], object] = {}
+
+
+def _child(metric: Histogram, label: str):
+    key = (id(metric), label)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(label)
+    return child
+
+
+class timed:
+    """
+    Замер длительности в гистограмму metric (по умолчанию
+    weld_stage_seconds{stage=...}) и памяти стадии (common.memory).
+    Ошибки и отмены тоже замеряются.
+    """
+
+    __slots__ = ("_child", "_stage", "_start", "_memory")
+
+    def __init__(self, stage: str, metric: Histogram = STAGE_SECONDS):
+        self._child = _child(metric, stage)
+        self._stage = stage
+
+    def __enter__(self) -> "timed":
+        self._memory = memory.enter(self._stage)
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._child.observe(perf_counter() - self._start)
+        memory.leave(self._memory)
+
+    def __call__(self, fn: Callable) -> Callable:
+        child, stage = self._child, self._stage
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                mem = memory.enter(stage)
+                start = perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    child.observe(perf_counter() - start)
+                    memory.leave(mem)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            mem = memory.enter(stage)
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(perf_counter() - start)
+                memory.leave(mem)
+        return wrapper
+
+
+def count_tiles(kind: str, n: int = 1) -> None:
+    TILES.labels(kind).inc(n)
+
+
+def count_defects(classes: Iterable[str]) -> None:
+    for name in classes:
+        DEFECTS.labels(name).inc()
+
+
+class _Collector:
+    """Метрики, которые вычисляются только при сборе (GET /metrics)."""
+
+    def __init__(self, collect: Callable[[], Iterator[Metric]]):
+        self.collect = collect
+
+
+def track_admission(controller) -> None:
+    """
+    Метрики common.admission.AdmissionController: работа и очередь —
+    gauge, время ожидания — гистограмма, отказы 429/503 — счётчики.
+    """
+    name = controller.name
+    IN_FLIGHT.labels(name).set_function(lambda: controller.in_flight)
+    QUEUE_DEPTH.labels(name).set_function(lambda: controller.waiting)
+    QUEUE_DEPTH.labels(f"{name}_background").set_function(lambda: controller.background_waiting)
+    controller.wait_observer = QUEUE_WAIT_SECONDS.labels(name).observe
+
+    def collect():
+        rejected = CounterMetricFamily(
+            "weld_admission_rejected", "Отказы контроля допуска", labels=["resource", "reason"]
+        )
+        rejected.add_metric([name, "queue_full"], controller.rejected_queue_full)
+        rejected.add_metric([name, "timeout"], controller.rejected_timeout)
+        yield rejected
+
+    REGISTRY.register(_Collector(collect))
+
+
+def track_cancellations(stats) -> None:
+    """Счётчики common.deadline.CancellationStats."""
+    def collect():
+        values = stats.stats()
+        requests = CounterMetricFamily(
+            "weld_cancelled_requests", "Брошенные запросы", labels=["reason"]
+        )
+        requests.add_metric(["client_gone"], values["requests_aborted"])
+        requests.add_metric(["deadline"], values["requests_expired"])
+        yield requests
+        yield CounterMetricFamily(
+            "weld_cancelled_tiles", "Тайлы, отброшенные без инференса", value=values["tiles_dropped"]
+        )
+
+    REGISTRY.register(_Collector(collect))
+
+
+def track_cache(cache) -> None:
+    """Счётчики и объём predict_service.tile_cache.TileCache."""
+    def collect():
+        values = cache.stats()
+        for key in ("hits", "misses", "evictions", "expired"):
+            yield CounterMetricFamily(f"weld_tile_cache_{key}", f"Кэш тайлов: {key}", value=values[key])
+        yield GaugeMetricFamily("weld_tile_cache_bytes", "Кэш тайлов: занятый объём", value=values["bytes"])
+        yield GaugeMetricFamily("weld_tile_cache_entries", "Кэш тайлов: записей", value=values["entries"])
+
+    REGISTRY.register(_Collector(collect))
+
+
+def track_memory() -> None:
+    """
+    Метрики common.memory: прирост RSS по стадиям и запросам,
+    пик аллокаций по стадиям (с MEMORY_TRACE=1) и пиковый RSS процесса.
+    """
+    def observe_stage(stage: str, growth: int, traced: int | None) -> None:
+        _child(STAGE_PEAK_RSS_GROWTH, stage).observe(growth)
+        if traced is not None:
+            _child(STAGE_ALLOC_PEAK, stage).observe(traced)
+
+    memory.stage_observer = observe_stage
+    memory.request_observer = REQUEST_PEAK_RSS_GROWTH.observe
+
+    def collect():
+        yield GaugeMetricFamily("weld_process_peak_rss_bytes", "Пиковый RSS процесса", value=memory.peak_rss())
+
+    REGISTRY.register(_Collector(collect))
+
+
+def track_executors() -> None:
+    """
+    Насыщенность пулов common.executors: воркеры, занятые воркеры и
+    очередь — gauge, завершённые задачи — счётчик, ожидание — гистограмма.
+    """
+    for pool in executors.pools():
+        pool.wait_observer = EXECUTOR_WAIT_SECONDS.labels(pool.name).observe
+
+    def collect():
+        workers = GaugeMetricFamily("weld_executor_workers", "Воркеров в пуле", labels=["pool"])
+        active = GaugeMetricFamily("weld_executor_active", "Занятых воркеров пула", labels=["pool"])
+        queued = GaugeMetricFamily("weld_executor_queued", "Задач в очереди пула", labels=["pool"])
+        tasks = CounterMetricFamily("weld_executor_tasks", "Завершённые задачи пула", labels=["pool", "outcome"])
+        for pool in executors.pools():
+            workers.add_metric([pool.name], pool.workers)
+            active.add_metric([pool.name], pool.active)
+            queued.add_metric([pool.name], pool.queued)
+            tasks.add_metric([pool.name, "ok"], pool.completed)
+            tasks.add_metric([pool.name, "error"], pool.failed)
+        yield from (workers, active, queued, tasks)
+
+    REGISTRY.register(_Collector(collect))
+
+
+def track_ingest(watcher) -> None:
+    """Файлы app.ingest.IngestWatcher: ждут дозаписи, в очереди, в обработке."""
+    def collect():
+        values = watcher.stats()
+        files = GaugeMetricFamily("weld_ingest_pending", "Файлы папки сканера до сохранения", labels=["state"])
+        for state in ("settling", "queued", "processing"):
+            files.add_metric([state], values[state])
+        yield files
+
+    REGISTRY.register(_Collector(collect))
+
+
+def render() -> tuple[bytes, str]:
+    """Тело и Content-Type ответа GET /metrics."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
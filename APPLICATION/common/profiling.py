@@ -0,0 +1,252 @@
+# APPLICATION/common/profiling.py
+"""
+Профилирование живых сервисов по запросу администратора.
+
+Сэмплирующий профайлер: фоновый поток каждые PROFILE_INTERVAL секунд
+снимает стеки всех потоков процесса (sys._current_frames) и копит
+время по одинаковым стекам. Результат сохраняется в PROFILE_DIR в формате
+speedscope (https://www.speedscope.app — флеймграф по каждому потоку).
+
+Два способа включить:
+  * один запрос: заголовок X-Profile: <PROFILE_TOKEN> или параметр
+    ?profile=<PROFILE_TOKEN>; имя файла придёт в заголовке ответа
+    X-Profile-File, сам файл — GET /debug/profiles/<имя>. Заголовок
+    уходит раньше, чем запрос закончится и профиль запишется; пока файл
+    сохраняется, эндпоинт отвечает 202 с Retry-After (profile_pending());
+  * окно в N секунд по всему процессу: GET /debug/profile?seconds=N
+    с тем же токеном.
+
+Пока PROFILE_TOKEN не задан, профилирование выключено: middleware не
+подключается, а эндпоинты отвечают 404. Накладных расходов нет.
+Одновременно идёт не больше одного профиля; в профиль запроса
+попадает и всё, что процесс делал параллельно с ним.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Mapping
+from urllib.parse import parse_qs
+
+PROFILE_TOKEN       = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR         = Path(os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "weld-profiles")))
+PROFILE_INTERVAL    = float(os.getenv("PROFILE_INTERVAL", "0.005"))   # период сэмплирования, с
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))  # предел окна /debug/profile
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_FILE_HEADER = "X-Profile-File"
+PROFILE_QUERY = "profile"
+
+_SAFE_NAME = re.compile(r"^[\w.-]+\.speedscope\.json$")
+
+# Один профиль за раз: сэмплер сам нагружает процесс
+_busy = threading.Lock()
+# Имена файлов профилей запросов, которые ещё не записаны
+_pending: set[str] = set()
+
+
+def enabled() -> bool:
+    """Задан ли PROFILE_TOKEN."""
+    return bool(PROFILE_TOKEN)
+
+
+def authorized(token: str | None) -> bool:
+    """Совпадает ли token с PROFILE_TOKEN (сравнение за постоянное время)."""
+    return enabled() and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def denied(headers: Mapping[str, str], query: Mapping[str, str]) -> int | None:
+    """
+    Проверка доступа к /debug/profile*: токен из заголовка X-Profile или
+    параметра ?profile=. Возвращает HTTP-статус отказа (404 — профилирование
+    выключено, 403 — неверный токен) или None, если доступ разрешён.
+    """
+    if not enabled():
+        return 404
+    if not authorized(headers.get(PROFILE_HEADER) or query.get(PROFILE_QUERY)):
+        return 403
+    return None
+
+
+class StackSampler:
+    """
+    Сэмплер стеков всех потоков процесса, кроме собственного.
+
+    Args:
+        interval: Период сэмплирования, с.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        # (имя потока, стек от корня к листу) -> секунды: каждый сэмпл весит
+        # фактическое время с предыдущего (период плывёт под нагрузкой и GIL)
+        self.samples: Counter[tuple[str, tuple[tuple[str, str, int], ...]]] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        self._thread.join()
+        return self
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = now - last, now
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples[(names.get(ident, str(ident)), tuple(stack))] += weight
+
+    def speedscope(self, name: str) -> dict[str, Any]:
+        """Профиль в формате speedscope: по профилю "sampled" на поток."""
+        frames: list[dict] = []
+        index: dict[tuple[str, str, int], int] = {}
+        profiles: dict[str, dict] = {}
+        for (thread, stack), seconds in self.samples.most_common():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                ids.append(index[frame])
+            profile = profiles.setdefault(thread, {
+                "type": "sampled", "name": thread, "unit": "seconds",
+                "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+            })
+            profile["samples"].append(ids)
+            profile["weights"].append(seconds)
+            profile["endValue"] += seconds
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "weld-defects",
+            "shared": {"frames": frames},
+            "profiles": sorted(profiles.values(), key=lambda p: -p["endValue"]),
+        }
+
+    def save(self, name: str) -> Path:
+        """Записать профиль в PROFILE_DIR; возвращает путь к файлу."""
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        path = PROFILE_DIR / f"{name}.speedscope.json"
+        # Через временный файл: недописанный профиль не должен отдаваться
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self.speedscope(name)))
+        os.replace(tmp, path)
+        return path
+
+
+def _profile_name(service: str, label: str) -> str:
+    slug = re.sub(r"[^\w]+", "_", label).strip("_") or "root"
+    return f"{service}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}"[:120]
+
+
+async def profile_window(service: str, seconds: float) -> Path | None:
+    """
+    Сэмплировать весь процесс seconds секунд (не больше PROFILE_MAX_SECONDS).
+    None — уже идёт другой профиль.
+    """
+    if not _busy.acquire(blocking=False):
+        return None
+    try:
+        sampler = StackSampler().start()
+        try:
+            await asyncio.sleep(min(max(seconds, 0.0), PROFILE_MAX_SECONDS))
+        finally:
+            # join ждёт текущий сэмпл — не в цикле событий
+            await asyncio.to_thread(sampler.stop)
+        return await asyncio.to_thread(sampler.save, _profile_name(service, f"window_{seconds:g}s"))
+    finally:
+        _busy.release()
+
+
+def profile_path(name: str) -> Path | None:
+    """Путь к сохранённому профилю; None — нет такого или имя недопустимо."""
+    if not _SAFE_NAME.match(name):
+        return None
+    path = PROFILE_DIR / name
+    return path if path.is_file() else None
+
+
+def profile_pending(name: str) -> bool:
+    """Профиль запроса name ещё снимается или записывается (файла пока нет)."""
+    return name in _pending
+
+
+class ProfileMiddleware:
+    """
+    ASGI-middleware: запрос с верным токеном выполняется под сэмплером,
+    имя файла профиля отдаётся в заголовке X-Profile-File. Файл
+    появляется после завершения запроса, до этого profile_pending(имя)
+    истинно. Подключается, только если профилирование включено (enabled()).
+
+    Args:
+        app: ASGI-приложение.
+        service: Имя сервиса — префикс имени файла.
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    def _token(self, scope) -> str | None:
+        header = PROFILE_HEADER.lower().encode()
+        for key, value in scope.get("headers", ()):
+            if key == header:
+                return value.decode("latin-1")
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        return query.get(PROFILE_QUERY, [None])[0]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not authorized(self._token(scope)):
+            await self.app(scope, receive, send)
+            return
+        if not _busy.acquire(blocking=False):
+            # Уже идёт профиль: запрос выполняется как обычно
+            await self.app(scope, receive, send)
+            return
+
+        name = _profile_name(self.service, f"{scope['method']}_{scope['path']}")
+        filename = f"{name}.speedscope.json"
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_FILE_HEADER.lower().encode(), filename.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        _pending.add(filename)
+        try:
+            sampler = StackSampler().start()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+                _busy.release()
+            await asyncio.to_thread(sampler.save, name)
+        finally:
+            _pending.discard(filename)
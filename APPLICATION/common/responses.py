@@ -0,0 +1,36 @@
+# APPLICATION/common/responses.py
+"""
+Потоковый ответ, который гарантированно освобождает свой ресурс.
+
+Разрешение контроля допуска или временный каталог серии нельзя
+освобождать только в finally генератора ответа. Если отправка упала до
+первой итерации, генератор не запускается и его finally не выполняется.
+Например, под ASGI 2.4 OSError на http.response.start Starlette
+превращает в ClientDisconnect. BackgroundTask здесь тоже не помогает:
+Starlette вызывает его только после успешной отправки.
+
+ClosingStreamingResponse вызывает on_close в finally своего __call__.
+Поэтому on_close должен быть идемпотентным: генератор может успеть
+освободить ресурс сам.
+"""
+
+from __future__ import annotations
+
+from typing import Callable
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse, вызывающий on_close() при любом завершении отправки."""
+
+    def __init__(self, content, *, on_close: Callable[[], object], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
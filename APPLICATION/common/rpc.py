@@ -0,0 +1,227 @@
+# APPLICATION/common/rpc.py
+"""
+Бинарный протокол фронтенд ↔ ML-сервис (POST /detect_batch) на msgpack.
+
+Запрос — одно сообщение с пачкой участков панорамы: пиксели идут сырыми
+байтами (или PNG), либо, если панорама лежит в разделяемой памяти
+(common.shm), только координатами участка в сегменте. Ответ — поток
+сообщений: заголовок с именами классов и затем по сообщению на участок,
+в порядке запроса. Боксы, классы и уверенности передаются типизированными
+массивами (сырые little-endian байты), без строк и JSON-чисел. Ошибка
+после начала потока приходит последним сообщением {"error", "kind"}
+(см. error()).
+
+Схемы сообщений общие для обеих сторон — этот модуль импортируют и
+app.pipeline, и predict_service.ml_service.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # без msgpack фронтенд остаётся на REST /detect
+    msgpack = None
+
+from common.boxes import format_coordinates, ruler_length
+from common.deadline import DeadlineExceeded
+
+PROTOCOL_VERSION = 1
+MEDIA_TYPE = "application/x-msgpack"
+
+# Типы массивов на проводе
+CLASS_DTYPE = np.dtype("<u2")
+SCORE_DTYPE = np.dtype("<f4")
+BOX_DTYPE   = np.dtype("<i4")
+
+# Вид ошибки в сообщении {"error": ..., "kind": ...}
+ERROR_DEADLINE = "deadline"
+
+
+def available() -> bool:
+    """Установлен ли msgpack."""
+    return msgpack is not None
+
+
+def packb(message: dict) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def unpackb(data: bytes) -> dict:
+    return msgpack.unpackb(data, raw=False)
+
+
+def unpacker() -> "msgpack.Unpacker":
+    """Потоковый распаковщик: feed() кусками, итерация — готовые сообщения."""
+    return msgpack.Unpacker(raw=False, max_buffer_size=256 * 1024 * 1024)
+
+
+# -----------------------------------------------------------------------------
+# Запрос
+# -----------------------------------------------------------------------------
+@dataclass(frozen=True)
+class TileRequest:
+    """
+    Участок панорамы в запросе. Ровно одно из полей data / bounds:
+    data — пиксели (format "raw" — C-порядок shape/dtype, "png" — файл),
+    bounds — (y0, y1, x0, x1) внутри сегмента разделяемой памяти.
+    """
+    index: int
+    offset: int
+    data: bytes | memoryview | None = None
+    format: str = "raw"
+    shape: tuple[int, ...] = ()
+    dtype: str = "|u1"
+    bounds: tuple[int, int, int, int] | None = None
+
+    @classmethod
+    def from_array(cls, region: np.ndarray, index: int, offset: int) -> "TileRequest":
+        region = np.ascontiguousarray(region)
+        return cls(index, offset, memoryview(region).cast("B"), "raw", region.shape, region.dtype.str)
+
+    def pack(self) -> dict:
+        msg: dict[str, Any] = {"index": self.index, "offset": self.offset}
+        if self.bounds is not None:
+            msg["bounds"] = list(self.bounds)
+        else:
+            msg.update(data=self.data, format=self.format, shape=list(self.shape), dtype=self.dtype)
+        return msg
+
+    @classmethod
+    def unpack(cls, msg: dict) -> "TileRequest":
+        bounds = msg.get("bounds")
+        return cls(
+            index=msg["index"],
+            offset=msg["offset"],
+            data=msg.get("data"),
+            format=msg.get("format", "raw"),
+            shape=tuple(msg.get("shape", ())),
+            dtype=msg.get("dtype", "|u1"),
+            bounds=tuple(bounds) if bounds is not None else None,
+        )
+
+    def raw_array(self) -> np.ndarray:
+        """Пиксели формата raw как массив (view на байты сообщения)."""
+        return np.frombuffer(self.data, dtype=np.dtype(self.dtype)).reshape(self.shape)
+
+
+def encode_batch(
+    tiles: Iterable[TileRequest],
+    width: int,
+    height: int,
+    segment: dict | None = None,
+) -> bytes:
+    """
+    Собрать запрос /detect_batch.
+
+    Args:
+        tiles: Участки панорамы.
+        width, height: Размер панорамы (для перевода координат и длины по линейке).
+        segment: Дескриптор сегмента разделяемой памяти (SharedPanorama.descriptor),
+            если участки заданы через bounds.
+    """
+    msg = {
+        "v": PROTOCOL_VERSION,
+        "width": width,
+        "height": height,
+        "tiles": [t.pack() for t in tiles],
+    }
+    if segment is not None:
+        msg["segment"] = segment
+    return packb(msg)
+
+
+# -----------------------------------------------------------------------------
+# Ответ
+# -----------------------------------------------------------------------------
+@dataclass(frozen=True)
+class TileResult:
+    """
+    Детекции одного участка в координатах панорамы.
+
+    classes (n,) uint16, scores (n,) float32, boxes (n, 4) int32 —
+    x1, верх, x2, низ. gate_score задан, если тайл отсёк каскадный гейт.
+    """
+    index: int
+    classes: np.ndarray
+    scores: np.ndarray
+    boxes: np.ndarray
+    gate_score: float | None = None
+
+    @classmethod
+    def empty(cls, index: int, gate_score: float | None = None) -> "TileResult":
+        return cls(
+            index,
+            np.empty(0, CLASS_DTYPE),
+            np.empty(0, SCORE_DTYPE),
+            np.empty((0, 4), BOX_DTYPE),
+            gate_score,
+        )
+
+    def pack(self) -> dict:
+        msg = {
+            "index":   self.index,
+            "classes": self.classes.astype(CLASS_DTYPE, copy=False).tobytes(),
+            "scores":  self.scores.astype(SCORE_DTYPE, copy=False).tobytes(),
+            "boxes":   self.boxes.astype(BOX_DTYPE, copy=False).tobytes(),
+        }
+        if self.gate_score is not None:
+            msg["gate_score"] = self.gate_score
+        return msg
+
+    @classmethod
+    def unpack(cls, msg: dict) -> "TileResult":
+        return cls(
+            index=msg["index"],
+            classes=np.frombuffer(msg["classes"], CLASS_DTYPE),
+            scores=np.frombuffer(msg["scores"], SCORE_DTYPE),
+            boxes=np.frombuffer(msg["boxes"], BOX_DTYPE).reshape(-1, 4),
+            gate_score=msg.get("gate_score"),
+        )
+
+    def detections(self, names: list[str], panorama_width: int) -> list[dict]:
+        """
+        Детекции в том же виде, что отдаёт REST /detect, — их понимают
+        merge_detections и group_by_tile.
+        """
+        result = []
+        for cls_id, score, box in zip(self.classes.tolist(), self.scores.tolist(), self.boxes.tolist()):
+            result.append({
+                "class": names[cls_id],
+                "confidence": score,
+                "coordinates": format_coordinates(box),
+                "index": self.index,
+                "length": ruler_length(box[0], box[2], panorama_width),
+                "box": box,
+            })
+        return result
+
+
+def header(names: dict[int, str] | list[str]) -> dict:
+    """Первое сообщение потока ответа: версия и имена классов по id."""
+    if isinstance(names, dict):
+        names = [names[i] for i in range(len(names))]
+    return {"v": PROTOCOL_VERSION, "names": list(names)}
+
+
+def error(exc: Exception) -> dict:
+    """
+    Последнее сообщение потока, прерванного ошибкой. kind="deadline" —
+    истёк дедлайн запроса: фронтенд отвечает 504, а не 502.
+    """
+    message = {"error": str(exc)}
+    if isinstance(exc, DeadlineExceeded):
+        message["kind"] = ERROR_DEADLINE
+    return message
+
+
+def iter_messages(chunks: Iterable[bytes]) -> Iterator[dict]:
+    """Распаковать поток ответа из кусков байтов (синхронный вариант)."""
+    stream = unpacker()
+    for chunk in chunks:
+        stream.feed(chunk)
+        yield from stream
@@ -0,0 +1,194 @@
+# APPLICATION/common/shm.py
+"""
+Передача панорамы между фронтендом и ML-сервисом через именованную
+разделяемую память, когда оба процесса работают на одной машине.
+
+Фронтенд один раз копирует декодированную панораму в сегмент
+``multiprocessing.shared_memory`` и дальше отправляет ML-сервису только имя
+сегмента, форму массива и координаты участка. ML-сервис подключается
+к сегменту и работает с view, без единой копии пикселей.
+"""
+
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+# Все сегменты панорам называются weldpano_<pid>_<uuid>: по pid создателя
+# sweep_stale_segments находит сегменты, брошенные упавшим процессом
+SEGMENT_PREFIX = "weldpano_"
+SHM_DIR = Path("/dev/shm")
+
+_live: dict[str, "SharedPanorama"] = {}
+_live_lock = threading.Lock()
+
+
+class SharedPanorama:
+    """
+    Сегмент разделяемой памяти с панорамой. Владелец — создавший процесс:
+    он обязан вызвать close() (или использовать with), иначе сегмент
+    удалят atexit-обработчик или sweep_stale_segments после падения.
+    """
+
+    def __init__(self, img: np.ndarray):
+        name = f"{SEGMENT_PREFIX}{os.getpid()}_{uuid.uuid4().hex[:12]}"
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=max(1, img.nbytes))
+        self.name = self._shm.name
+        self.array = np.ndarray(img.shape, dtype=img.dtype, buffer=self._shm.buf)
+        self.array[...] = img
+        with _live_lock:
+            _live[self.name] = self
+
+    @property
+    def descriptor(self) -> dict:
+        """Что нужно ML-сервису, чтобы подключиться к сегменту."""
+        return {
+            "name":  self.name,
+            "shape": list(self.array.shape),
+            "dtype": self.array.dtype.str,
+        }
+
+    def locate(self, region: np.ndarray) -> tuple[int, int, int, int] | None:
+        """
+        Если region — view внутри панорамы этого сегмента, вернуть его
+        границы (y0, y1, x0, x1), иначе None.
+        """
+        arr = self.array
+        if region.dtype != arr.dtype or region.strides != arr.strides[:region.ndim]:
+            return None
+        if region.shape[2:] != arr.shape[2:]:
+            return None
+        start = region.__array_interface__["data"][0] - arr.__array_interface__["data"][0]
+        if start < 0 or start >= arr.nbytes:
+            return None
+        y0, rest = divmod(start, arr.strides[0])
+        x0, rest = divmod(rest, arr.strides[1])
+        if rest or y0 + region.shape[0] > arr.shape[0] or x0 + region.shape[1] > arr.shape[1]:
+            return None
+        return y0, y0 + region.shape[0], x0, x0 + region.shape[1]
+
+    def close(self) -> None:
+        """Освободить и удалить сегмент; повторный вызов безопасен."""
+        with _live_lock:
+            if _live.pop(self.name, None) is None:
+                return
+        self.array = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # на сегмент ещё смотрят view; память освободится вместе с ними
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SharedPanorama":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _close_all() -> None:
+    for shared in list(_live.values()):
+        shared.close()
+
+
+atexit.register(_close_all)
+
+
+def live_segments() -> int:
+    """Сколько сегментов этого процесса сейчас существует."""
+    return len(_live)
+
+
+def sweep_stale_segments() -> int:
+    """
+    Удалить сегменты панорам, чей процесс-создатель уже не существует
+    (остались после SIGKILL/OOM). Возвращает число удалённых сегментов.
+    """
+    if not SHM_DIR.is_dir():
+        return 0
+    removed = 0
+    for path in SHM_DIR.glob(f"{SEGMENT_PREFIX}*"):
+        try:
+            pid = int(path.name[len(SEGMENT_PREFIX):].split("_", 1)[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        try:
+            path.unlink()
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Подключиться к чужому сегменту. До Python 3.13 подключение регистрирует
+    сегмент в resource_tracker, и тот удалил бы его при выходе процесса —
+    снимаем регистрацию, владельцем остаётся фронтенд.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # в однопроцессном режиме регистрация принадлежит самому создателю
+        if not name.startswith(f"{SEGMENT_PREFIX}{os.getpid()}_"):
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+_deferred: list[shared_memory.SharedMemory] = []
+
+
+@contextmanager
+def attached_panorama(name: str, shape: list[int], dtype: str) -> Iterator[np.ndarray]:
+    """
+    Подключиться к сегменту панорамы на время блока with.
+
+    Raises:
+        FileNotFoundError: Сегмента нет (другая машина/контейнер или он уже удалён).
+        ValueError: Форма не помещается в сегмент.
+    """
+    # Сегменты, которые не удалось закрыть раньше из-за живых view
+    for shm in _deferred[:]:
+        try:
+            shm.close()
+            _deferred.remove(shm)
+        except BufferError:
+            pass
+
+    if not name.startswith(SEGMENT_PREFIX):
+        raise FileNotFoundError(name)
+    shm = _attach(name)
+    array = None
+    try:
+        array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+        yield array
+    finally:
+        del array
+        try:
+            shm.close()
+        except BufferError:
+            _deferred.append(shm)
@@ -0,0 +1,230 @@
+# APPLICATION/common/tiling.py
+"""
+Геометрия нарезки панорам на тайлы.
+
+Единый источник правды для фронтенда, ML-сервиса и скриптов подготовки
+датасета. По ширине и высоте панорамы строится план нарезки: ширина тайла,
+количество тайлов, их смещения и перекрытие. План подбирается так, чтобы
+после letterbox-масштабирования к ``imgsz`` модели на паддинг уходило как
+можно меньше пикселей.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+# Входной размер модели (длинная сторона после letterbox) и шаг сетки YOLO
+DEFAULT_IMGSZ = int(os.getenv("MODEL_IMGSZ", "640"))
+MODEL_STRIDE = 32
+
+# Исторические размеры плёнок → количество тайлов. plan_tiles строит для них
+# ровно такую же нарезку, карта оставлена для справки и проверки.
+LEGACY_SIZE_MAP: dict[tuple[int, int], int] = {
+    (31920, 1152): 28,
+    (30780, 1152): 27,
+    (18144, 1142): 16,
+}
+
+# Сколько вариантов количества тайлов сверх минимального перебирать
+_EXTRA_CANDIDATES = 3
+
+
+@dataclass(frozen=True)
+class TilePlan:
+    """
+    План нарезки панорамы на горизонтальные тайлы во всю высоту.
+
+    Attributes:
+        width (int): Ширина панорамы.
+        height (int): Высота панорамы (и каждого тайла).
+        tile_width (int): Ширина одного тайла, одинаковая для всех.
+        offsets (tuple[int, ...]): Левая граница каждого тайла в панораме.
+        imgsz (int): Входной размер модели, под который строился план.
+    """
+    width: int
+    height: int
+    tile_width: int
+    offsets: tuple[int, ...]
+    imgsz: int = DEFAULT_IMGSZ
+
+    @property
+    def count(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def overlap(self) -> int:
+        """Максимальное перекрытие соседних тайлов в пикселях."""
+        if self.count < 2:
+            return 0
+        step = min(b - a for a, b in zip(self.offsets, self.offsets[1:]))
+        return self.tile_width - step
+
+    @property
+    def slices(self) -> tuple[slice, ...]:
+        """Срезы по оси X для каждого тайла."""
+        return tuple(slice(x, x + self.tile_width) for x in self.offsets)
+
+    @property
+    def seams(self) -> tuple[int, ...]:
+        """X-координаты стыков между соседними тайлами (середина перекрытия)."""
+        return tuple(
+            (b + a + self.tile_width) // 2
+            for a, b in zip(self.offsets, self.offsets[1:])
+        )
+
+    @property
+    def padding_ratio(self) -> float:
+        """Доля паддинга во входе модели по всем тайлам."""
+        padded = _letterbox_area(self.tile_width, self.height, self.imgsz)
+        scale = self.imgsz / max(self.tile_width, self.height)
+        useful = (self.tile_width * scale) * (self.height * scale)
+        return 1.0 - useful / padded
+
+    def tile_offset(self, index: int) -> int:
+        """Смещение тайла по его номеру (нумерация с 1, как в API)."""
+        return self.offsets[index - 1]
+
+    def visible_columns(self, index: int) -> slice:
+        """
+        Столбцы тайла (нумерация с 1, в координатах тайла), которые остаются
+        от него в склейке join_tiles: до начала следующего тайла.
+        """
+        if index == self.count:
+            return slice(0, self.tile_width)
+        return slice(0, self.offsets[index] - self.offsets[index - 1])
+
+    def tile_index(self, x: float) -> int:
+        """Номер тайла (с 1), в который попадает точка x панорамы."""
+        return max(1, bisect_right(self.offsets, x))
+
+    def seam_strip(self, seam: int, strip_width: int) -> slice:
+        """
+        Срез по оси X полосы шириной strip_width с центром на стыке seam
+        (0 — стык между 1-м и 2-м тайлом), прижатой к краям панорамы.
+        """
+        strip_width = min(strip_width, self.width)
+        x0 = self.seams[seam] - strip_width // 2
+        x0 = max(0, min(x0, self.width - strip_width))
+        return slice(x0, x0 + strip_width)
+
+
+def _letterbox_side(side: int, scale: float, stride: int = MODEL_STRIDE) -> int:
+    return math.ceil(side * scale / stride) * stride
+
+
+def _letterbox_area(tile_w: int, tile_h: int, imgsz: int) -> int:
+    """Площадь входа модели после rect-letterbox (кратно stride)."""
+    scale = imgsz / max(tile_w, tile_h)
+    return _letterbox_side(tile_w, scale) * _letterbox_side(tile_h, scale)
+
+
+def _spread_offsets(width: int, tile_w: int, count: int) -> tuple[int, ...]:
+    """Равномерно раскладывает count тайлов так, чтобы последний кончался на width."""
+    if count == 1:
+        return (0,)
+    span = width - tile_w
+    return tuple(round(i * span / (count - 1)) for i in range(count))
+
+
+@lru_cache(maxsize=64)
+def plan_tiles(
+    width: int,
+    height: int,
+    imgsz: int = DEFAULT_IMGSZ,
+    min_overlap: int = 0,
+    max_aspect: float = 1.0,
+) -> TilePlan:
+    """
+    Построить план нарезки панорамы произвольного размера.
+
+    Тайл берётся во всю высоту, ширина не превышает ``height * max_aspect``
+    (чтобы не терять разрешение при масштабировании к imgsz). Среди
+    допустимых количеств тайлов выбирается то, у которого суммарная площадь
+    входа модели (с учётом паддинга до кратности stride) минимальна.
+
+    Args:
+        width (int): Ширина панорамы.
+        height (int): Высота панорамы.
+        imgsz (int): Входной размер модели.
+        min_overlap (int): Минимальное перекрытие соседних тайлов.
+        max_aspect (float): Максимальное отношение ширины тайла к высоте.
+
+    Returns:
+        TilePlan: План нарезки.
+
+    Raises:
+        ValueError: При неположительных размерах или слишком большом перекрытии.
+    """
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Некорректный размер панорамы {width}×{height}")
+
+    max_tw = max(1, int(height * max_aspect))
+    if width <= max_tw:
+        return TilePlan(width, height, width, (0,), imgsz)
+    if min_overlap >= max_tw:
+        raise ValueError(f"Перекрытие {min_overlap} не меньше ширины тайла {max_tw}")
+
+    n_min = math.ceil((width - min_overlap) / (max_tw - min_overlap))
+    best: tuple[int, int, int] | None = None
+    for n in range(n_min, n_min + _EXTRA_CANDIDATES):
+        tile_w = math.ceil((width + (n - 1) * min_overlap) / n)
+        cost = n * _letterbox_area(tile_w, height, imgsz)
+        if best is None or cost < best[0]:
+            best = (cost, n, tile_w)
+
+    _, count, tile_w = best
+    return TilePlan(width, height, tile_w, _spread_offsets(width, tile_w, count), imgsz)
+
+
+def plan_for_image(img: np.ndarray, imgsz: int = DEFAULT_IMGSZ) -> TilePlan:
+    """План нарезки для уже декодированного изображения."""
+    h, w = img.shape[:2]
+    return plan_tiles(w, h, imgsz)
+
+
+def tile_views(img: np.ndarray, plan: TilePlan) -> list[np.ndarray]:
+    """
+    Нарезать панораму по плану. Возвращаются view исходного массива,
+    пиксели не копируются.
+    """
+    h, w = img.shape[:2]
+    if (w, h) != (plan.width, plan.height):
+        raise ValueError(
+            f"План {plan.width}×{plan.height} не подходит к изображению {w}×{h}"
+        )
+    return [img[:, s] for s in plan.slices]
+
+
+def refine_windows(plan: TilePlan, spans: list[tuple[float, float]]) -> list[slice]:
+    """
+    Окна во всю высоту вокруг интервалов [x1, x2] панорамы: не уже тайла,
+    с центром на интервале; пересекающиеся окна объединяются.
+    """
+    windows: list[list[int]] = []
+    for x1, x2 in sorted(spans):
+        half = max(plan.tile_width, int(x2 - x1) + 2 * MODEL_STRIDE) // 2
+        cx = int(x1 + x2) // 2
+        lo, hi = max(0, cx - half), min(plan.width, cx + half)
+        if windows and lo <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], hi)
+        else:
+            windows.append([lo, hi])
+    return [slice(lo, hi) for lo, hi in windows]
+
+
+def join_tiles(tiles: list[np.ndarray], plan: TilePlan) -> np.ndarray:
+    """
+    Склеить тайлы обратно в панораму. В зонах перекрытия остаются
+    пиксели правого тайла.
+    """
+    first = tiles[0]
+    out = np.empty((plan.height, plan.width) + first.shape[2:], dtype=first.dtype)
+    for tile, s in zip(tiles, plan.slices):
+        out[:, s] = tile
+    return out
@@ -0,0 +1,97 @@
+# APPLICATION/common/tracing.py
+"""
+Ручные спаны OpenTelemetry для конвейера тайлов.
+
+Автоинструментация (opentelemetry-instrument) даёт только спаны
+HTTP-запросов; здесь размечаются стадии внутри них: декодирование,
+нарезка, отправка каждого участка, инференс (предобработка, прямой
+проход, NMS, постобработка), запись в БД и отчёт:
+
+    with span("decode", panorama_width=w, panorama_height=h):
+        ...
+
+Контекст трассы уходит в ML-сервис заголовком traceparent (inject), и
+одна загрузка панорамы — одна трасса в Jaeger от фронтенда до модели.
+
+Без пакета opentelemetry-api все функции — пустышки. Сэмплирование
+задаётся стандартными переменными OTEL_TRACES_SAMPLER(_ARG); в
+несэмплированный спан атрибуты не пишутся.
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Mapping, Sequence
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+except ImportError:  # без OpenTelemetry трассировка выключена
+    trace = None
+
+_tracer = trace.get_tracer("weld-defects") if trace is not None else None
+
+
+def enabled() -> bool:
+    """Установлен ли opentelemetry-api."""
+    return _tracer is not None
+
+
+@contextmanager
+def span(name: str, parent: Any = None, **attributes) -> Iterator[Any]:
+    """
+    Дочерний спан текущего или явно заданного контекста parent (нужен,
+    если блок выполняется в пуле потоков). Исключение из блока
+    записывается в спан и пробрасывается дальше.
+    """
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, context=parent) as current:
+        if attributes and current.is_recording():
+            current.set_attributes(attributes)
+        yield current
+
+
+def annotate(**attributes) -> None:
+    """Добавить атрибуты текущему спану (например, размер панорамы после декодирования)."""
+    if trace is not None:
+        current = trace.get_current_span()
+        if current.is_recording():
+            current.set_attributes(attributes)
+
+
+def server_context(headers: Mapping[str, str]) -> Any:
+    """
+    Родитель для спанов обработчика: текущий спан, если его уже открыла
+    автоинструментация FastAPI, иначе контекст из заголовка traceparent.
+    """
+    if trace is None:
+        return None
+    if trace.get_current_span().get_span_context().is_valid:
+        return otel_context.get_current()
+    return propagate.extract(headers)
+
+
+def inject(headers: dict[str, str]) -> dict[str, str]:
+    """Добавить в заголовки исходящего запроса контекст текущей трассы."""
+    if trace is not None:
+        propagate.inject(headers)
+    return headers
+
+
+def record_phases(phases: Sequence[tuple[str, float]], end_ns: int | None = None) -> None:
+    """
+    Задним числом записать последовательные фазы (имя, секунды) как
+    дочерние спаны текущего, заканчивая последнюю в end_ns (по умолчанию
+    сейчас). Нужно для фаз, которые замеряет сама библиотека, — например,
+    preprocess/inference/postprocess в Results.speed у ultralytics.
+    """
+    if _tracer is None or not trace.get_current_span().is_recording():
+        return
+    stop = end_ns if end_ns is not None else time.time_ns()
+    start = stop - sum(int(seconds * 1e9) for _, seconds in phases)
+    for name, seconds in phases:
+        end = start + int(seconds * 1e9)
+        _tracer.start_span(name, start_time=start).end(end_time=end)
+        start = end
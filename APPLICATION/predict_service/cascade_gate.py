@@ -0,0 +1,46 @@
+import json
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+
+class CascadeGate:
+    """
+    Лёгкий классификатор «есть дефект / нет дефекта» перед детектором.
+
+    Тайл уменьшается до imgsz×imgsz, и полный YOLO-детектор запускается
+    только если вероятность класса defect не ниже порога. Порог подобран
+    train_gate.py под целевой recall и лежит в gate.json рядом с весами.
+    """
+
+    DEFECT_CLASS = "defect"
+
+    def __init__(self, weights: str, threshold: float | None = None, imgsz: int | None = None):
+        self.weights = weights
+        self.model = YOLO(weights, task="classify")
+        cfg_path = Path(weights).with_name("gate.json")
+        cfg = json.loads(cfg_path.read_text(encoding="utf-8")) if cfg_path.exists() else {}
+
+        self.threshold = threshold if threshold is not None else cfg.get("threshold", 0.5)
+        self.imgsz = imgsz or cfg.get("imgsz", 128)
+        ids = {name: idx for idx, name in self.model.names.items()}
+        self.defect_idx = ids.get(self.DEFECT_CLASS, 1)
+
+        self.checked = 0
+        self.skipped = 0
+
+    def score(self, image: np.ndarray) -> float:
+        """Вероятность наличия дефекта на тайле."""
+        small = cv2.resize(image, (self.imgsz, self.imgsz), interpolation=cv2.INTER_AREA)
+        res = self.model(small, imgsz=self.imgsz, verbose=False)[0]
+        return float(res.probs.data[self.defect_idx])
+
+    def check(self, image: np.ndarray) -> tuple[bool, float]:
+        """Пропустить ли тайл к детектору; вторым значением — оценка гейта."""
+        score = self.score(image)
+        passed = score >= self.threshold
+        self.checked += 1
+        self.skipped += not passed
+        return passed, score
@@ -1,46 +1,181 @@
-from ultralytics import YOLO
-from typing import Dict, Any
+import threading
+import time
+from functools import wraps
+from typing import TYPE_CHECKING, Dict, Any
 import numpy as np
 
+from common.boxes import format_coordinates, ruler_length
+from common.metrics import INFERENCE_SECONDS, count_defects, count_tiles, timed
+from common.rpc import BOX_DTYPE, CLASS_DTYPE, SCORE_DTYPE, TileResult
+from common.tiling import DEFAULT_IMGSZ, plan_tiles
+from common.tracing import annotate, enabled as tracing_enabled, record_phases, span
+from predict_service.tile_cache import TileCache, file_digest, tile_key
+
+if TYPE_CHECKING:  # гейт тянет ultralytics, а StubDetector работает без него
+    from predict_service.cascade_gate import CascadeGate
+
+# Сырые детекции тайла: (class_id, confidence, x1, y1, x2, y2) в координатах тайла
+RawBoxes = tuple[tuple[int, float, int, int, int, int], ...]
+
+# Оценка памяти под запись кэша: сам кортеж + по кортежу на бокс
+_CACHE_ENTRY_BYTES = 160
+_CACHE_BOX_BYTES = 200
+
+# Время последнего NMS в потоке: ultralytics замеряет постобработку
+# целиком, а NMS в ней — главная часть
+_nms_timing = threading.local()
+
+
+def _install_nms_timer() -> None:
+    """Обернуть ultralytics.utils.ops.non_max_suppression замером времени (один раз)."""
+    from ultralytics.utils import ops as yolo_ops
+
+    original = yolo_ops.non_max_suppression
+    if getattr(original, "_timed", False):
+        return
+
+    @wraps(original)
+    def timed_nms(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            _nms_timing.seconds = time.perf_counter() - start
+
+    timed_nms._timed = True
+    yolo_ops.non_max_suppression = timed_nms
+
 
 class DefectDetector:
-    def __init__(self, model_path: str):
+    def __init__(
+        self,
+        model_path: str,
+        imgsz: int = DEFAULT_IMGSZ,
+        gate: "CascadeGate | None" = None,
+        cache: TileCache | None = None,
+        conf: float = 0.1,
+    ):
+        # ultralytics (и torch) импортируются только для настоящей модели:
+        # StubDetector обходится без них
+        from ultralytics import YOLO
+
         self.model = YOLO(model_path)
         self.classes = self.model.names
-        self.index = 1
+        self.imgsz = imgsz
+        self.gate = gate
+        self.cache = cache
+        self.conf = conf
+        # Версия модели для ключа кэша: веса детектора и гейта с его порогом
+        self.version = file_digest(model_path)
+        if gate is not None:
+            self.version += f"+{file_digest(gate.weights)}@{gate.threshold}"
+        if tracing_enabled():
+            _install_nms_timer()
 
-    def predict(self, image: np.ndarray, panorama_size: tuple=(31920, 1152), index: int=1) -> Dict[str, Any]:
+    def _infer(self, image: np.ndarray) -> tuple[float | None, RawBoxes]:
+        """
+        Сырой инференс тайла без смещения в панораме.
+
+        Returns:
+            tuple: (оценка гейта, если он отсёк тайл, иначе None; боксы тайла)
+        """
+        # Каскад: тайлы, которые гейт считает чистыми, до детектора не доходят
+        if self.gate is not None:
+            with timed("gate", INFERENCE_SECONDS), span("gate"):
+                passed, gate_score = self.gate.check(image)
+            if not passed:
+                count_tiles("gated")
+                return gate_score, ()
+
+        with timed("detector", INFERENCE_SECONDS), span("detector", tile_width=image.shape[1], tile_height=image.shape[0]):
+            _nms_timing.seconds = 0.0
+            results = self.model(image, conf=self.conf, imgsz=self.imgsz, verbose=False)
+            # Фазы, замеренные ultralytics (мс), — дочерними спанами детектора
+            speed = results[0].speed
+            nms = _nms_timing.seconds
+            record_phases([
+                ("preprocess", speed["preprocess"] / 1000),
+                ("forward", speed["inference"] / 1000),
+                ("nms", nms),
+                ("postprocess", max(0.0, speed["postprocess"] / 1000 - nms)),
+            ])
+        boxes = tuple(
+            (int(box.cls), float(box.conf), *[round(x) for x in box.xyxy[0].tolist()])
+            for box in results[0].boxes
+        )
+        count_tiles("detected")
+        count_defects(self.classes[b[0]] for b in boxes)
+        return None, boxes
+
+    def _infer_cached(self, image: np.ndarray) -> tuple[float | None, RawBoxes]:
+        if self.cache is None:
+            return self._infer(image)
+        key = tile_key(image, self.version, self.conf, self.imgsz)
+        raw = self.cache.get(key)
+        if raw is not None:
+            count_tiles("cached")
+            annotate(cache_hit=True)
+        else:
+            raw = self._infer(image)
+            self.cache.put(key, raw, _CACHE_ENTRY_BYTES + _CACHE_BOX_BYTES * len(raw[1]))
+        return raw
+
+    def _offset(self, panorama_size: tuple, index: int, offset: int | None) -> int:
+        if offset is None:
+            offset = plan_tiles(panorama_size[0], panorama_size[1], self.imgsz).tile_offset(index)
+        return offset
+
+    def predict(
+        self,
+        image: np.ndarray,
+        panorama_size: tuple=(31920, 1152),
+        index: int=1,
+        offset: int | None=None,
+    ) -> Dict[str, Any]:
         """Обработка изображения с конвертацией numpy в python-типы"""
-        results = self.model(image, conf=0.1, verbose=False)
+        gated, boxes = self._infer_cached(image)
+        if gated is not None:
+            return {"status": "no_defects", "detections": [], "gate_score": gated}
+
         size = panorama_size
         detections = []
-        SIZE_MAP = {
-            (31920, 1152): 28,
-            (30780, 1152): 27,
-            (18144, 1142): 16,
-        }
+        offset = self._offset(size, index, offset)
 
-        for box in results[0].boxes:
-            bbox = [round(x) for x in box.xyxy[0].tolist()]
-            x1 = bbox[0] + self.index * size[0] / SIZE_MAP[size]
-            y1 = bbox[3]
-            x2 = bbox[2] + self.index * size[0] / SIZE_MAP[size]
-            y2 = bbox[1]
-            length = (int((x1+x2-2000)/2*310/size[0]))%310
-            if length%10>=5:
-                length+=10-length%10
-            else:
-                length-=length%10
+        for cls_id, conf, x1, y1, x2, y2 in boxes:
+            # бокс в координатах панорамы: x1, верх, x2, низ
+            pano_box = [x1 + offset, y1, x2 + offset, y2]
             detections.append({
-                "class": self.classes[int(box.cls)],
-                "confidence": float(box.conf),  # Явное преобразование в float
-                "coordinates": f"{x1=}, {y1=}, {x2=}, {y2=}",
+                "class": self.classes[cls_id],
+                "confidence": conf,
+                "coordinates": format_coordinates(pano_box),
                 "index": index,
-                "length": length
+                "length": ruler_length(pano_box[0], pano_box[2], size[0]),
+                "box": pano_box,
             })
-        self.index+=1
 
         return {
             "status": "success" if detections else "no_defects",
             "detections": detections,
-        }
\ No newline at end of file
+        }
+
+    def predict_arrays(
+        self,
+        image: np.ndarray,
+        panorama_size: tuple=(31920, 1152),
+        index: int=1,
+        offset: int | None=None,
+    ) -> TileResult:
+        """То же, что predict, но типизированными массивами для /detect_batch"""
+        gated, boxes = self._infer_cached(image)
+        if gated is not None or not boxes:
+            return TileResult.empty(index, gated)
+
+        raw = np.array(boxes, dtype=np.float64)
+        xyxy = raw[:, 2:].astype(BOX_DTYPE)
+        xyxy[:, [0, 2]] += self._offset(panorama_size, index, offset)
+        return TileResult(
+            index=index,
+            classes=raw[:, 0].astype(CLASS_DTYPE),
+            scores=raw[:, 1].astype(SCORE_DTYPE),
+            boxes=xyxy,
+        )
@@ -1,34 +1,379 @@
 import os
+from contextlib import nullcontext
 import cv2
 import numpy as np
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, status, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, status, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from dotenv import load_dotenv
-from predict_service.deffect_detector import DefectDetector
+from pydantic import BaseModel
+from common import executors, memory, profiling, rpc
+from common.admission import AdmissionController, Overloaded, Permit
+from common.deadline import (
+    DEADLINE_HEADER, Deadline, DeadlineExceeded, RequestAborted, cancellations
+)
+from common.metrics import (
+    render as render_metrics, timed, track_admission, track_cache, track_cancellations, track_executors,
+    track_memory
+)
+from common.responses import ClosingStreamingResponse
+from common.shm import attached_panorama
+from common.tracing import server_context, span
+from predict_service.tile_cache import TileCache
 
 load_dotenv()
 
 app = FastAPI()
 
+# Учёт памяти по стадиям каждого запроса (GET /debug/memory)
+app.add_middleware(memory.MemoryMiddleware)
+
+# Профилирование запроса по заголовку X-Profile (только с PROFILE_TOKEN)
+if profiling.enabled():
+    app.add_middleware(profiling.ProfileMiddleware, service="ml")
+
 
 # model = DefectDetector('weights/best.pt')
 HERE = os.path.dirname(__file__)
 model_path = os.getenv("MODEL_PATH", os.path.join(HERE, "../app/weights/best.pt"))
-model = DefectDetector(model_path)
+
+# Бэкенд детектора: yolo — модель по MODEL_PATH, stub — заглушка без torch
+# для нагрузочных тестов (bench/load.py) с задержкой STUB_LATENCY_MS на тайл
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "yolo").lower()
+
+# Каскадный гейт включается, если заданы его веса (см. train_gate.py)
+gate_path = os.getenv("GATE_WEIGHTS")
+gate_threshold = os.getenv("GATE_THRESHOLD")
+gate = None
+if gate_path and os.path.exists(gate_path) and DETECTOR_BACKEND != "stub":
+    from predict_service.cascade_gate import CascadeGate
+
+    gate = CascadeGate(
+        gate_path,
+        threshold=float(gate_threshold) if gate_threshold else None
+    )
+
+# Кэш сырых результатов по тайлам (TILE_CACHE_BYTES=0 — выключен)
+cache_bytes = int(os.getenv("TILE_CACHE_BYTES", str(64 * 1024 * 1024)))
+cache = TileCache(cache_bytes, ttl=float(os.getenv("TILE_CACHE_TTL", "3600"))) if cache_bytes > 0 else None
+
+if DETECTOR_BACKEND == "stub":
+    from predict_service.stub_detector import StubDetector
+
+    model = StubDetector(
+        latency=float(os.getenv("STUB_LATENCY_MS", "20")) / 1000,
+        boxes=int(os.getenv("STUB_BOXES", "2")),
+        cache=cache,
+    )
+else:
+    from predict_service.deffect_detector import DefectDetector
+
+    model = DefectDetector(model_path, gate=gate, cache=cache)
+
+# Контроль допуска: тайлов в работе одновременно, длина очереди и время ожидания.
+# Пачка /detect_batch весит столько, сколько в ней участков
+tiles = AdmissionController(
+    "tiles",
+    capacity=int(os.getenv("MAX_INFLIGHT_TILES", "8")),
+    queue_size=int(os.getenv("TILE_QUEUE_SIZE", "64")),
+    max_wait=float(os.getenv("TILE_QUEUE_TIMEOUT", "30")),
+)
+
+# Метрики очереди, отмен и кэша читаются только при сборе (GET /metrics)
+track_admission(tiles)
+track_cancellations(cancellations)
+track_memory()
+track_executors()
+if cache is not None:
+    track_cache(cache)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": str(exc)})
+
+
+@app.exception_handler(RequestAborted)
+async def aborted_handler(request: Request, exc: RequestAborted):
+    # Клиент уже отключился: тело ответа никто не прочитает
+    return JSONResponse(status_code=499, content={"detail": str(exc)})
+
+
+async def _admit(request: Request, weight: int) -> tuple[Permit, Deadline | None]:
+    """
+    Место в очереди тайлов с учётом дедлайна фронтенда (X-Deadline-Ms).
+    Тайлы, чей дедлайн истёк или чей клиент отключился, пока они ждали
+    в очереди, отбрасываются без инференса.
+    """
+    deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    try:
+        if deadline is not None:
+            deadline.check()
+        permit = await tiles.acquire(weight, timeout=deadline.remaining() if deadline else None)
+    except Overloaded:
+        if deadline is None or not deadline.expired:
+            raise
+        exc = DeadlineExceeded("Дедлайн истёк в очереди")
+        cancellations.record(exc, weight)
+        raise exc
+    except DeadlineExceeded as exc:
+        cancellations.record(exc, weight)
+        raise
+
+    if await request.is_disconnected():
+        permit.release()
+        exc = RequestAborted("Клиент отключился, пока тайлы ждали в очереди")
+        cancellations.record(exc, weight)
+        raise exc
+    return permit, deadline
+
 
 @app.post("/detect", status_code=status.HTTP_201_CREATED)
-async def detect_defects(file: UploadFile = File(...)):
+async def detect_defects(
+    request: Request,
+    file: UploadFile = File(...),
+    index: int = Form(1),
+    offset: int | None = Form(None),
+    width: int = Form(31920),
+    height: int = Form(1152),
+):
+    permit, _ = await _admit(request, 1)
     try:
-        contents = await file.read()
-        image = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+        try:
+            contents = await file.read()
+            with span("tile", server_context(request.headers), tile_index=index, tile_offset=offset or 0,
+                      panorama_width=width, panorama_height=height, transport="rest"):
+                with timed("decode"), span("decode"):
+                    image = await executors.run(
+                        "decode", cv2.imdecode, np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR
+                    )
+                if image is None:
+                    raise HTTPException(status_code=400, detail="Invalid image format")
+
+                result = await executors.run(
+                    "inference", model.predict, image, panorama_size=(width, height), index=index, offset=offset
+                )
+            return result
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        permit.release()
+
+class ShmRegion(BaseModel):
+    """Участок панорамы в сегменте разделяемой памяти фронтенда."""
+    name: str
+    shape: list[int]
+    dtype: str
+    y0: int
+    y1: int
+    x0: int
+    x1: int
+    index: int = 1
+    offset: int | None = None
+    width: int = 31920
+    height: int = 1152
+
+
+@app.post("/detect_shm", status_code=status.HTTP_201_CREATED)
+async def detect_defects_shm(region: ShmRegion, request: Request):
+    """
+    То же, что /detect, но пиксели не передаются: участок берётся view
+    из сегмента разделяемой памяти, который создал фронтенд. 404 означает,
+    что сегмент отсюда не виден, и фронтенд переходит на HTTP.
+    """
+    permit, _ = await _admit(request, 1)
+    try:
+        try:
+            with span("tile", server_context(request.headers), tile_index=region.index,
+                      tile_offset=region.offset or region.x0, panorama_width=region.width,
+                      panorama_height=region.height, transport="shm"):
+                # Подключение к сегменту — в том же потоке, что и инференс: при
+                # отмене запроса сегмент не отключится из-под работающей модели
+                return await executors.run("inference", _predict_shm, region)
+
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Shared memory segment not found")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        permit.release()
+
+
+def _predict_shm(region: ShmRegion) -> dict:
+    with attached_panorama(region.name, region.shape, region.dtype) as pano:
+        image = pano[region.y0:region.y1, region.x0:region.x1]
+        if image.size == 0:
+            raise HTTPException(status_code=400, detail="Empty region")
+        result = model.predict(
+            image,
+            panorama_size=(region.width, region.height),
+            index=region.index,
+            offset=region.offset,
+        )
+        # view на сегмент должны умереть до отключения от него
+        del image, pano
+    return result
+
+
+def _decode_tile(tile: rpc.TileRequest, pano: np.ndarray | None) -> np.ndarray:
+    if tile.bounds is not None:
+        if pano is None:
+            raise ValueError("Tile bounds given without a shared memory segment")
+        y0, y1, x0, x1 = tile.bounds
+        return pano[y0:y1, x0:x1]
+    if tile.format == "png":
+        with timed("decode"), span("decode"):
+            image = cv2.imdecode(np.frombuffer(tile.data, np.uint8), cv2.IMREAD_COLOR)
         if image is None:
-            raise HTTPException(status_code=400, detail="Invalid image format")
+            raise ValueError("Invalid image format")
+        return image
+    return tile.raw_array()
 
-        result = model.predict(image)
-        return result
 
+def _stream_batch(batch: dict, deadline: Deadline | None, parent=None):
+    """
+    Генератор ответа /detect_batch: заголовок, затем по сообщению на
+    участок по мере готовности. Шаги генератора выполняются в пуле
+    стадии inference (common.executors), а не в event loop. Участки,
+    до которых не дошли (истёк дедлайн или клиент отключился и поток
+    закрыт), считаются отброшенными. Спан каждого участка — ребёнок
+    контекста трассы parent запроса (в потоках пула своего контекста нет).
+    """
+    yield rpc.packb(rpc.header(model.classes))
+    size = (batch["width"], batch["height"])
+    regions = [rpc.TileRequest.unpack(t) for t in batch["tiles"]]
+    segment = batch.get("segment")
+    done = 0
+    reason = RequestAborted("Поток ответа закрыт")
+    try:
+        pano_ctx = (
+            attached_panorama(segment["name"], segment["shape"], segment["dtype"])
+            if segment is not None else nullcontext()
+        )
+        with pano_ctx as pano:
+            for tile in regions:
+                if deadline is not None:
+                    deadline.check()
+                with span("tile", parent, tile_index=tile.index, tile_offset=tile.offset,
+                          panorama_width=size[0], panorama_height=size[1],
+                          transport="shm" if tile.bounds is not None else tile.format):
+                    result = model.predict_arrays(_decode_tile(tile, pano), size, tile.index, tile.offset)
+                done += 1
+                yield rpc.packb(result.pack())
+            # view на сегмент должны умереть до отключения от него
+            del pano
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        reason = e
+        # Статус уже отправлен: ошибку сообщаем последним сообщением потока
+        yield rpc.packb(rpc.error(e))
+    finally:
+        if done < len(regions):
+            cancellations.record(reason if isinstance(reason, DeadlineExceeded) else None, len(regions) - done)
+
+
+@app.post("/detect_batch", status_code=status.HTTP_200_OK)
+async def detect_batch(request: Request):
+    """
+    Бинарный вариант /detect (схемы сообщений — common/rpc.py): пачка
+    участков в одном msgpack-запросе, потоковый ответ по участку.
+    404 — сегмент разделяемой памяти отсюда не виден.
+    """
+    if not rpc.available():
+        raise HTTPException(status_code=415, detail="msgpack is not installed")
+    try:
+        batch = rpc.unpackb(await request.body())
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid msgpack body")
+    if batch.get("v") != rpc.PROTOCOL_VERSION:
+        raise HTTPException(status_code=400, detail=f"Unsupported protocol version {batch.get('v')}")
+
+    segment = batch.get("segment")
+    if segment is not None:
+        # Проверяем доступность сегмента до начала потока, чтобы ответить 404
+        try:
+            with attached_panorama(segment["name"], segment["shape"], segment["dtype"]):
+                pass
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Shared memory segment not found")
+
+    permit, deadline = await _admit(request, len(batch["tiles"]))
+    chunks = _stream_batch(batch, deadline, server_context(request.headers))
+    # Разрешение освобождает и генератор (сразу по окончании потока), и сам
+    # ответ — если отправка сорвалась до первой итерации генератора
+    return ClosingStreamingResponse(_guarded(permit, chunks), media_type=rpc.MEDIA_TYPE, on_close=permit.release)
+
+
+async def _guarded(permit: Permit, chunks):
+    """Держать разрешение, пока поток ответа не отдан или не прерван клиентом."""
+    try:
+        async for chunk in executors.iterate("inference", chunks):
+            yield chunk
+    finally:
+        permit.release()
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Метрики Prometheus: инференс, тайлы по исходу, дефекты, очередь, кэш, отмены."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Тайлы в работе, очередь, ожидание, отказы (429/503), брошенная работа и загрузка пулов."""
+    return {**tiles.stats(), "cancelled": cancellations.stats(), "executors": executors.stats()}
+
+@app.get("/debug/memory", include_in_schema=False)
+def debug_memory(request: Request):
+    """RSS, прирост пика по стадиям, последние запросы и топ аллокаций (токен PROFILE_TOKEN)."""
+    if code := profiling.denied(request.headers, request.query_params):
+        raise HTTPException(status_code=code)
+    return memory.summary()
+
+@app.get("/debug/profile", include_in_schema=False)
+async def debug_profile(request: Request, seconds: float = 10):
+    """Профиль всего процесса за seconds секунд (speedscope), токен PROFILE_TOKEN."""
+    if code := profiling.denied(request.headers, request.query_params):
+        raise HTTPException(status_code=code)
+    path = await profiling.profile_window("ml", seconds)
+    if path is None:
+        raise HTTPException(status_code=409, detail="Profiling already in progress")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+@app.get("/debug/profiles/{name}", include_in_schema=False)
+def debug_profile_file(name: str, request: Request):
+    """Сохранённый профиль запроса (X-Profile-File); 202, пока он ещё записывается."""
+    if code := profiling.denied(request.headers, request.query_params):
+        raise HTTPException(status_code=code)
+    path = profiling.profile_path(name)
+    if path is None:
+        if profiling.profile_pending(name):
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={"detail": "Profile is still being written"},
+                headers={"Retry-After": "1"},
+            )
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Счётчики кэша тайлов: попадания, промахи, вытеснения, занятый объём."""
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, "model_version": model.version, **cache.stats()}
+
 
 if __name__ == "__main__":
     uvicorn.run(
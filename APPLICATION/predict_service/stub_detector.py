@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+
+from common.metrics import INFERENCE_SECONDS, count_defects, count_tiles, timed
+from common.tiling import DEFAULT_IMGSZ
+from common.tracing import span
+from predict_service.deffect_detector import DefectDetector, RawBoxes
+from predict_service.tile_cache import TileCache
+
+# Классы из app/data.yaml
+STUB_CLASSES = (
+    "пора", "включение", "подрез", "прожог", "трещина", "наплыв", "эталон1",
+    "эталон2", "эталон3", "пора-скрытая", "утяжина", "несплавление", "непровар корня",
+)
+
+
+class StubDetector(DefectDetector):
+    """
+    Детектор-заглушка для нагрузочных тестов (bench/load.py): без torch
+    и весов, с фиксированной задержкой и детерминированными боксами.
+    Перевод координат и кэш — те же, что у DefectDetector. «Инференс»
+    замеряется той же стадией detector (weld_inference_seconds и спан),
+    поэтому разбивка по стадиям ML-сервиса в bench/load.py не пустая.
+
+    Args:
+        latency: Задержка «инференса» одного тайла, с (sleep отпускает GIL,
+            как и инференс на GPU).
+        boxes: Боксов на тайл.
+        imgsz: Входной размер модели (для плана нарезки).
+        cache: Кэш тайлов, как у DefectDetector.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        boxes: int = 2,
+        imgsz: int = DEFAULT_IMGSZ,
+        cache: TileCache | None = None,
+    ):
+        self.model = None
+        self.classes = dict(enumerate(STUB_CLASSES))
+        self.imgsz = imgsz
+        self.gate = None
+        self.cache = cache
+        self.conf = 0.1
+        self.latency = latency
+        self.boxes = boxes
+        self.version = f"stub:{boxes}@{latency}"
+
+    def _infer(self, image: np.ndarray) -> tuple[float | None, RawBoxes]:
+        """Боксы зависят только от размера тайла: повторные прогоны сравнимы."""
+        h, w = image.shape[:2]
+        with timed("detector", INFERENCE_SECONDS), span("detector", tile_width=w, tile_height=h):
+            if self.latency > 0:
+                time.sleep(self.latency)
+            boxes = []
+            for k in range(self.boxes):
+                x1 = (k + 1) * w // (self.boxes + 1) - 20
+                y1 = (k + 1) * h // (self.boxes + 2)
+                boxes.append((k % len(STUB_CLASSES), 0.5 + 0.4 * k / max(1, self.boxes), max(0, x1), y1, x1 + 40, y1 + 24))
+        count_tiles("detected")
+        count_defects(self.classes[b[0]] for b in boxes)
+        return None, tuple(boxes)
@@ -0,0 +1,115 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+
+try:  # xxh3 заметно быстрее blake2b на мегабайтных тайлах, но необязателен
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def tile_key(image: np.ndarray, *salt: Any) -> bytes:
+    """
+    Ключ кэша: хэш пикселей тайла (вместе с формой и типом) и соли —
+    версии модели, порога уверенности и т.п.
+    """
+    header = repr((image.shape, image.dtype.str, salt)).encode()
+    if xxhash is not None:
+        h = xxhash.xxh3_128(header)
+    else:
+        h = hashlib.blake2b(header, digest_size=16)
+    if image.flags.c_contiguous:
+        h.update(memoryview(image).cast("B"))
+    elif image.ndim >= 2 and image[0].flags.c_contiguous:
+        # view внутри панорамы: строки непрерывны, хэшируем их без копии тайла
+        for row in image:
+            h.update(memoryview(row).cast("B"))
+    else:
+        h.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+    return h.digest()
+
+
+def file_digest(path: str, chunk: int = 1 << 20) -> str:
+    """Короткий хэш содержимого файла (версия весов модели)."""
+    h = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        while block := f.read(chunk):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TileCache:
+    """
+    LRU-кэш сырых результатов инференса по тайлам с бюджетом в байтах и TTL.
+
+    Значения хранятся в координатах самого тайла, без смещения в панораме,
+    поэтому закэшированный тайл годится для любой позиции.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: OrderedDict[bytes, tuple[float, int, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key: bytes) -> Any | None:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            stored_at, size, value = item
+            if now - stored_at > self.ttl:
+                del self._items[key]
+                self.bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: Any, size: int) -> None:
+        size += len(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._items[key] = (time.monotonic(), size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted, _) = self._items.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
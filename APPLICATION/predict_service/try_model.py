@@ -5,6 +5,8 @@ import os
 from PIL import Image
 from pathlib import Path
 
+from common.tiling import plan_tiles
+
 
 # -----------------------------------------------------------------
 # 1) Определяем базовый каталог (папка, где находится try_model.py)
@@ -26,15 +28,14 @@ path = BASE_DIR / "images" / name
 
 results = model.predict(str(path))
 
-SIZE_MAP = {
-    (31920, 1152): 28,
-    (30780, 1152): 27,
-    (18144, 1142): 16,
-}
-
 image = Image.open(path)
 size = image.size
 
+# План нарезки для этого размера (тот же, что использует фронтенд)
+plan = plan_tiles(*size)
+print(f"План нарезки {size[0]}×{size[1]}: {plan.count} тайлов "
+      f"по {plan.tile_width}px, перекрытие {plan.overlap}px")
+
 # print(results[0].orig_img)
 # Вывод предсказаний
 print("\nРезультаты обнаружения:")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон сервисов целиком: синтетические панорамы каждого
+размера (common.tiling.LEGACY_SIZE_MAP или --sizes) отправляются в
+POST /api/predict и/или POST /upload при заданной конкурентности.
+
+Для каждой пары (эндпоинт, размер, конкурентность) считаются пропускная
+способность, задержки p50/p95/p99 и разбивка по стадиям — разница
+гистограмм weld_stage_seconds и weld_inference_seconds с /metrics
+фронтенда и ML-сервиса до и после прогона, на один запрос.
+
+Сервисы можно поднять заранее (docker compose, start.sh) или дать
+скрипту запустить их локально (--spawn):
+  stub — ML-сервис с заглушкой StubDetector (DETECTOR_BACKEND=stub):
+         детерминированные боксы и --stub-latency-ms на тайл, без torch;
+  yolo — ML-сервис с настоящими весами (MODEL_PATH).
+БД при --spawn — --db (по умолчанию SQLite во временном каталоге,
+можно указать локальный PostgreSQL), кэш тайлов ML-сервиса выключен
+(--tile-cache — оставить): панорама во всех запросах одна и та же.
+/upload рисует результат моделью во фронтенде, поэтому требует
+ultralytics и с заглушкой.
+
+Результаты — JSON в --out, для сравнения прогонов между коммитами.
+
+Запуск из корня репозитория:
+    python bench/load.py --spawn stub --concurrency 1,4 --requests 8
+    python bench/load.py --url http://localhost:8000 --ml-url http://localhost:8001 --endpoint predict,upload
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+from synthetic import SIZES, encode_panorama, parse_size, synthetic_panorama
+
+ROOT = Path(__file__).resolve().parents[1]
+APPLICATION = ROOT / "APPLICATION"
+
+ENDPOINTS = {
+    "predict": "/api/predict",
+    "upload": "/upload",
+}
+# Гистограммы, разница которых даёт разбивку по стадиям
+STAGE_METRICS = {
+    "weld_stage_seconds": "stage",
+    "weld_inference_seconds": "model",
+}
+
+
+# -----------------------------------------------------------------------------
+# Метрики
+# -----------------------------------------------------------------------------
+async def scrape(http: httpx.AsyncClient, url: str | None) -> dict[str, tuple[float, float]]:
+    """{метка стадии: (сумма секунд, число замеров)} с /metrics; {} — недоступно."""
+    if not url:
+        return {}
+    from prometheus_client.parser import text_string_to_metric_families
+
+    try:
+        resp = await http.get(f"{url}/metrics", timeout=10)
+        resp.raise_for_status()
+    except httpx.HTTPError:
+        return {}
+    totals: dict[str, list[float]] = {}
+    for family in text_string_to_metric_families(resp.text):
+        label = STAGE_METRICS.get(family.name)
+        if label is None:
+            continue
+        for sample in family.samples:
+            key = sample.labels.get(label)
+            if key is None or not sample.name.endswith(("_sum", "_count")):
+                continue
+            entry = totals.setdefault(key, [0.0, 0.0])
+            entry[0 if sample.name.endswith("_sum") else 1] += sample.value
+    return {k: (v[0], v[1]) for k, v in totals.items()}
+
+
+def stage_breakdown(before: dict, after: dict, requests: int) -> dict[str, dict]:
+    """Стадии за прогон на один запрос: среднее время (мс) и число замеров."""
+    result = {}
+    for stage, (seconds, count) in sorted(after.items()):
+        seconds0, count0 = before.get(stage, (0.0, 0.0))
+        if count - count0 <= 0:
+            continue
+        result[stage] = {
+            "ms_per_request": (seconds - seconds0) * 1000 / max(1, requests),
+            "calls_per_request": (count - count0) / max(1, requests),
+            "ms_per_call": (seconds - seconds0) * 1000 / (count - count0),
+        }
+    return result
+
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    if len(ordered) == 1:
+        p50 = p95 = p99 = ordered[0]
+    else:
+        q = statistics.quantiles(ordered, n=100, method="inclusive")
+        p50, p95, p99 = q[49], q[94], q[98]
+    return {
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Прогон
+# -----------------------------------------------------------------------------
+async def run_level(
+    http: httpx.AsyncClient,
+    args,
+    endpoint: str,
+    size: tuple[int, int],
+    payload: bytes,
+    concurrency: int,
+) -> dict:
+    url = args.url + ENDPOINTS[endpoint]
+    params = {"progressive": "true"} if endpoint == "predict" and args.progressive else None
+    filename = f"bench_{size[0]}x{size[1]}.{args.format}"
+    content_type = f"image/{'jpeg' if args.format == 'jpg' else args.format}"
+
+    async def one() -> tuple[float, int | str]:
+        files = {"file": (filename, payload, content_type)}
+        start = time.perf_counter()
+        try:
+            resp = await http.post(url, files=files, params=params, timeout=args.timeout)
+            status = resp.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        return time.perf_counter() - start, status
+
+    for _ in range(args.warmup):
+        await one()
+
+    before = [await scrape(http, args.url), await scrape(http, args.ml_url)]
+    semaphore = asyncio.Semaphore(concurrency)
+    results: list[tuple[float, int | str]] = []
+
+    async def worker():
+        async with semaphore:
+            results.append(await one())
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.requests)))
+    wall = time.perf_counter() - started
+    after = [await scrape(http, args.url), await scrape(http, args.ml_url)]
+
+    ok = [latency for latency, status in results if isinstance(status, int) and status < 300]
+    statuses = Counter(str(status) for _, status in results)
+    return {
+        "endpoint": endpoint,
+        "width": size[0],
+        "height": size[1],
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "statuses": dict(statuses),
+        "wall_seconds": wall,
+        "throughput_rps": len(ok) / wall if wall else 0.0,
+        "latency": percentiles(ok),
+        "stages": {
+            "frontend": stage_breakdown(before[0], after[0], len(results)),
+            "ml": stage_breakdown(before[1], after[1], len(results)),
+        },
+    }
+
+
+def print_row(row: dict) -> None:
+    lat = row["latency"]
+    print(
+        f"{row['endpoint']:<8} {row['width']:>6}x{row['height']:<5} c={row['concurrency']:<3} "
+        f"ok={row['ok']}/{row['requests']:<4} {row['throughput_rps']:>7.2f} rps  "
+        f"p50={lat.get('p50_ms', 0):>8.0f}  p95={lat.get('p95_ms', 0):>8.0f}  p99={lat.get('p99_ms', 0):>8.0f} мс"
+    )
+    for service, stages in row["stages"].items():
+        top = sorted(stages.items(), key=lambda kv: -kv[1]["ms_per_request"])[:6]
+        if top:
+            parts = ", ".join(f"{k} {v['ms_per_request']:.0f}" for k, v in top)
+            print(f"    {service:<8} мс/запрос: {parts}")
+
+
+# -----------------------------------------------------------------------------
+# Локальный стенд
+# -----------------------------------------------------------------------------
+def spawn_stack(args) -> list[subprocess.Popen]:
+    """Запустить ML-сервис и фронтенд через uvicorn; адреса пишутся в args."""
+    env = {**os.environ, "PYTHONPATH": str(APPLICATION)}
+    db = args.db or f"sqlite:///{Path(tempfile.mkdtemp(prefix='weld-bench-')) / 'bench.db'}"
+    ml_env = {
+        **env,
+        "DETECTOR_BACKEND": args.spawn,
+        "STUB_LATENCY_MS": str(args.stub_latency_ms),
+        "STUB_BOXES": str(args.stub_boxes),
+        # Одна и та же синтетическая панорама иначе распознаётся из кэша
+        "TILE_CACHE_BYTES": str(64 * 2**20) if args.tile_cache else "0",
+    }
+    front_env = {**env, "ML_SERVICE_URL": f"http://127.0.0.1:{args.ml_port}", "DATABASE_URL": db}
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    procs = [
+        subprocess.Popen(uvicorn + ["--port", str(args.ml_port), "predict_service.ml_service:app"],
+                         cwd=APPLICATION, env=ml_env),
+        subprocess.Popen(uvicorn + ["--port", str(args.port), "app.main:application"],
+                         cwd=APPLICATION, env=front_env),
+    ]
+    args.url = f"http://127.0.0.1:{args.port}"
+    args.ml_url = f"http://127.0.0.1:{args.ml_port}"
+    args.db_url = db
+    return procs
+
+
+async def wait_ready(http: httpx.AsyncClient, urls: list[str], procs: list[subprocess.Popen], timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            if any(p.poll() is not None for p in procs):
+                raise SystemExit("Сервис завершился при старте, см. вывод выше")
+            try:
+                if (await http.get(f"{url}/metrics", timeout=2)).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise SystemExit(f"{url} не ответил за {timeout:.0f} с")
+            await asyncio.sleep(0.5)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args) -> dict:
+    sizes = [parse_size(s) for s in args.sizes.split(",")] if args.sizes else SIZES
+    endpoints = args.endpoint.split(",")
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    procs = spawn_stack(args) if args.spawn else []
+    try:
+        limits = httpx.Limits(max_connections=max(levels) + 4)
+        async with httpx.AsyncClient(limits=limits) as http:
+            if procs:
+                await wait_ready(http, [args.ml_url, args.url], procs, args.startup_timeout)
+            runs = []
+            for width, height in sizes:
+                payload = encode_panorama(synthetic_panorama(width, height), args.format)
+                for endpoint in endpoints:
+                    for concurrency in levels:
+                        row = await run_level(http, args, endpoint, (width, height), payload, concurrency)
+                        row["payload_bytes"] = len(payload)
+                        print_row(row)
+                        runs.append(row)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=30)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "backend": args.spawn or "external",
+            "args": {k: v for k, v in vars(args).items() if k != "out"},
+        },
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000", help="Фронтенд")
+    parser.add_argument("--ml-url", default="http://localhost:8001", help="ML-сервис (для стадий; '' — без него)")
+    parser.add_argument("--endpoint", default="predict", help="predict, upload или оба через запятую")
+    parser.add_argument("--sizes", default="", help="Размеры через запятую, например 31920x1152 (по умолчанию все известные)")
+    parser.add_argument("--concurrency", default="1,4", help="Уровни конкурентности через запятую")
+    parser.add_argument("--requests", type=int, default=8, help="Запросов на уровень")
+    parser.add_argument("--warmup", type=int, default=1, help="Прогревочных запросов на уровень (не учитываются)")
+    parser.add_argument("--progressive", action="store_true", help="POST /api/predict?progressive=true")
+    parser.add_argument("--format", choices=("png", "jpg"), default="png")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--out", default="", help="JSON с результатами (по умолчанию bench/results/load-<время>.json)")
+    spawn = parser.add_argument_group("локальный стенд")
+    spawn.add_argument("--spawn", choices=("stub", "yolo"), help="Запустить сервисы с заглушкой или настоящей моделью")
+    spawn.add_argument("--db", default="", help="DATABASE_URL фронтенда (по умолчанию временная SQLite)")
+    spawn.add_argument("--stub-latency-ms", type=float, default=20)
+    spawn.add_argument("--stub-boxes", type=int, default=2)
+    spawn.add_argument("--tile-cache", action="store_true", help="Не выключать кэш тайлов ML-сервиса")
+    spawn.add_argument("--port", type=int, default=18000)
+    spawn.add_argument("--ml-port", type=int, default=18001)
+    spawn.add_argument("--startup-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    out = Path(args.out) if args.out else ROOT / "bench" / "results" / f"load-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"Результаты: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарки горячих функций на фиксированных синтетических входах:
+
+  encode_png / encode_jpg   — app.utils.ndarray_to_bytes, тайл 1140×1152;
+  slice_panorama            — app.utils._slice_panorama, панорама 31920×1152;
+  predict_boxes_N           — DefectDetector.predict (перевод N боксов
+                              в координаты панорамы; инференс — StubDetector
+                              без задержки), predict_arrays_N — то же для
+                              /detect_batch;
+  draw_preds_N / join_tiles — PanoramaProcessor._draw_preds и _join_tiles;
+  report_N                  — app.utils.create_defects_report на N дефектов;
+  perona_malik              — model_training/perona_malik_filter.py, 512×512.
+
+Для каждого случая берётся число вызовов на раунд, чтобы раунд длился
+не меньше --min-time, и --rounds раундов; в отчёт идут медиана, минимум
+и разброс времени одного вызова. Случаи, для которых не хватает пакетов
+(matplotlib, python-docx), пропускаются.
+
+Результат — JSON в --out. С --compare старый.json печатается изменение
+медианы по каждому случаю; замедление больше --threshold помечается
+как регрессия (с --fail-on-regression — ненулевой код выхода).
+
+Запуск из корня репозитория:
+    python bench/micro.py --out bench/results/micro-base.json
+    python bench/micro.py -k encode,report --compare bench/results/micro-base.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "APPLICATION"))
+
+from synthetic import synthetic_panorama  # noqa: E402
+
+# Имя случая -> подготовка, возвращающая замеряемую функцию без аргументов
+CASES: dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+class Skip(Exception):
+    """Случай нельзя выполнить в этом окружении."""
+
+
+def _require(module: str) -> None:
+    if importlib.util.find_spec(module) is None:
+        raise Skip(f"нет пакета {module}")
+
+
+# -----------------------------------------------------------------------------
+# Фиксированные входы
+# -----------------------------------------------------------------------------
+_cache: dict[str, object] = {}
+
+
+def panorama() -> np.ndarray:
+    if "panorama" not in _cache:
+        _cache["panorama"] = synthetic_panorama(31920, 1152)
+    return _cache["panorama"]
+
+
+def tile() -> np.ndarray:
+    return np.ascontiguousarray(panorama()[:, :1140])
+
+
+def report_data(n: int) -> list[dict]:
+    """n дефектов, разложенных по 28 тайлам, в формате ответа API."""
+    names = ["пора", "включение", "подрез", "трещина", "несплавление"]
+    per_tile: list[list[dict]] = [[] for _ in range(28)]
+    for k in range(n):
+        x = 100 + k * 3
+        per_tile[k % 28].append({
+            "class": names[k % len(names)],
+            "confidence": f"{50 + k % 50:.2f}%",
+            "index": k % 28 + 1,
+            "coordinates": f"x1={x}, y1=300, x2={x + 40}, y2=330",
+            "length": k % 300,
+        })
+    return [{"status": "success" if d else "no_defects", "defects": d} for d in per_tile]
+
+
+class _Boxes:
+    """Минимальный заменитель ultralytics Boxes для _draw_preds."""
+
+    def __init__(self, n: int, width: int, height: int):
+        self._items = []
+        for k in range(n):
+            x1 = 20 + k * (width - 80) // max(1, n)
+            y1 = 40 + (k * 37) % (height - 100)
+            self._items.append(type("Box", (), {
+                "conf": np.array([0.5 + 0.4 * k / max(1, n)], np.float32),
+                "cls": np.array([k % 13], np.float32),
+                "xyxy": np.array([[x1, y1, x1 + 50, y1 + 30]], np.float32),
+            }))
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _processor():
+    from app.visualize_predictions import PanoramaProcessor
+    return PanoramaProcessor()
+
+
+# -----------------------------------------------------------------------------
+# Случаи
+# -----------------------------------------------------------------------------
+@case("encode_png")
+def _():
+    from app.utils import ndarray_to_bytes
+    t = tile()
+    return lambda: ndarray_to_bytes(t, format="png")
+
+
+@case("encode_jpg")
+def _():
+    from app.utils import ndarray_to_bytes
+    t = tile()
+    return lambda: ndarray_to_bytes(t, format="jpg")
+
+
+@case("slice_panorama")
+def _():
+    from app.utils import _slice_panorama
+    img = panorama()
+    return lambda: _slice_panorama(img)
+
+
+def _stub(boxes: int):
+    from predict_service.stub_detector import StubDetector
+    return StubDetector(latency=0, boxes=boxes)
+
+
+for _n in (10, 1000):
+    @case(f"predict_boxes_{_n}")
+    def _(n=_n):
+        detector, t = _stub(n), tile()
+        return lambda: detector.predict(t, panorama_size=(31920, 1152), index=3)
+
+    @case(f"predict_arrays_{_n}")
+    def _(n=_n):
+        detector, t = _stub(n), tile()
+        return lambda: detector.predict_arrays(t, panorama_size=(31920, 1152), index=3)
+
+
+for _n in (10, 200):
+    @case(f"draw_preds_{_n}")
+    def _(n=_n):
+        processor, t = _processor(), tile()
+        res = type("Result", (), {"boxes": _Boxes(n, t.shape[1], t.shape[0]), "masks": None})
+        names = dict(enumerate(f"class{k}" for k in range(13)))
+        return lambda: processor._draw_preds(t, res, names, 0.1)
+
+
+@case("join_tiles")
+def _():
+    from common.tiling import plan_for_image, tile_views
+    processor, img = _processor(), panorama()
+    plan = plan_for_image(img)
+    tiles = [np.ascontiguousarray(v) for v in tile_views(img, plan)]
+    return lambda: processor._join_tiles(tiles, plan)
+
+
+for _n in (10, 1000, 10000):
+    @case(f"report_{_n}")
+    def _(n=_n):
+        _require("docx")
+        from app.utils import create_defects_report
+        data = report_data(n)
+        out = os.path.join(tempfile.mkdtemp(prefix="weld-micro-"), "report.docx")
+        return lambda: create_defects_report(data, output_filename=out)
+
+
+@case("perona_malik")
+def _():
+    _require("matplotlib")
+    spec = importlib.util.spec_from_file_location(
+        "perona_malik_filter", ROOT / "model_training" / "perona_malik_filter.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    img = panorama()[:512, :512, 0].copy()
+    return lambda: module.perona_malik_filter(img, iterations=10)
+
+
+# -----------------------------------------------------------------------------
+# Замер
+# -----------------------------------------------------------------------------
+def measure(fn: Callable[[], object], rounds: int, min_time: float, max_time: float) -> dict:
+    """Время одного вызова по раундам; число вызовов на раунд — по min_time."""
+    fn()  # прогрев: импорты, кэши, ленивые инициализации
+    number, elapsed = 1, 0.0
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    times = [elapsed / number]
+    budget = time.perf_counter() + max_time
+    while len(times) < rounds and time.perf_counter() < budget:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "rounds": len(times),
+        "calls_per_round": number,
+    }
+
+
+def _fmt(seconds: float) -> str:
+    for unit, scale in (("с", 1), ("мс", 1e-3), ("мкс", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds * 1e9:.3g} нс"
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", default="", help="Только случаи, чьё имя содержит одну из подстрок (через запятую)")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Минимальная длительность раунда, с")
+    parser.add_argument("--max-time", type=float, default=30, help="Предел времени на случай, с")
+    parser.add_argument("--out", default="", help="JSON с результатами")
+    parser.add_argument("--compare", default="", help="JSON предыдущего прогона")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Порог регрессии (доля)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--list", action="store_true", help="Показать случаи и выйти")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(CASES))
+        return
+
+    filters = [f for f in args.k.split(",") if f]
+    baseline = json.loads(Path(args.compare).read_text())["results"] if args.compare else {}
+
+    results, skipped, regressions = {}, {}, []
+    print(f"{'случай':<20} {'медиана':>10} {'мин':>10} {'±':>9}  изменение")
+    for name, setup in CASES.items():
+        if filters and not any(f in name for f in filters):
+            continue
+        try:
+            fn = setup()
+        except (Skip, ImportError) as e:
+            skipped[name] = str(e)
+            print(f"{name:<20} пропущен: {e}")
+            continue
+        stats = results[name] = measure(fn, args.rounds, args.min_time, args.max_time)
+
+        change = ""
+        if name in baseline:
+            ratio = stats["median_s"] / baseline[name]["median_s"] - 1
+            change = f"{ratio:+.1%}"
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += "  РЕГРЕССИЯ"
+        print(
+            f"{name:<20} {_fmt(stats['median_s']):>10} {_fmt(stats['min_s']):>10} "
+            f"{_fmt(stats['stdev_s']):>9}  {change}"
+        )
+
+    if args.out:
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({
+            "meta": {
+                "commit": git_commit(),
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+            },
+            "results": results,
+            "skipped": skipped,
+        }, ensure_ascii=False, indent=2))
+        print(f"Результаты: {out}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(f"Регрессии: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
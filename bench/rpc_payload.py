@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Сравнение протоколов фронтенд ↔ ML-сервис по размеру сообщений и времени
+сериализации на одной панораме (без сети и инференса):
+
+  rest          — PNG-тайл в multipart /detect, JSON-ответ со строками
+                  координат, переформатирование confidence на фронтенде;
+  msgpack-png   — /detect_batch, тайлы PNG, ответ типизированными массивами;
+  msgpack-raw   — /detect_batch, тайлы сырыми байтами;
+  msgpack-shm   — /detect_batch, только координаты участков в сегменте.
+
+Время — медиана по --repeat прогонам на всю панораму, обе стороны вместе
+(кодирование на отправителе + декодирование на получателе).
+
+Запуск из корня репозитория:
+    python bench/rpc_payload.py --width 31920 --height 1152 --boxes 4
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "APPLICATION"))
+
+from common import rpc  # noqa: E402
+from common.boxes import format_coordinates, ruler_length  # noqa: E402
+from common.tiling import plan_tiles, tile_views  # noqa: E402
+from synthetic import synthetic_panorama  # noqa: E402
+
+try:
+    import cv2
+except ImportError:  # без OpenCV PNG-варианты пропускаются
+    cv2 = None
+
+NAMES = ["lack_of_fusion", "pore", "crack", "inclusion", "undercut"]
+BOUNDARY = b"b7a1c0e5f3d24a9c8e6b1f0a2d4c6e8f"
+
+
+def synthetic_boxes(plan, index: int, n: int, rng) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    offset = plan.tile_offset(index)
+    x1 = rng.integers(0, plan.tile_width - 60, n) + offset
+    y1 = rng.integers(0, plan.height - 60, n)
+    boxes = np.stack([x1, y1, x1 + rng.integers(10, 60, n), y1 + rng.integers(10, 60, n)], axis=1)
+    return rng.integers(0, len(NAMES), n), rng.random(n), boxes
+
+
+def rest_response(plan, index, classes, scores, boxes) -> dict:
+    """Ответ /detect в текущем формате DefectDetector.predict."""
+    detections = []
+    for c, s, b in zip(classes.tolist(), scores.tolist(), boxes.tolist()):
+        detections.append({
+            "class": NAMES[c],
+            "confidence": s,
+            "coordinates": format_coordinates(b),
+            "index": index,
+            "length": ruler_length(b[0], b[2], plan.width),
+            "box": b,
+        })
+    return {"status": "success" if detections else "no_defects", "detections": detections}
+
+
+def multipart(png: bytes, fields: dict) -> bytes:
+    """Тело multipart/form-data, как его собирает httpx."""
+    boundary = BOUNDARY
+    parts = []
+    for key, value in fields.items():
+        parts.append(
+            b"--" + boundary + b'\r\nContent-Disposition: form-data; name="' + key.encode()
+            + b'"\r\n\r\n' + str(value).encode() + b"\r\n"
+        )
+    parts.append(
+        b"--" + boundary + b'\r\nContent-Disposition: form-data; name="file"; filename="tile.png"'
+        b"\r\nContent-Type: image/png\r\n\r\n" + png + b"\r\n"
+    )
+    parts.append(b"--" + boundary + b"--\r\n")
+    return b"".join(parts)
+
+
+def run_rest(img, plan, results) -> tuple[int, int]:
+    sent = received = 0
+    for index, tile in enumerate(tile_views(img, plan), start=1):
+        ok, png = cv2.imencode(".png", tile, [int(cv2.IMWRITE_PNG_COMPRESSION), 6])
+        body = multipart(png.tobytes(), {
+            "index": index, "offset": plan.tile_offset(index),
+            "width": plan.width, "height": plan.height,
+        })
+        # ML-сервис: разбор multipart (упрощённо — срез) и декодирование PNG
+        start = body.index(b"\r\n\r\n", body.index(b'name="file"')) + 4
+        end = body.rindex(b"\r\n--" + BOUNDARY)
+        cv2.imdecode(np.frombuffer(body[start:end], np.uint8), cv2.IMREAD_COLOR)
+
+        reply = json.dumps(rest_response(plan, index, *results[index - 1])).encode()
+        # Фронтенд: разбор JSON и форматирование для API
+        for d in json.loads(reply)["detections"]:
+            f"{d['confidence'] * 100:.2f}%"
+        sent += len(body)
+        received += len(reply)
+    return sent, received
+
+
+def run_msgpack(img, plan, results, mode: str, batch: int) -> tuple[int, int]:
+    sent = received = 0
+    tiles = list(tile_views(img, plan))
+    segment = {"name": "weldpano_bench", "shape": list(img.shape), "dtype": img.dtype.str}
+    for start in range(0, plan.count, batch):
+        requests = []
+        for index in range(start + 1, min(start + batch, plan.count) + 1):
+            tile, offset = tiles[index - 1], plan.tile_offset(index)
+            if mode == "shm":
+                requests.append(rpc.TileRequest(index, offset, bounds=(0, plan.height, offset, offset + plan.tile_width)))
+            elif mode == "png":
+                ok, png = cv2.imencode(".png", tile, [int(cv2.IMWRITE_PNG_COMPRESSION), 6])
+                requests.append(rpc.TileRequest(index, offset, png.tobytes(), "png"))
+            else:
+                requests.append(rpc.TileRequest.from_array(tile, index, offset))
+        body = rpc.encode_batch(requests, plan.width, plan.height, segment if mode == "shm" else None)
+
+        # ML-сервис: распаковка и получение пикселей
+        msg = rpc.unpackb(body)
+        for t in map(rpc.TileRequest.unpack, msg["tiles"]):
+            if t.bounds is not None:
+                img[:, t.bounds[2]:t.bounds[3]]
+            elif t.format == "png":
+                cv2.imdecode(np.frombuffer(t.data, np.uint8), cv2.IMREAD_COLOR)
+            else:
+                t.raw_array()
+
+        reply = [rpc.packb(rpc.header(NAMES))]
+        for t in msg["tiles"]:
+            classes, scores, boxes = results[t["index"] - 1]
+            reply.append(rpc.packb(rpc.TileResult(
+                t["index"],
+                classes.astype(rpc.CLASS_DTYPE),
+                scores.astype(rpc.SCORE_DTYPE),
+                boxes.astype(rpc.BOX_DTYPE),
+            ).pack()))
+        # Фронтенд: потоковая распаковка и детекции для слияния
+        names = None
+        for m in rpc.iter_messages(reply):
+            if names is None:
+                names = m["names"]
+                continue
+            for d in rpc.TileResult.unpack(m).detections(names, plan.width):
+                f"{d['confidence'] * 100:.2f}%"
+        sent += len(body)
+        received += sum(map(len, reply))
+    return sent, received
+
+
+def measure(fn, repeat: int) -> tuple[float, int, int]:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        sent, received = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), sent, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=31920)
+    parser.add_argument("--height", type=int, default=1152)
+    parser.add_argument("--boxes", type=int, default=4, help="Детекций на тайл")
+    parser.add_argument("--batch", type=int, default=8, help="Участков в запросе /detect_batch")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if not rpc.available():
+        sys.exit("Нужен msgpack: pip install msgpack")
+
+    img = synthetic_panorama(args.width, args.height)
+    plan = plan_tiles(args.width, args.height)
+    rng = np.random.default_rng(1)
+    results = [synthetic_boxes(plan, i, args.boxes, rng) for i in range(1, plan.count + 1)]
+
+    cases = {
+        "rest":        lambda: run_rest(img, plan, results),
+        "msgpack-png": lambda: run_msgpack(img, plan, results, "png", args.batch),
+        "msgpack-raw": lambda: run_msgpack(img, plan, results, "raw", args.batch),
+        "msgpack-shm": lambda: run_msgpack(img, plan, results, "shm", args.batch),
+    }
+    if cv2 is None:
+        print("OpenCV не установлен: rest и msgpack-png пропущены")
+        del cases["rest"], cases["msgpack-png"]
+
+    print(f"Панорама {args.width}x{args.height}, тайлов {plan.count}, детекций на тайл {args.boxes}")
+    print(f"{'протокол':<13} {'запросы, МБ':>12} {'ответы, КБ':>11} {'время, мс':>10}")
+    for name, fn in cases.items():
+        seconds, sent, received = measure(fn, args.repeat)
+        print(f"{name:<13} {sent / 2**20:>12.2f} {received / 2**10:>11.1f} {seconds * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Холодный старт процесса сервиса: время импорта модуля приложения, время
+lifespan-старта (схема БД и прочая инициализация) и RSS после старта.
+
+Каждый прогон — отдельный процесс python, поэтому кэш импортов не
+переиспользуется (кэш страниц ОС — да; первый прогон обычно медленнее,
+он отбрасывается как прогрев). Печатаются медианы и список тяжёлых
+пакетов, которые оказались в sys.modules.
+
+Фронтенд по умолчанию поднимается на временной SQLite-базе (--db —
+любой DATABASE_URL).
+
+Запуск из корня репозитория:
+    python bench/startup.py
+    python bench/startup.py --app predict_service.ml_service:app --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+APPLICATION = Path(__file__).resolve().parents[1] / "APPLICATION"
+
+HEAVY = ("torch", "ultralytics", "matplotlib", "docx", "PIL", "yaml", "pandas", "scipy")
+
+CHILD = r"""
+import asyncio, json, resource, sys, time
+t0 = time.perf_counter()
+module_name, attr = sys.argv[1].split(":")
+module = __import__(module_name, fromlist=[attr])
+app = getattr(module, attr)
+t1 = time.perf_counter()
+
+async def lifespan():
+    async with app.router.lifespan_context(app):
+        pass
+
+asyncio.run(lifespan())
+t2 = time.perf_counter()
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * resource.getpagesize()
+print(json.dumps({
+    "import_s": t1 - t0,
+    "startup_s": t2 - t1,
+    "rss_mib": rss / 2**20,
+    "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": sorted(m for m in sys.argv[2].split(",") if m in sys.modules),
+}))
+"""
+
+
+def run_once(app: str, env: dict) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, app, ",".join(HEAVY)],
+        cwd=APPLICATION, env=env, capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        sys.exit(f"{app} не стартовал:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app.main:application", help="модуль:объект ASGI-приложения")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--db", default="", help="DATABASE_URL (по умолчанию временная SQLite)")
+    parser.add_argument("--out", default="", help="JSON с результатами")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="weld-startup-")
+    env = dict(os.environ)
+    env["DATABASE_URL"] = args.db or f"sqlite:///{tmp}/weld.db"
+    env.setdefault("YOLO_CONFIG_DIR", tmp)
+
+    run_once(args.app, env)  # прогрев кэша страниц
+    runs = [run_once(args.app, env) for _ in range(args.runs)]
+
+    summary = {
+        key: statistics.median(r[key] for r in runs)
+        for key in ("import_s", "startup_s", "rss_mib", "peak_rss_mib")
+    }
+    summary["heavy"] = runs[-1]["heavy"]
+    print(f"{args.app}: медиана по {args.runs} процессам")
+    print(f"  импорт         {summary['import_s'] * 1000:8.0f} мс")
+    print(f"  lifespan-старт {summary['startup_s'] * 1000:8.0f} мс")
+    print(f"  RSS            {summary['rss_mib']:8.0f} МиБ (пик {summary['peak_rss_mib']:.0f} МиБ)")
+    print(f"  тяжёлые пакеты {', '.join(summary['heavy']) or '—'}")
+
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps({"app": args.app, "summary": summary, "runs": runs}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Синтетические входные данные для bench/: панорамы, похожие на плёнку,
+фиксированного размера и с фиксированным seed — прогоны сравнимы между
+коммитами.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "APPLICATION"))
+
+from common.tiling import LEGACY_SIZE_MAP  # noqa: E402
+
+# Размеры известных плёнок (ширина, высота)
+SIZES: list[tuple[int, int]] = list(LEGACY_SIZE_MAP)
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    """'31920x1152' -> (31920, 1152)."""
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def synthetic_panorama(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Похожая на плёнку панорама: плавный фон, шов и зерно."""
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 8 * np.pi, width, dtype=np.float32)[None, :]
+    base = 110 + 40 * np.sin(x) * np.exp(-((y - 0.5) ** 2) / 0.02)
+    noise = rng.normal(0, 6, (height, width)).astype(np.float32)
+    gray = np.clip(base + noise, 0, 255).astype(np.uint8)
+    return np.repeat(gray[:, :, None], 3, axis=2)
+
+
+def encode_panorama(img: np.ndarray, fmt: str = "png") -> bytes:
+    """Файл панорамы, как его загружает пользователь."""
+    import cv2
+
+    ok, buf = cv2.imencode(f".{fmt}", img)
+    if not ok:
+        raise ValueError(f"Не удалось закодировать панораму в {fmt}")
+    return buf.tobytes()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# build_dataset.py
+"""
+Инкрементальная сборка датасета: цепочка шагов как в make.
+
+    organize        organize_images.py          — раскладка train/val/test, seed val
+    split_panorama  split_panorama_by_samples.py — нарезка origin → samples
+    split_labels    split_labels_by_samples.py   — разметка по тайлам
+    sample_lists    update_sample_lists.py       — <split>_samples.txt
+
+Для каждого шага в манифесте сборки (SQLite, data/.build.sqlite) хранятся
+параметры и отпечатки входов и выходов. Отпечаток — sha256 по всем
+файлам: .txt (разметка, списки) хэшируются по содержимому, остальные
+файлы (изображения) — по размеру и времени изменения. Шаг пропускается, если
+с его последнего завершения не изменились ни параметры, ни входы, ни
+выходы. Выходы шага — входы следующих, поэтому изменения доходят по
+цепочке сами.
+
+Внутри шагов работа тоже инкрементальная: organize копирует только
+новые файлы и не меняет состав val (отбор по sha256(seed:имя)),
+нарезка пропускает панорамы по своему манифесту, разметка и списки не
+перезаписывают файлы с тем же содержимым.
+
+Запуск из корня репозитория:
+    python build_dataset.py                  # собрать то, что устарело
+    python build_dataset.py --dry-run        # показать устаревшие шаги и зависящие от них
+    python build_dataset.py --only split_labels --force
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+import organize_images
+import split_labels_by_samples
+import split_panorama_by_samples
+import update_sample_lists
+
+DATA = Path("data")
+MANIFEST = DATA / ".build.sqlite"
+SPLITS = ("train", "val", "test")
+
+# Разметка и списки хэшируются по содержимому, остальное (изображения) — по stat
+CONTENT_HASHED = {".txt"}
+# Служебные файлы шагов и сборки в отпечатки не входят
+IGNORED = {"manifest.json", ".image_sizes.json", ".build.sqlite"}
+
+
+def _file_digest(path: Path) -> str:
+    if path.suffix.lower() in CONTENT_HASHED:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    st = path.stat()
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def fingerprint(paths: list[Path]) -> dict:
+    """Отпечаток набора файлов и каталогов: sha256 и число файлов."""
+    h = hashlib.sha256()
+    files = 0
+    for root in paths:
+        h.update(f"\0{root.as_posix()}\0".encode())
+        if root.is_file():
+            members = [root]
+        elif root.is_dir():
+            members = sorted(p for p in root.rglob("*") if p.is_file())
+        else:
+            h.update(b"missing")
+            continue
+        for path in members:
+            if path.name in IGNORED or path.name.endswith(".tmp"):
+                continue
+            h.update(f"{path.relative_to(root).as_posix()}={_file_digest(path)}\n".encode())
+            files += 1
+    return {"sha256": h.hexdigest(), "files": files}
+
+
+@dataclass
+class Step:
+    name: str
+    run: Callable[[argparse.Namespace], None]
+    inputs: Callable[[argparse.Namespace], list[Path]]
+    outputs: Callable[[argparse.Namespace], list[Path]]
+    params: Callable[[argparse.Namespace], dict]
+
+
+def _organize(args):
+    organize_images.organize(args.source, ratio=args.val_ratio, seed=args.seed)
+
+
+def _split_panorama(args):
+    for split in SPLITS:
+        split_panorama_by_samples.process_split(split, args.jobs, args.format, args.png_compression, False)
+
+
+def _split_labels(args):
+    with split_labels_by_samples.SizeCache(split_labels_by_samples.SIZE_CACHE) as sizes:
+        for split in SPLITS:
+            split_labels_by_samples.process_split(split, sizes)
+
+
+def _sample_lists(args):
+    update_sample_lists.update_lists(DATA, args.old_root, args.new_root)
+
+
+STEPS = [
+    Step(
+        "organize", _organize,
+        inputs=lambda a: [
+            a.source,
+            *(cfg["txt"] for cfg in organize_images.SPLITS.values()),
+        ],
+        outputs=lambda a: [
+            *(cfg["img"] for cfg in organize_images.SPLITS.values()),
+            organize_images.SPLITS["train"]["lbl"],
+            organize_images.VAL_IMG_DIR, organize_images.VAL_LBL_DIR,
+            DATA / "train.txt", DATA / "val.txt",
+        ],
+        params=lambda a: {"val_ratio": a.val_ratio, "seed": a.seed},
+    ),
+    Step(
+        "split_panorama", _split_panorama,
+        inputs=lambda a: [DATA / "images" / s / "origin" for s in SPLITS],
+        outputs=lambda a: [DATA / "images" / s / "samples" for s in SPLITS],
+        params=lambda a: {"format": a.format, "png_compression": a.png_compression},
+    ),
+    Step(
+        "split_labels", _split_labels,
+        inputs=lambda a: [DATA / "labels" / s / "origin" for s in SPLITS]
+                         + [DATA / "images" / s / "origin" for s in SPLITS],
+        outputs=lambda a: [DATA / "labels" / s / "samples" for s in SPLITS],
+        params=lambda a: {},
+    ),
+    Step(
+        "sample_lists", _sample_lists,
+        inputs=lambda a: [DATA / f"{s}.txt" for s in SPLITS] + [DATA / "images" / s / "samples" for s in SPLITS],
+        outputs=lambda a: [DATA / f"{s}_samples.txt" for s in SPLITS],
+        params=lambda a: {"old_root": a.old_root, "new_root": a.new_root},
+    ),
+]
+
+
+class BuildManifest:
+    """Манифест сборки: по строке на шаг с параметрами и отпечатками."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS steps ("
+            " name TEXT PRIMARY KEY, params TEXT, inputs TEXT, outputs TEXT,"
+            " finished_at TEXT, seconds REAL)"
+        )
+
+    def get(self, name: str) -> dict | None:
+        row = self.db.execute(
+            "SELECT params, inputs, outputs FROM steps WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"params": json.loads(row[0]), "inputs": json.loads(row[1]), "outputs": json.loads(row[2])}
+
+    def put(self, name: str, params: dict, inputs: dict, outputs: dict, seconds: float) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?, ?)",
+                (name, json.dumps(params, sort_keys=True), json.dumps(inputs), json.dumps(outputs),
+                 time.strftime("%Y-%m-%dT%H:%M:%S"), seconds),
+            )
+
+    def forget(self, name: str) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM steps WHERE name = ?", (name,))
+
+
+def stale_reason(step: Step, args, record: dict | None) -> tuple[str | None, dict, dict, dict]:
+    """Почему шаг надо выполнить (None — актуален) и его текущие параметры и отпечатки."""
+    params = step.params(args)
+    inputs = fingerprint(step.inputs(args))
+    outputs = fingerprint(step.outputs(args))
+    if record is None:
+        return "ещё не выполнялся", params, inputs, outputs
+    if record["params"] != params:
+        return "изменились параметры", params, inputs, outputs
+    if record["inputs"] != inputs:
+        return "изменились входы", params, inputs, outputs
+    if record["outputs"] != outputs:
+        return "изменились выходы", params, inputs, outputs
+    return None, params, inputs, outputs
+
+
+def _overlaps(a: list[Path], b: list[Path]) -> bool:
+    """Есть ли среди путей a и b совпадающие или вложенные друг в друга."""
+    return any(p == q or q in p.parents or p in q.parents for p in a for q in b)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--source", type=Path, default=organize_images.SOURCE_DIR, help="Каталог исходных плёнок")
+    ap.add_argument("--val-ratio", type=float, default=0.1)
+    ap.add_argument("--seed", type=int, default=0, help="Seed отбора val")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Процессов нарезки")
+    ap.add_argument("--format", choices=("png", "webp"), default="png")
+    ap.add_argument("--png-compression", type=int, choices=range(10), default=None, metavar="0-9")
+    ap.add_argument("--old-root", default="", help="Префикс путей в списках для замены")
+    ap.add_argument("--new-root", default="")
+    ap.add_argument("--only", nargs="+", choices=[s.name for s in STEPS], help="Только эти шаги")
+    ap.add_argument("--force", action="store_true", help="Выполнить шаги, даже если они актуальны")
+    ap.add_argument("--dry-run", action="store_true", help="Только показать устаревшие шаги")
+    args = ap.parse_args()
+
+    manifest = BuildManifest(MANIFEST)
+    pending: list[Step] = []  # устаревшие шаги, не выполненные из-за --dry-run
+    for step in STEPS:
+        if args.only and step.name not in args.only:
+            continue
+        reason, params, _, _ = stale_reason(step, args, manifest.get(step.name))
+        if reason is None and args.dry_run:
+            # Входы шага — выходы устаревшего шага выше: после него устареет и этот
+            upstream = [s.name for s in pending if _overlaps(step.inputs(args), s.outputs(args))]
+            if upstream:
+                reason = f"устареет после {', '.join(upstream)}"
+        if reason is None and not args.force:
+            print(f"= {step.name}: актуален")
+            continue
+        print(f"▶ {step.name}: {reason or 'принудительно'}")
+        if args.dry_run:
+            pending.append(step)
+            continue
+
+        # Незавершённый шаг не должен считаться выполненным
+        manifest.forget(step.name)
+        start = time.perf_counter()
+        step.run(args)
+        seconds = time.perf_counter() - start
+        # Отпечатки — после шага: это состояние, которое он оставил
+        manifest.put(step.name, params, fingerprint(step.inputs(args)), fingerprint(step.outputs(args)), seconds)
+        print(f"✓ {step.name}: {seconds:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
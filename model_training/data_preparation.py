@@ -1,10 +1,138 @@
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
 import cv2
 import numpy as np
 from tqdm import tqdm
 
 # ПОДГОТОВКА ДАТАСЕТА ДЛЯ ОБУЧЕНИЯ,
 # ПРОПУСКАЮТСЯ ИЗОБРАЖЕНИЯ С СО СРЕДНЕЙ ИНТЕНСИВНОСТЬЮ >= 170
+#
+# Панорамы обрабатываются в пуле процессов (jobs), JPEG-тайлы пишутся
+# в потоках (writer_threads). Разметка панорамы разбирается один раз
+# в массивы numpy, полигоны раскладываются по тайлам по интервалу x,
+# обрезка и нормировка идут одной операцией на тайл. Файлы разметки
+# совпадают байт в байт с прежней покадровой версией.
+
+
+def _read_polygons(label_path, W, H):
+    """
+    Полигоны разметки панорамы в пикселях.
+
+    Returns:
+        tuple: (классы — строки как в файле, точки (N, 2) float64,
+            границы полигонов в массиве точек (P + 1,)).
+            Полигоны меньше чем из двух точек отброшены: в разметку
+            тайла они не попадают.
+    """
+    classes, values, starts = [], [], [0]
+    if os.path.exists(label_path):
+        with open(label_path, 'r') as f:
+            for line in f.readlines():
+                ann = line.strip().split()
+                if not ann:
+                    continue
+                pairs = (len(ann) - 1) // 2
+                if pairs < 2:
+                    continue
+                classes.append(ann[0])
+                values.extend(map(float, ann[1:1 + 2 * pairs]))
+                starts.append(starts[-1] + pairs)
+    points = np.array(values, dtype=np.float64).reshape(-1, 2)
+    points[:, 0] *= W
+    points[:, 1] *= H
+    return classes, points, np.array(starts)
+
+
+def _bucket_by_tile(points, starts, columns, tile_width):
+    """Номера полигонов для каждого тайла (в порядке файла разметки)."""
+    buckets = [[] for _ in range(columns)]
+    if len(starts) < 2:
+        return buckets
+    x_min = np.minimum.reduceat(points[:, 0], starts[:-1])
+    x_max = np.maximum.reduceat(points[:, 0], starts[:-1])
+    # Кандидаты по делению с запасом в тайл, затем точное условие:
+    # полигон касается [x_start, x_end] включительно с обеих сторон
+    first = np.clip(np.floor(x_min / tile_width).astype(np.int64) - 1, 0, columns - 1)
+    last = np.clip(np.floor(x_max / tile_width).astype(np.int64), 0, columns - 1)
+    for p, (lo, hi, left, right) in enumerate(zip(first.tolist(), last.tolist(), x_min.tolist(), x_max.tolist())):
+        for col in range(lo, hi + 1):
+            x_start = col * tile_width
+            if not (right < x_start or left > x_start + tile_width):
+                buckets[col].append(p)
+    return buckets
+
+
+def _tile_annotations(classes, points, starts, polygons, x_start, tile_width, tile_height):
+    """Строки разметки тайла: точки полигонов обрезаны по тайлу и нормированы."""
+    if not polygons:
+        return []
+    index = np.concatenate([np.arange(starts[p], starts[p + 1]) for p in polygons])
+    x = np.maximum(x_start, np.minimum(points[index, 0], x_start + tile_width))
+    rel = np.empty(2 * len(index))
+    rel[0::2] = (x - x_start) / tile_width
+    rel[1::2] = points[index, 1] / tile_height
+    values = rel.tolist()
+
+    lines, k = [], 0
+    for p in polygons:
+        n = 2 * (starts[p + 1] - starts[p])
+        lines.append(f"{classes[p]} " + " ".join(map(str, values[k:k + n])))
+        k += n
+    return lines
+
+
+def _process_panorama(image_file, input_images_dir, input_labels_dir, output_images_dir,
+                      output_labels_dir, tile_width, tile_height, intensity_threshold, writer_threads):
+    """Нарезать одну панораму; вернуть (тайлов записано, предупреждение или None)."""
+    base_name = os.path.splitext(image_file)[0]
+    image_path = os.path.join(input_images_dir, image_file)
+    label_path = os.path.join(input_labels_dir, f"{base_name}.txt")
+
+    image = cv2.imread(image_path)
+    if image is None:
+        return 0, f"\nВнимание: не прочитан файл изображения {image_path}\n"
+
+    H, W = image.shape[:2]
+
+    if H != tile_height:
+        return 0, f"\nВнимание:  высота изображения {H} не соответствует {tile_height} для {image_file}\n"
+
+    if W % tile_width != 0:
+        return 0, f"\nВнимание: отсутствует целое число тайлов ({tile_width}x{tile_height}) в {image_file}\n"
+
+    columns = W // tile_width
+    classes, points, starts = _read_polygons(label_path, W, H)
+    buckets = _bucket_by_tile(points, starts, columns, tile_width)
+
+    written = 0
+    with ThreadPoolExecutor(writer_threads) as writers:
+        encoded = []
+        for col in range(columns):
+            x_start = col * tile_width
+            tile = image[0:tile_height, x_start:x_start + tile_width]
+
+            gray_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
+            if np.mean(gray_tile) >= intensity_threshold:
+                continue
+
+            # JPEG кодируется в потоке, тайл — view на панораму
+            encoded.append(writers.submit(
+                cv2.imwrite, os.path.join(output_images_dir, f"{base_name}_{col}.jpg"), tile
+            ))
+
+            tile_annotations = _tile_annotations(
+                classes, points, starts, buckets[col], x_start, tile_width, tile_height
+            )
+            with open(os.path.join(output_labels_dir, f"{base_name}_{col}.txt"), 'w') as f:
+                if tile_annotations:
+                    f.write("\n".join(tile_annotations))
+            written += 1
+        for future in encoded:
+            future.result()
+    return written, None
+
 
 def process_panoramas(input_images_dir='all_images/',
                       input_labels_dir='all_labels/',
@@ -12,84 +140,40 @@ def process_panoramas(input_images_dir='all_images/',
                       output_labels_dir='datasetz/labels/',
                       tile_width=1140,
                       tile_height=1152,
-                      intensity_threshold=170):
+                      intensity_threshold=170,
+                      jobs=None,
+                      writer_threads=4):
     os.makedirs(output_images_dir, exist_ok=True)
     os.makedirs(output_labels_dir, exist_ok=True)
 
     image_files = [f for f in os.listdir(input_images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-
-    for image_file in tqdm(image_files, desc="Обработка панорам"):
-        base_name = os.path.splitext(image_file)[0]
-        image_path = os.path.join(input_images_dir, image_file)
-        label_path = os.path.join(input_labels_dir, f"{base_name}.txt")
-
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"\nВнимание: не прочитан файл изображения {image_path}\n")
-            continue
-
-        H, W = image.shape[:2]
-
-        if H != tile_height:
-            print(f"\nВнимание:  высота изображения {H} не соответствует {tile_height} для {image_file}\n")
-            continue
-
-        annotations = []
-        if os.path.exists(label_path):
-            with open(label_path, 'r') as f:
-                annotations = [line.strip().split() for line in f.readlines() if line.strip()]
-
-        if W % tile_width != 0:
-            print(f"\nВнимание: отсутствует целое число тайлов ({tile_width}x{tile_height}) в {image_file}\n")
-            continue
-
-        for col in range(W // tile_width):
-            x_start = col * tile_width
-            x_end = x_start + tile_width
-
-            tile = image[0:tile_height, x_start:x_end]
-
-            gray_tile = cv2.cvtColor(tile, cv2.COLOR_BGR2GRAY)
-            mean_intensity = np.mean(gray_tile)
-
-            if mean_intensity >= intensity_threshold:
-                continue
-
-            tile_annotations = []
-            for ann in annotations:
-                class_id = ann[0]
-                points = list(map(float, ann[1:]))
-
-                abs_points = [(x * W, y * H) for x, y in zip(points[::2], points[1::2])]
-
-                x_min = min(x for x, y in abs_points)
-                x_max = max(x for x, y in abs_points)
-
-                if x_max < x_start or x_min > x_end:
-                    continue
-
-                new_points = []
-                for x, y in abs_points:
-                    x_new = max(x_start, min(x, x_end))
-                    y_new = y
-                    x_rel = (x_new - x_start) / tile_width
-                    y_rel = y_new / tile_height
-                    new_points.extend([x_rel, y_rel])
-
-                if len(new_points) >= 4:
-                    tile_annotations.append(f"{class_id} " + " ".join(map(str, new_points)))
-
-            tile_filename = f"{base_name}_{col}.jpg"
-            label_filename = f"{base_name}_{col}.txt"
-
-            cv2.imwrite(os.path.join(output_images_dir, tile_filename), tile)
-
-            if tile_annotations:
-                with open(os.path.join(output_labels_dir, label_filename), 'w') as f:
-                    f.write("\n".join(tile_annotations))
-            else:
-                open(os.path.join(output_labels_dir, label_filename), 'w').close()
+    args = (input_images_dir, input_labels_dir, output_images_dir, output_labels_dir,
+            tile_width, tile_height, intensity_threshold, writer_threads)
+    jobs = jobs or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    tiles = 0
+    if jobs == 1:
+        results = (_process_panorama(f, *args) for f in image_files)
+        for written, warning in tqdm(results, total=len(image_files), desc="Обработка панорам"):
+            tiles += written
+            if warning:
+                print(warning)
+    else:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = [pool.submit(_process_panorama, f, *args) for f in image_files]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Обработка панорам"):
+                written, warning = future.result()
+                tiles += written
+                if warning:
+                    print(warning)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Панорам: {len(image_files)}, тайлов: {tiles}, {elapsed:.1f} с — "
+        f"{len(image_files) / elapsed if elapsed else 0:.2f} панорам/с"
+    )
 
 
 if __name__ == "__main__":
-    process_panoramas()
\ No newline at end of file
+    process_panoramas()
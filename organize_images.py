@@ -1,13 +1,15 @@
 # organize_images.py
 
+import hashlib
 import shutil
-import random
 from pathlib import Path
 
-def copy_split(txt_path: Path, dest_dir: Path, file_map: dict):
+def copy_split(txt_path: Path, dest_dir: Path, file_map: dict, skip_dirs: tuple = ()):
     """
     Копирует файлы из списка txt_path в папку dest_dir, используя заранее
-    построенный file_map (имя→полный путь).
+    построенный file_map (имя→полный путь). Файлы, которые уже лежат
+    в dest_dir с тем же размером и временем изменения (copy2 их сохраняет)
+    или в одной из skip_dirs (уже выделены в val), не копируются.
     """
     if not txt_path.exists():
         print(f'ERROR: не найден файл {txt_path}')
@@ -24,13 +26,32 @@ def copy_split(txt_path: Path, dest_dir: Path, file_map: dict):
             src = file_map.get(filename)
             if src:
                 dst = dest_dir / filename
-                shutil.copy(src, dst)
+                if any((d / filename).exists() for d in skip_dirs) or _same_file(src, dst):
+                    continue
+                shutil.copy2(src, dst)
                 count += 1
                 print(f'Copied to {dest_dir.name}: {filename}')
             else:
                 print(f'WARNING: {filename} не найден в исходных данных')
     return count
 
+def _same_file(src: Path, dst: Path) -> bool:
+    if not dst.exists():
+        return False
+    a, b = src.stat(), dst.stat()
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+def _listed_names(txt_path: Path) -> set | None:
+    """Имена файлов из списка txt_path (пути сводятся к имени); None — списка нет."""
+    if not txt_path.exists():
+        return None
+    with txt_path.open('r', encoding='utf-8') as f:
+        return {Path(line.strip()).name for line in f if line.strip()}
+
+def _val_rank(name: str, seed: int) -> str:
+    """Порядок отбора в val: зависит только от имени файла и seed."""
+    return hashlib.sha256(f'{seed}:{name}'.encode('utf-8')).hexdigest()
+
 def clean_split(dest_dir: Path, labels_dir: Path):
     """
     Удаляет из dest_dir все PNG-файлы, для которых нет соответствующего
@@ -55,79 +76,116 @@ def split_val_set(
     val_lbl_dir: Path,
     val_txt: Path,
     train_txt: Path,
-    ratio: float = 0.1
+    ratio: float = 0.1,
+    seed: int = 0,
+    listed: set | None = None
 ):
     """
     Выделяет ratio долю изображений вместе с их .txt в папку val,
     создаёт val.txt и train.txt с путями к новым наборам.
+
+    Отбор детерминирован: изображения train и уже выделенного val
+    упорядочиваются по sha256(seed:имя), в val идут первые. Повторный
+    запуск на тех же файлах ничего не перемещает; при изменении набора
+    перемещаются только файлы, сменившие сплит.
+
+    listed — имена из списка train (train_base.txt): в отбор идут только
+    они, а изображения val (и их разметка), которых в списке больше нет,
+    удаляются. None — в отбор идут все изображения train и val.
     """
-    imgs = list(train_img_dir.glob('*.png'))
-    n_val = max(1, int(len(imgs) * ratio))
-    val_imgs = set(random.sample(imgs, n_val))
+    pool = {img.name: img for img in train_img_dir.glob('*.png')}
+    if val_img_dir.exists():
+        for img in val_img_dir.glob('*.png'):
+            if listed is not None and img.name not in listed:
+                img.unlink()
+                lbl = val_lbl_dir / f'{img.stem}.txt'
+                if lbl.exists():
+                    lbl.unlink()
+                print(f'Deleted from {val_img_dir.as_posix()} (not listed): {img.name}')
+                continue
+            pool[img.name] = img
+    if listed is not None:
+        pool = {name: img for name, img in pool.items() if name in listed}
+    n_val = max(1, int(len(pool) * ratio)) if pool else 0
+    val_names = set(sorted(pool, key=lambda name: _val_rank(name, seed))[:n_val])
 
     # Создаём папки
     val_img_dir.mkdir(parents=True, exist_ok=True)
     val_lbl_dir.mkdir(parents=True, exist_ok=True)
 
-    # Перемещаем и записываем val.txt
+    # Перемещаем изображения и разметку туда, где им положено быть
+    moved = 0
+    for name, img in pool.items():
+        img_dir, lbl_dir = (val_img_dir, val_lbl_dir) if name in val_names else (train_img_dir, train_lbl_dir)
+        if img.parent == img_dir:
+            continue
+        shutil.move(str(img), str(img_dir / name))
+        lbl_src = (train_lbl_dir if img.parent == train_img_dir else val_lbl_dir) / f'{img.stem}.txt'
+        if lbl_src.exists():
+            shutil.move(str(lbl_src), str(lbl_dir / lbl_src.name))
+        moved += 1
+
     with val_txt.open('w', encoding='utf-8') as vf:
-        for img in val_imgs:
-            # move image
-            dst_img = val_img_dir / img.name
-            shutil.move(str(img), str(dst_img))
-            # move label if есть
-            lbl_src = train_lbl_dir / f'{img.stem}.txt'
-            if lbl_src.exists():
-                dst_lbl = val_lbl_dir / lbl_src.name
-                shutil.move(str(lbl_src), str(dst_lbl))
-            # записываем путь в val.txt
-            vf.write(f'{val_img_dir.as_posix()}/{img.name}\n')
-
-    print(f'Moved {n_val} images + labels to {val_img_dir.name} / {val_lbl_dir.name}')
+        for name in sorted(val_names):
+            vf.write(f'{val_img_dir.as_posix()}/{name}\n')
+
+    print(f'Moved {moved} images + labels between {train_img_dir.name} and {val_img_dir.name}, val: {n_val}')
 
     # Записываем train.txt из оставшихся
-    remaining = list(train_img_dir.glob('*.png'))
+    remaining = sorted(name for name in pool if name not in val_names)
     with train_txt.open('w', encoding='utf-8') as tf:
-        for img in remaining:
-            tf.write(f'{train_img_dir.as_posix()}/{img.name}\n')
+        for name in remaining:
+            tf.write(f'{train_img_dir.as_posix()}/{name}\n')
     print(f'Wrote {len(remaining)} remaining images to {train_txt}')
 
-def main():
-    source_dir = Path('data/films-1000')
-    splits = {
-        'train': {
-            'txt':    Path('data/train_base.txt'),
-            'img':    Path('data/images/train/origin'),
-            'lbl':    Path('data/labels/train/origin'),
-        },
-        'test': {
-            'txt':    Path('data/test.txt'),
-            'img':    Path('data/images/test/origin'),
-            'lbl':    None,
-        }
+SOURCE_DIR = Path('data/films-1000')
+SPLITS = {
+    'train': {
+        'txt':    Path('data/train_base.txt'),
+        'img':    Path('data/images/train/origin'),
+        'lbl':    Path('data/labels/train/origin'),
+    },
+    'test': {
+        'txt':    Path('data/test.txt'),
+        'img':    Path('data/images/test/origin'),
+        'lbl':    None,
     }
+}
+VAL_IMG_DIR = Path('data/images/val/origin')
+VAL_LBL_DIR = Path('data/labels/val/origin')
 
+def organize(source_dir: Path = SOURCE_DIR, ratio: float = 0.1, seed: int = 0):
+    """
+    Раскладывает панорамы по train/val/test. Повторный запуск копирует
+    только новые и изменённые файлы и не меняет состав val.
+    """
     # 1. Сбор .png и копирование train/test
     print(f'Сканирование {source_dir}…')
     file_map = {p.name: p for p in source_dir.rglob('*.png')}
 
-    for name, cfg in splits.items():
+    for name, cfg in SPLITS.items():
         print(f'\n=== Обработка "{name}" ===')
-        copied = copy_split(cfg['txt'], cfg['img'], file_map)
+        skip = (VAL_IMG_DIR,) if name == 'train' else ()
+        copied = copy_split(cfg['txt'], cfg['img'], file_map, skip)
         deleted = clean_split(cfg['img'], cfg['lbl'])
         print(f'{name}: скопировано {copied}, удалено {deleted}')
 
     # 2. Выделение валидации из train
-    print('\n=== Выделение 10% валидации ===')
+    print(f'\n=== Выделение {ratio:.0%} валидации (seed={seed}) ===')
     split_val_set(
-        train_img_dir=Path('data/images/train/origin'),
-        train_lbl_dir=Path('data/labels/train/origin'),
-        val_img_dir=Path('data/images/val/origin'),
-        val_lbl_dir=Path('data/labels/val/origin'),
+        train_img_dir=SPLITS['train']['img'],
+        train_lbl_dir=SPLITS['train']['lbl'],
+        val_img_dir=VAL_IMG_DIR,
+        val_lbl_dir=VAL_LBL_DIR,
         val_txt=Path('data/val.txt'),
         train_txt=Path('data/train.txt'),
-        ratio=0.1
+        ratio=ratio,
+        seed=seed,
+        listed=_listed_names(SPLITS['train']['txt'])
     )
 
+def main():
+    organize()
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
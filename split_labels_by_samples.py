@@ -5,10 +5,14 @@
 
 from __future__ import annotations
 
+import shutil
 import sys
 from pathlib import Path
 
-import cv2  # ← OpenCV уже используется в проекте
+# общий модуль геометрии нарезки лежит в APPLICATION/common
+sys.path.insert(0, str(Path(__file__).resolve().parent / "APPLICATION"))
+from common.imagesize import SizeCache  # noqa: E402
+from common.tiling import TilePlan, plan_tiles  # noqa: E402
 
 # ─────────── Настройки  ────────────────────────────────────────────────────
 SPLITS = ("train", "val", "test")
@@ -16,13 +20,7 @@ SPLITS = ("train", "val", "test")
 ROOT_IMG = Path("data/images")
 ROOT_LBL = Path("data/labels")
 DST_SUBDIR = "samples"            # куда складываем новые .txt
-
-# (width, height) → количество тайлов по горизонтали
-SIZE_MAP: dict[tuple[int, int], int] = {
-    (31920, 1152): 28,
-    (30780, 1152): 27,
-    (18144, 1142): 16,
-}
+SIZE_CACHE = Path("data/.image_sizes.json")  # размеры панорам между запусками
 # ───────────────────────────────────────────────────────────────────────────
 
 
@@ -56,19 +54,18 @@ def parse_yolo_line(line: str, file_name: str, line_num: int) -> tuple[int, floa
 
 
 def split_labels(lbl_path: Path,
-                 img_size: tuple[int, int],
-                 tiles_in_row: int,
+                 plan: TilePlan,
                  dest_root: Path) -> None:
     """
-    Разрезает один .txt с YOLO-разметкой на tiles_in_row кусочков
+    Разрезает один .txt с YOLO-разметкой на plan.count кусочков
     и сохраняет результат в dest_root/<имя_панорамы>/01.txt … NN.txt
     """
-    pano_w, pano_h = img_size
-    tile_w = pano_w / tiles_in_row               # float, но без остатка
+    pano_w, pano_h = plan.width, plan.height
+    tile_w = plan.tile_width
     tile_h = pano_h
 
     # Буферы строк разметки для каждого тайла
-    buffers: list[list[str]] = [[] for _ in range(tiles_in_row)]
+    buffers: list[list[str]] = [[] for _ in range(plan.count)]
 
     # Читаем и обрабатываем каждую строку
     for idx, raw_line in enumerate(lbl_path.read_text(encoding="utf-8").splitlines(), start=1):
@@ -86,17 +83,11 @@ def split_labels(lbl_path: Path,
         x1, y1 = cx - box_w / 2, cy - box_h / 2
         x2, y2 = cx + box_w / 2, cy + box_h / 2
 
-        # Номера тайлов, которые пересекает bbox
-        first_tile = int(x1 // tile_w)
-        last_tile = int(x2 // tile_w)
-
-        for tile_idx in range(first_tile, last_tile + 1):
-            if not (0 <= tile_idx < tiles_in_row):
-                # bbox слегка «выглядывает» за панораму — игнорируем часть вне неё
-                continue
-
-            t_left = tile_idx * tile_w
+        # Тайлы, которые пересекает bbox (часть вне панорамы игнорируем)
+        for tile_idx, t_left in enumerate(plan.offsets):
             t_right = t_left + tile_w
+            if x2 < t_left or x1 >= t_right:
+                continue
 
             # Пересечение bbox с тайлом
             ix1 = clip(x1, t_left, t_right)
@@ -123,19 +114,30 @@ def split_labels(lbl_path: Path,
     dest_dir = dest_root / pano_name
     dest_dir.mkdir(parents=True, exist_ok=True)
 
+    # Файлы с тем же содержимым не перезаписываются (их mtime — сигнал для
+    # инкрементальной сборки build_dataset.py), файлы опустевших тайлов удаляются
     created = 0
+    keep = set()
     for i, rows in enumerate(buffers, start=1):
         if not rows:
             continue
-        (dest_dir / f"{i:02d}.txt").write_text("\n".join(rows))
+        out = dest_dir / f"{i:02d}.txt"
+        text = "\n".join(rows)
+        if not out.exists() or out.read_text() != text:
+            out.write_text(text)
+        keep.add(out.name)
         created += 1
+    for old in dest_dir.glob("*.txt"):
+        if old.name not in keep:
+            old.unlink()
 
     print(f"✓ {lbl_path.name}: создано {created} файлов")
 
 
-def process_split(split: str) -> None:
+def process_split(split: str, sizes: SizeCache) -> None:
     """
-    Обрабатывает один из наборов (train / val / test).
+    Обрабатывает один из наборов (train / val / test). Размер панорамы
+    берётся из заголовка PNG (common.imagesize), пиксели не декодируются.
     """
     src_lbl_dir = ROOT_LBL / split / "origin"
     src_img_dir = ROOT_IMG / split / "origin"
@@ -149,25 +151,27 @@ def process_split(split: str) -> None:
 
     print(f"\n=== {split.upper()} ===  найдено {len(lbl_files)} файлов разметки")
 
+    # Разметка панорам, ушедших из сплита (например, в val), удаляется
+    stems = {p.stem for p in lbl_files}
+    for old in dst_lbl_root.iterdir():
+        if old.is_dir() and old.name not in stems:
+            shutil.rmtree(old)
+            print(f"✗ {old.name}: разметки нет в {src_lbl_dir}, тайлы удалены")
+
     for lbl_path in lbl_files:
         img_path = src_img_dir / f"{lbl_path.stem}.png"
         if not img_path.exists():
             print(f"⚠️  {lbl_path.stem}: нет исходного PNG, пропуск")
             continue
 
-        # Определяем размер и количество тайлов
-        img = cv2.imread(str(img_path), cv2.IMREAD_UNCHANGED)
-        if img is None:
+        # Определяем размер и план нарезки
+        try:
+            w, h = sizes.get(img_path)
+        except ValueError:
             print(f"❌ Не удалось открыть {img_path}")
             continue
 
-        h, w = img.shape[:2]
-        tiles = SIZE_MAP.get((w, h))
-        if tiles is None:
-            print(f"⚠️  {lbl_path.name}: неизвестный размер {w}×{h}, пропуск")
-            continue
-
-        split_labels(lbl_path, (w, h), tiles, dst_lbl_root)
+        split_labels(lbl_path, plan_tiles(w, h), dst_lbl_root)
 
 
 def main() -> None:
@@ -186,8 +190,9 @@ def main() -> None:
     else:
         splits = SPLITS
 
-    for sp in splits:
-        process_split(sp)
+    with SizeCache(SIZE_CACHE) as sizes:
+        for sp in splits:
+            process_split(sp, sizes)
 
 
 if __name__ == "__main__":
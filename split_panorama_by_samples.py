@@ -1,65 +1,140 @@
 # split_panorama_by_samples.py
+#
+# Нарезает origin-панорамы на сэмплы по плану common.tiling.
+# Панорамы режутся в пуле процессов (--jobs). Уже нарезанные панорамы
+# пропускаются по манифесту <split>/samples/manifest.json: в нём для
+# каждой панорамы хранятся sha256 исходника, число тайлов и формат.
+# Повторный запуск после добавления новых плёнок режет только их.
 
 from __future__ import annotations
 
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import cv2
 import sys
 
+# общий модуль геометрии нарезки лежит в APPLICATION/common
+sys.path.insert(0, str(Path(__file__).resolve().parent / "APPLICATION"))
+from common.tiling import plan_tiles  # noqa: E402
+
 # --- настройки ---------------------------------------------------------------
 
 SPLITS = ("train", "val", "test")
 SRC_FOLDER = Path("data/images")     # корень с origin-изображениями
 DST_SUBDIR = "samples"              # куда класть результат
+MANIFEST = "manifest.json"          # манифест нарезки в <split>/samples
 
-# Карта «размер панорамы  → количество тайлов»
-# (width, height) : tiles_in_row
-SIZE_MAP: dict[tuple[int, int], int] = {
-    (31920, 1152): 28,
-    (30780, 1152): 27,
-    (18144, 1142): 16,
-}
+TILE_NAME = re.compile(r"^\d{2,}\.(png|webp)$")
 
 # -----------------------------------------------------------------------------
 
-def slice_panorama(pano_path: Path, out_root: Path) -> None:
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_params(fmt: str, png_compression: int | None) -> list[int]:
+    """Параметры cv2.imwrite: сжатие PNG 0–9 или WebP без потерь."""
+    if fmt == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, 101]      # > 100 — lossless
+    if png_compression is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    return []
+
+
+def tiles_fresh(dest_dir: Path, entry: dict, source_mtime_ns: int) -> bool:
+    """Все тайлы из манифеста на месте и не старше исходника."""
+    for i in range(1, entry["tiles"] + 1):
+        try:
+            if (dest_dir / f"{i:02d}.{entry['format']}").stat().st_mtime_ns < source_mtime_ns:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def slice_panorama(pano_path: Path,
+                   out_root: Path,
+                   fmt: str = "png",
+                   png_compression: int | None = None,
+                   known: dict | None = None) -> tuple[dict | None, str]:
     """
-    Нарезает панораму согласно SIZE_MAP и сохраняет
-    в out_root/<имя панорамы>/<01..N>.png
+    Нарезает панораму согласно плану common.tiling и сохраняет
+    в out_root/<имя панорамы>/<01..N>.png (или .webp).
+
+    known — запись манифеста с прошлого запуска: если sha256 исходника
+    совпал и тайлы на месте, панорама не декодируется.
+
+    Returns:
+        tuple: (запись манифеста или None при ошибке, строка для лога)
     """
+    st = pano_path.stat()
+    digest = file_sha256(pano_path)
+    dest_dir = out_root / pano_path.stem
+    settings = {"format": fmt, "png_compression": png_compression if fmt == "png" else None}
+    entry = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns, **settings}
+
+    if (known is not None and known["sha256"] == digest
+            and all(known.get(k) == v for k, v in settings.items())
+            and tiles_fresh(dest_dir, known, 0)):
+        # Исходник только «потрогали»: содержимое то же, тайлы помечаем
+        # свежими, чтобы следующий запуск обошёлся без хэширования
+        for i in range(1, known["tiles"] + 1):
+            os.utime(dest_dir / f"{i:02d}.{fmt}")
+        return {**known, **entry}, f"= {pano_path.name}: не изменилась"
+
     img = cv2.imread(str(pano_path), cv2.IMREAD_UNCHANGED)
     if img is None:
-        print(f"❌ Не удалось открыть {pano_path}")
-        return
+        return None, f"❌ Не удалось открыть {pano_path}"
 
     h, w = img.shape[:2]
-    tiles_in_row = SIZE_MAP.get((w, h))
-    if tiles_in_row is None:
-        print(f"⚠️  Пропуск {pano_path.name}: неизвестный размер {w}×{h}")
-        return
-
-    tile_w = w // tiles_in_row  # ширина одного тайла
-    if w % tiles_in_row:
-        # теоретически не должно случиться, но проверим
-        print(f"⚠️  {pano_path.name}: {w} не делится на {tiles_in_row}")
-        return
+    plan = plan_tiles(w, h)
 
-    pano_name = pano_path.stem
-    dest_dir = out_root / pano_name
     dest_dir.mkdir(parents=True, exist_ok=True)
 
-    for i in range(tiles_in_row):
-        left = i * tile_w
-        right = left + tile_w
-        tile = img[:, left:right]          # нарезаем по ширине, высоту берём всю
-        out_fn = dest_dir / f"{i+1:02d}.png"
-        cv2.imwrite(str(out_fn), tile)
+    params = encode_params(fmt, png_compression)
+    written = set()
+    for i, cols in enumerate(plan.slices):
+        tile = img[:, cols]                # нарезаем по ширине, высоту берём всю
+        out_fn = dest_dir / f"{i+1:02d}.{fmt}"
+        cv2.imwrite(str(out_fn), tile, params)
+        written.add(out_fn.name)
+
+    # Тайлы прежней нарезки (другой план или формат) удаляем
+    for old in dest_dir.iterdir():
+        if TILE_NAME.match(old.name) and old.name not in written:
+            old.unlink()
+
+    entry["tiles"] = plan.count
+    return entry, (f"✓ {pano_path.name}: сохранено {plan.count} сэмплов "
+                   f"({plan.tile_width}×{h}, перекрытие {plan.overlap}px) "
+                   f"в {dest_dir.relative_to(out_root.parent)}")
 
-    print(f"✓ {pano_path.name}: сохранено {tiles_in_row} сэмплов "
-          f"({tile_w}×{h}) в {dest_dir.relative_to(out_root.parent)}")
 
+def load_manifest(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
 
-def process_split(split: str) -> None:
+
+def save_manifest(path: Path, manifest: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def process_split(split: str, jobs: int, fmt: str, png_compression: int | None, force: bool) -> None:
     """
     Обрабатывает один из наборов: train, val или test.
     Ищет панорамы в data/images/<split>/origin/*
@@ -73,25 +148,70 @@ def process_split(split: str) -> None:
         print(f"⚠️  В {src_dir} не найдено .png-панорам")
         return
 
-    print(f"\n=== {split.upper()} ===  найдено {len(pano_files)} панорам")
+    manifest_path = dst_root / MANIFEST
+    manifest = {} if force else load_manifest(manifest_path)
+    settings = {"format": fmt, "png_compression": png_compression if fmt == "png" else None}
+
+    # Панорамы, ушедшие из origin (например, перенесённые в val), — вместе с тайлами
+    present = {p.name for p in pano_files}
+    for name in [name for name in manifest if name not in present]:
+        shutil.rmtree(dst_root / Path(name).stem, ignore_errors=True)
+        del manifest[name]
+        save_manifest(manifest_path, manifest)
+        print(f"✗ {name}: нет в {src_dir}, тайлы удалены")
+
+    # Быстрая проверка без чтения исходника: размер, mtime, настройки и тайлы
+    todo = []
     for pano_path in pano_files:
-        slice_panorama(pano_path, dst_root)
+        entry = manifest.get(pano_path.name)
+        st = pano_path.stat()
+        if (entry is not None and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+                and all(entry.get(k) == v for k, v in settings.items())
+                and tiles_fresh(dst_root / pano_path.stem, entry, st.st_mtime_ns)):
+            continue
+        todo.append((pano_path, entry))
+
+    print(f"\n=== {split.upper()} ===  найдено {len(pano_files)} панорам, к нарезке {len(todo)}")
+    if not todo:
+        return
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max(1, min(jobs, len(todo)))) as pool:
+        futures = {
+            pool.submit(slice_panorama, pano_path, dst_root, fmt, png_compression, entry): pano_path
+            for pano_path, entry in todo
+        }
+        for future in as_completed(futures):
+            entry, message = future.result()
+            print(message)
+            if entry is not None:
+                manifest[futures[future].name] = entry
+                # Манифест пишется после каждой панорамы: прерванный запуск
+                # продолжится с того же места
+                save_manifest(manifest_path, manifest)
+
+    elapsed = time.perf_counter() - start
+    print(f"{split}: {len(todo)} панорам за {elapsed:.1f} с ({len(todo) / elapsed:.2f} пан/с)")
 
 
 def main() -> None:
-    args = sys.argv[1:]
-    if args:
-        # пользователь указал конкретные сплиты
-        for sp in args:
-            if sp not in SPLITS:
-                print(f"Неверный split: {sp}. Допустимы {SPLITS}")
-                return
-            process_split(sp)
-    else:
-        # обрабатываем все train/val/test
-        for sp in SPLITS:
-            process_split(sp)
+    ap = argparse.ArgumentParser(description="Нарезка origin-панорам на сэмплы")
+    ap.add_argument("splits", nargs="*", help=f"Сплиты из {SPLITS} (по умолчанию все)")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Процессов нарезки")
+    ap.add_argument("--format", choices=("png", "webp"), default="png", help="webp — без потерь")
+    ap.add_argument("--png-compression", type=int, choices=range(10), default=None,
+                    metavar="0-9", help="Уровень сжатия PNG (по умолчанию — OpenCV)")
+    ap.add_argument("--force", action="store_true", help="Нарезать всё заново, не глядя в манифест")
+    args = ap.parse_args()
+
+    for sp in args.splits:
+        if sp not in SPLITS:
+            print(f"Неверный split: {sp}. Допустимы {SPLITS}")
+            return
+
+    for sp in args.splits or SPLITS:
+        process_split(sp, args.jobs, args.format, args.png_compression, args.force)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,206 @@
+"""
+train_gate.py — обучение каскадного гейта «есть дефект / нет дефекта»,
+который стоит перед YOLO-детектором в ML-сервисе.
+
+Позитивы и негативы берутся из уже нарезанных тайлов:
+    data/images/<split>/samples/<панорама>/NN.png
+    data/labels/<split>/samples/<панорама>/NN.txt   (нет файла или пустой → негатив)
+
+Тайлы уменьшаются до --imgsz и раскладываются в ImageFolder-структуру
+data/gate/<split>/{clean,defect}/, после чего обучается YOLO-классификатор.
+Затем на val подбирается порог под целевой recall и считается, какую долю
+тайлов гейт отсекает и сколько времени это экономит.
+
+Пример запуска:
+    python train_gate.py \
+        --model yolov8n-cls.pt \
+        --imgsz 128 \
+        --epochs 20 \
+        --device cpu \
+        --target-recall 0.99 \
+        --detector APPLICATION/app/weights/best.pt
+
+Для ML-сервиса:
+    GATE_WEIGHTS=runs/classify/gate/weights/best.pt  (порог берётся из gate.json рядом)
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from train_yolo import ensure_ultralytics
+
+SPLITS = ("train", "val")
+CLASSES = ("clean", "defect")
+
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Training script for the defect/no-defect cascade gate")
+    ap.add_argument("--images-root", type=Path, default=Path("data/images"),
+                    help="Корень с data/images/<split>/samples")
+    ap.add_argument("--labels-root", type=Path, default=Path("data/labels"),
+                    help="Корень с data/labels/<split>/samples")
+    ap.add_argument("--out", type=Path, default=Path("data/gate"),
+                    help="Куда сложить уменьшенные тайлы для классификатора")
+    ap.add_argument("--model", default="yolov8n-cls.pt",
+                    help="Базовая модель-классификатор")
+    ap.add_argument("--imgsz", type=int, default=128,
+                    help="Размер входа гейта (тайл уменьшается до imgsz×imgsz)")
+    ap.add_argument("--epochs", type=int, default=20)
+    ap.add_argument("--batch", type=int, default=64)
+    ap.add_argument("--device", default="0",
+                    help="GPU id или 'cpu'")
+    ap.add_argument("--name", default="gate",
+                    help="Имя эксперимента (папка в runs/classify/)")
+    ap.add_argument("--target-recall", type=float, default=0.99,
+                    help="Какую долю тайлов с дефектами гейт обязан пропустить")
+    ap.add_argument("--detector", type=Path, default=None,
+                    help="Веса детектора для оценки сэкономленного времени")
+    return ap.parse_args()
+
+
+def collect_tiles(images_root: Path, labels_root: Path, split: str) -> list[tuple[Path, int]]:
+    """Список (путь к тайлу, 1 если в разметке есть объекты, иначе 0)."""
+    items = []
+    for img_path in sorted((images_root / split / "samples").glob("*/*.png")):
+        lbl_path = labels_root / split / "samples" / img_path.parent.name / f"{img_path.stem}.txt"
+        positive = lbl_path.exists() and lbl_path.read_text(encoding="utf-8").strip() != ""
+        items.append((img_path, int(positive)))
+    return items
+
+
+def build_dataset(items: list[tuple[Path, int]], split_dir: Path, imgsz: int) -> list[tuple[Path, int]]:
+    """
+    Уменьшает тайлы в split_dir/<clean|defect>/<панорама>_NN.png.
+    Уже существующие файлы не пересоздаются.
+    """
+    for cls in CLASSES:
+        (split_dir / cls).mkdir(parents=True, exist_ok=True)
+
+    out = []
+    for img_path, label in items:
+        dst = split_dir / CLASSES[label] / f"{img_path.parent.name}_{img_path.stem}.png"
+        if not dst.exists():
+            img = cv2.imread(str(img_path))
+            if img is None:
+                print(f"⚠️  Не удалось открыть {img_path}, пропуск")
+                continue
+            cv2.imwrite(str(dst), cv2.resize(img, (imgsz, imgsz), interpolation=cv2.INTER_AREA))
+        out.append((dst, label))
+    return out
+
+
+def tune_threshold(scores: np.ndarray, labels: np.ndarray, target_recall: float) -> float:
+    """Максимальный порог, при котором recall по позитивам не ниже целевого."""
+    pos = np.sort(scores[labels == 1])
+    if len(pos) == 0:
+        return 0.5
+    allowed_misses = int(np.floor((1.0 - target_recall) * len(pos)))
+    return float(pos[allowed_misses])
+
+
+def score_tiles(model, paths: list[Path], imgsz: int, defect_idx: int, batch: int) -> tuple[np.ndarray, float]:
+    """Оценки гейта для тайлов и среднее время на тайл, мс."""
+    scores = []
+    started = time.perf_counter()
+    for i in range(0, len(paths), batch):
+        chunk = [str(p) for p in paths[i:i + batch]]
+        for res in model.predict(chunk, imgsz=imgsz, verbose=False):
+            scores.append(float(res.probs.data[defect_idx]))
+    elapsed = time.perf_counter() - started
+    return np.array(scores), elapsed / max(1, len(paths)) * 1000
+
+
+def detector_latency(weights: Path, items: list[tuple[Path, int]], n: int = 20) -> float:
+    """Среднее время полного детектора на тайл исходного разрешения, мс."""
+    from ultralytics import YOLO
+
+    detector = YOLO(str(weights))
+    tiles = [cv2.imread(str(p)) for p, _ in items[:n]]
+    detector.predict(tiles[0], verbose=False)  # прогрев
+    started = time.perf_counter()
+    for tile in tiles:
+        detector.predict(tile, verbose=False)
+    return (time.perf_counter() - started) / len(tiles) * 1000
+
+
+def main() -> None:
+    args = parse_args()
+    ensure_ultralytics()
+
+    from ultralytics import YOLO  # импорт только после проверки
+
+    # 1. Сбор тайлов и уменьшенная копия в ImageFolder-структуре
+    raw: dict[str, list[tuple[Path, int]]] = {}
+    gate_items: dict[str, list[tuple[Path, int]]] = {}
+    for split in SPLITS:
+        raw[split] = collect_tiles(args.images_root, args.labels_root, split)
+        if not raw[split]:
+            raise SystemExit(f"Нет тайлов в {args.images_root / split / 'samples'}")
+        gate_items[split] = build_dataset(raw[split], args.out / split, args.imgsz)
+        n_pos = sum(label for _, label in gate_items[split])
+        print(f"{split}: {len(gate_items[split])} тайлов, из них с дефектами {n_pos}")
+
+    # 2. Обучение классификатора
+    model = YOLO(args.model)
+    print("\n🚀 Старт обучения гейта ...\n")
+    model.train(
+        data=str(args.out),
+        epochs=args.epochs,
+        imgsz=args.imgsz,
+        batch=args.batch,
+        device=args.device,
+        name=args.name,
+    )
+    weights = Path(model.trainer.save_dir) / "weights" / "best.pt"
+
+    # 3. Подбор порога под целевой recall на val
+    gate = YOLO(str(weights), task="classify")
+    defect_idx = {name: idx for idx, name in gate.names.items()}["defect"]
+    val_paths = [p for p, _ in gate_items["val"]]
+    labels = np.array([label for _, label in gate_items["val"]])
+    scores, gate_ms = score_tiles(gate, val_paths, args.imgsz, defect_idx, args.batch)
+
+    threshold = tune_threshold(scores, labels, args.target_recall)
+    passed = scores >= threshold
+    recall = float(passed[labels == 1].mean()) if (labels == 1).any() else 1.0
+    skip_rate = float(1.0 - passed.mean())
+
+    report = {
+        "threshold": threshold,
+        "imgsz": args.imgsz,
+        "target_recall": args.target_recall,
+        "recall": recall,
+        "skip_rate": skip_rate,
+        "val_tiles": int(len(labels)),
+        "val_positives": int(labels.sum()),
+        "gate_ms": gate_ms,
+    }
+
+    # 4. Оценка сэкономленного времени: гейт на каждом тайле + детектор на прошедших
+    if args.detector:
+        det_ms = detector_latency(args.detector, raw["val"])
+        cascade_ms = gate_ms + (1.0 - skip_rate) * det_ms
+        report["detector_ms"] = det_ms
+        report["cascade_ms"] = cascade_ms
+        report["saved_compute"] = 1.0 - cascade_ms / det_ms
+
+    (weights.parent / "gate.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    print("\n✅ Обучение гейта завершено.")
+    print(f"   Веса: {weights}")
+    print(f"   Порог: {threshold:.4f} (целевой recall {args.target_recall:.3f})")
+    print(f"   Recall на val: {recall:.4f}")
+    print(f"   Отсекается тайлов: {skip_rate:.1%}")
+    if "saved_compute" in report:
+        print(f"   Время на тайл: {report['detector_ms']:.1f} мс → {report['cascade_ms']:.1f} мс "
+              f"(экономия {report['saved_compute']:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,13 +14,16 @@ import argparse
 from pathlib import Path
 from typing import List
 
+# Форматы сэмплов split_panorama_by_samples.py (--format)
+SAMPLE_SUFFIXES = (".png", ".webp")
+
 
 def collect_sample_paths(origin_path: Path,
                          origin_dir_name: str = "origin",
                          samples_dir_name: str = "samples") -> List[Path]:
     """
     origin_path: .../<split>/origin/<file>.png
-    вернёт      : список .../<split>/samples/<file>/<*.png>
+    вернёт      : список .../<split>/samples/<file>/<*.png|*.webp>
     """
     if origin_dir_name not in origin_path.parts:
         return []  # на всякий — строка не из origin
@@ -29,7 +32,9 @@ def collect_sample_paths(origin_path: Path,
     # /.../<split>/samples/<file-stem>/
     sample_dir = Path(*origin_path.parts[:idx]) / samples_dir_name / origin_path.stem
     # glob внутри каталога
-    return sorted(sample_dir.glob("*.png"))
+    if not sample_dir.is_dir():
+        return []
+    return sorted(p for p in sample_dir.iterdir() if p.suffix in SAMPLE_SUFFIXES)
 
 
 def process_txt(txt_path: Path,
@@ -56,6 +61,23 @@ def process_txt(txt_path: Path,
     return lines_out
 
 
+def update_lists(lists_dir: Path, old_root: str, new_root: str) -> None:
+    """
+    <split>.txt → <split>_samples.txt для train/val/test. Файл с тем же
+    содержимым не перезаписывается.
+    """
+    for name in ("train", "val", "test"):
+        src = lists_dir / f"{name}.txt"
+        if not src.exists():
+            continue
+        dst = lists_dir / f"{name}_samples.txt"
+        new_lines = process_txt(src, old_root, new_root)
+        text = "\n".join(new_lines)
+        if not dst.exists() or dst.read_text() != text:
+            dst.write_text(text)
+        print(f"{dst}  ←  {len(new_lines)} строк")
+
+
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--lists-dir", default=".", type=Path,
@@ -66,14 +88,7 @@ def main() -> None:
                     help="чем заменить old-root")
     args = ap.parse_args()
 
-    for name in ("train", "val", "test"):
-        src = args.lists_dir / f"{name}.txt"
-        if not src.exists():
-            continue
-        dst = args.lists_dir / f"{name}_samples.txt"
-        new_lines = process_txt(src, args.old_root, args.new_root)
-        dst.write_text("\n".join(new_lines))
-        print(f"{dst}  ←  {len(new_lines)} строк")
+    update_lists(args.lists_dir, args.old_root, args.new_root)
 
 
 if __name__ == "__main__":
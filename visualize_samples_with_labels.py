@@ -7,6 +7,7 @@ python visualize_samples_with_labels.py data/images/val/samples/0-691-ls-14-d03
 
 from __future__ import annotations
 import argparse
+import sys
 from pathlib import Path
 import cv2
 import numpy as np
@@ -16,12 +17,10 @@ import matplotlib.pyplot as plt
 import yaml
 from matplotlib import font_manager as fm
 
-# ─── карта «размер панорамы → количество тайлов» ───────────────────────────
-SIZE_MAP = {
-    (31920, 1152): 28,
-    (30780, 1152): 27,
-    (18144, 1142): 16,
-}
+# ─── геометрия нарезки — общий модуль APPLICATION/common ───────────────────
+sys.path.insert(0, str(Path(__file__).resolve().parent / "APPLICATION"))
+from common.tiling import TilePlan, plan_tiles, tile_views  # noqa: E402
+from common.tiling import join_tiles as _join_planned       # noqa: E402
 # ───────────────────────────────────────────────────────────────────────────
 
 # ─── попытка подобрать шрифт с поддержкой Юникода ──────────────────────────
@@ -46,16 +45,15 @@ def get_text_size(draw: ImageDraw.ImageDraw, txt: str) -> tuple[int, int]:
         return x1 - x0, y1 - y0
     return FONT.getsize(txt)                     # старые Pillow
 
-def slice_panorama(img: np.ndarray) -> list[np.ndarray]:
+def slice_panorama(img: np.ndarray) -> tuple[list[np.ndarray], TilePlan]:
     h, w = img.shape[:2]
-    tiles = SIZE_MAP.get((w, h))
-    if tiles is None:
-        raise SystemExit(f"Неизвестный размер панорамы {w}×{h}")
-    tw = w // tiles
-    return [img[:, i * tw:(i + 1) * tw] for i in range(tiles)]
+    plan = plan_tiles(w, h)
+    return tile_views(img, plan), plan
 
-def join_tiles(tiles: list[np.ndarray]) -> np.ndarray:
-    return np.concatenate(tiles, axis=1)
+def join_tiles(tiles: list[np.ndarray], plan: TilePlan | None = None) -> np.ndarray:
+    if plan is None:                             # отдельные тайлы из директории
+        return np.concatenate(tiles, axis=1)
+    return _join_planned(tiles, plan)
 
 # ─── отрисовка результата на одном тайле ───────────────────────────────────
 def draw_preds(tile_bgr: np.ndarray,
@@ -138,12 +136,13 @@ def main():
         if not paths:
             raise SystemExit(f"Нет .png в {args.input}")
         tiles_bgr = [cv2.imread(str(p)) for p in paths]
+        plan      = None
         out_path  = None
     else:
         pano_bgr = cv2.imread(str(args.input))
         if pano_bgr is None:
             raise SystemExit(f"Не удалось открыть {args.input}")
-        tiles_bgr = slice_panorama(pano_bgr)
+        tiles_bgr, plan = slice_panorama(pano_bgr)
         out_path  = args.input.with_name(args.input.stem + "_pred.png")
 
     # —  инференс + отрисовка на каждом тайле  —
@@ -155,7 +154,7 @@ def main():
         )
 
     # —  склейка и показ  —
-    pano_rgb = join_tiles(processed)
+    pano_rgb = join_tiles(processed, plan)
     h, w = pano_rgb.shape[:2]
     dpi = 100
     plt.figure(figsize=(w / dpi, h / dpi), dpi=dpi)